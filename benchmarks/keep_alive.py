@@ -0,0 +1,94 @@
+"""
+Compare loop wakeups and CPU time of per-hub keep_alive tasks against a shared KeepAliveScheduler.
+
+The hubs are not connected to anything: a fake writer echoes every handshake by updating the
+liveness timestamp. The keep-alive interval is scaled down so a few rounds run in seconds.
+
+    PYTHONPATH=. python benchmarks/keep_alive.py --hubs 1000 --interval 1 --duration 5
+"""
+import argparse
+import asyncio
+import time
+
+from pynobo import KeepAliveScheduler, nobo
+
+
+class CountingLoop(asyncio.SelectorEventLoop):
+    """Event loop counting timers, i.e. wakeups scheduled by asyncio.sleep and call_at/call_later."""
+
+    timers = 0
+
+    def call_at(self, when, callback, *args, **kwargs):
+        self.timers += 1
+        return super().call_at(when, callback, *args, **kwargs)
+
+
+class EchoWriter:
+    """Minimal StreamWriter stand-in echoing handshakes back immediately."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.hub._last_recv_at = time.monotonic()
+
+    async def drain(self):
+        pass
+
+
+def make_hubs(count, scheduler=None):
+    hubs = []
+    for i in range(count):
+        hub = nobo(f'{i:012d}', ip='127.0.0.1', discover=False, synchronous=False, keep_alive_scheduler=scheduler)
+        hub._writer = EchoWriter(hub)
+        hubs.append(hub)
+    return hubs
+
+
+async def run_tasks(count, interval, duration):
+    hubs = make_hubs(count)
+    tasks = [asyncio.create_task(hub.keep_alive(interval=interval)) for hub in hubs]
+    await asyncio.sleep(duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return sum(hub._writer.writes for hub in hubs)
+
+
+async def run_scheduler(count, interval, duration):
+    scheduler = KeepAliveScheduler(interval=interval, resolution=interval / 20)
+    hubs = make_hubs(count, scheduler)
+    for hub in hubs:
+        scheduler.register(hub)
+    await asyncio.sleep(duration)
+    for hub in hubs:
+        scheduler.unregister(hub)
+    return sum(hub._writer.writes for hub in hubs)
+
+
+def measure(name, coroutine):
+    loop = CountingLoop()
+    try:
+        cpu = time.process_time()
+        handshakes = loop.run_until_complete(coroutine)
+        cpu = time.process_time() - cpu
+    finally:
+        loop.close()
+    print(f'{name:>10}: {loop.timers:8d} timer wakeups, {handshakes:8d} handshakes, {cpu:6.3f} s CPU')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hubs', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=1.0, help='keep-alive interval in seconds')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to run each strategy')
+    args = parser.parse_args()
+
+    measure('tasks', run_tasks(args.hubs, args.interval, args.duration))
+    measure('scheduler', run_scheduler(args.hubs, args.interval, args.duration))
+
+
+if __name__ == '__main__':
+    main()
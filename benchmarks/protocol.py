@@ -0,0 +1,64 @@
+"""
+Measure the cost of the protocol core alone: framing and state updates, with no I/O or event loop.
+
+A stream of initial data and temperature updates is encoded once, then fed to a HubProtocol in
+chunks like a socket would deliver them, and every response is applied to a nobo instance that
+is never started.
+
+    PYTHONPATH=. python benchmarks/protocol.py --updates 100000 --chunk 4096
+"""
+import argparse
+import time
+
+from pynobo import nobo
+from pynobo.protocol import HubProtocol, encode_command
+
+WEEK_PROFILE = ','.join(['00000', '06001', '08000', '15001', '23000'] * 7)
+
+
+def stream(serial, zones, components, updates):
+    responses = [['H00']]
+    responses += [['H01', str(zone), f'Zone {zone}', '1', '22', '16', '1', '-1'] for zone in range(1, zones + 1)]
+    responses += [['H02', f'186{component:09d}', '0', f'Heater {component}', '0', str(component % zones + 1), '-1', '-1']
+                  for component in range(components)]
+    responses += [['H03', '1', 'Default', WEEK_PROFILE], ['H05', serial, 'Hub', '0', '-1', '11123610_rev._1', '20180119', '20180119']]
+    responses += [['Y02', f'186{update % components:09d}', f'{18 + update % 60 / 10:.1f}'] for update in range(updates)]
+    return b''.join(encode_command(response) for response in responses), len(responses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--zones', type=int, default=10)
+    parser.add_argument('--components', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=100000, help='temperature updates after the initial data')
+    parser.add_argument('--chunk', type=int, default=4096, help='bytes fed at a time')
+    args = parser.parse_args()
+
+    serial = '102000022151'
+    data, count = stream(serial, args.zones, args.components, args.updates)
+    hub = nobo(serial, discover=False, synchronous=False)
+    protocol = HubProtocol(serial)
+
+    # Starting after the handshake, which is a single round trip
+    protocol.request_initial_data()
+    started = time.perf_counter()
+    framed = 0
+    for offset in range(0, len(data), args.chunk):
+        framed += len(protocol.receive_data(data[offset:offset + args.chunk]))
+    framing = time.perf_counter() - started
+
+    protocol = HubProtocol(serial)
+    protocol.request_initial_data()
+    started = time.perf_counter()
+    for offset in range(0, len(data), args.chunk):
+        for response in protocol.receive_data(data[offset:offset + args.chunk]):
+            hub.response_handler(response)
+    total = time.perf_counter() - started
+
+    assert framed == count and protocol.state == HubProtocol.CONNECTED
+    print(f'        framing: {framing:6.3f} s for {count} responses ({framing / count * 1e6:.2f} us per response)')
+    print(f'framing + state: {total:6.3f} s for {count} responses ({total / count * 1e6:.2f} us per response)')
+
+
+if __name__ == '__main__':
+    main()
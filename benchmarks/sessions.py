@@ -0,0 +1,102 @@
+"""
+Measure protocol and handler cost of many hub sessions in one process, without sockets.
+
+Every hub connects over a MemoryTransport to a simulated hub, which answers the handshake and
+initial data request, then pushes temperature updates once all hubs are connected. Time spent
+is pure pynobo protocol handling and asyncio scheduling.
+
+    PYTHONPATH=. python benchmarks/sessions.py --hubs 1000 --updates 100
+"""
+import argparse
+import asyncio
+import time
+
+from pynobo import MemoryTransport, nobo
+
+WEEK_PROFILE = ','.join(['00000', '06001', '08000', '15001', '23000'] * 7)
+
+
+def initial_data(serial, zones, components):
+    yield ['H00']
+    for zone in range(1, zones + 1):
+        yield ['H01', str(zone), f'Zone {zone}', '1', '22', '16', '1', '-1']
+    for component in range(components):
+        yield ['H02', f'186{component:09d}', '0', f'Heater {component}', '0', str(component % zones + 1), '-1', '-1']
+    yield ['H03', '1', 'Default', WEEK_PROFILE]
+    yield ['H05', serial, 'Hub', '0', '-1', '11123610_rev._1', '20180119', '20180119']
+
+
+def simulated_hub(serial, zones, components, updates, push, done):
+    async def handle(reader, writer):
+        def send(response):
+            writer.write(' '.join(response).encode('utf-8') + b'\r')
+
+        while True:
+            try:
+                command = (await reader.readuntil(b'\r'))[:-1].decode('utf-8').split(' ')
+            except asyncio.IncompleteReadError:
+                return
+            if command[0] == nobo.API.START:
+                send([nobo.API.START, nobo.API.VERSION])
+            elif command[0] == nobo.API.HANDSHAKE:
+                send([nobo.API.HANDSHAKE])
+            elif command[0] == nobo.API.GET_ALL_INFO:
+                for response in initial_data(serial, zones, components):
+                    send(response)
+                await writer.drain()
+                # Only push updates once every hub is connected, so they are timed apart from connecting
+                await push.wait()
+                for update in range(updates):
+                    send(['Y02', f'186{update % components:09d}', f'{18 + update % 60 / 10:.1f}'])
+                    if update % 10 == 9:
+                        await asyncio.sleep(0)
+                send(['Y02', f'186{0:09d}', 'done'])
+                done.release()
+    return handle
+
+
+async def run(hubs, zones, components, updates):
+    transport = MemoryTransport()
+    push = asyncio.Event()
+    done = asyncio.Semaphore(0)
+    serials = [f'102{i:09d}' for i in range(hubs)]
+    for i, serial in enumerate(serials):
+        transport.listen(f'10.{i // 65536}.{i // 256 % 256}.{i % 256}', simulated_hub(serial, zones, components, updates, push, done))
+    instances = [
+        nobo(serial, ip=f'10.{i // 65536}.{i // 256 % 256}.{i % 256}', discover=False, synchronous=False, transport=transport)
+        for i, serial in enumerate(serials)
+    ]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(hub.start() for hub in instances))
+    connected = time.perf_counter()
+    push.set()
+    for _ in instances:
+        await done.acquire()
+    # Let the receivers handle the last updates
+    while any(hub.temperatures.get(f'186{0:09d}') != 'done' for hub in instances):
+        await asyncio.sleep(0)
+    finished = time.perf_counter()
+    await asyncio.gather(*(hub.stop() for hub in instances))
+    return connected - started, finished - connected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hubs', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=10)
+    parser.add_argument('--components', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=100, help='temperature updates pushed per hub')
+    args = parser.parse_args()
+
+    cpu = time.process_time()
+    connect, receive = asyncio.run(run(args.hubs, args.zones, args.components, args.updates))
+    cpu = time.process_time() - cpu
+    messages = args.hubs * (args.updates + 1)
+    print(f'connect and initial load: {connect:6.3f} s for {args.hubs} hubs ({connect / args.hubs * 1e6:.0f} us per hub)')
+    print(f'       pushed responses: {receive:6.3f} s for {messages} responses ({receive / messages * 1e6:.1f} us per response)')
+    print(f'                    CPU: {cpu:6.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,41 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
 import collections
-from contextlib import suppress
+import concurrent.futures
+from contextlib import nullcontext, suppress
+import dataclasses
 import datetime
 import errno
+import heapq
+import ipaddress
+import itertools
+import json
 import logging
+import math
 import threading
 import time
+import types
 import warnings
 import socket
-from typing import Any, Callable, Union
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Mapping, Union
+import weakref
+
+from . import const
+from .exceptions import (
+    PynoboConnectionError,
+    PynoboError,
+    PynoboHandshakeError,
+    PynoboHubError,
+    PynoboTimeoutError,
+    PynoboValidationError,
+)
+from .protocol import SEPARATOR, HubProtocol, decode_response, encode_command
+from .transport import HUB_PORT, MemoryTransport, TcpTransport, Transport
+
+if TYPE_CHECKING:
+    from .journal import Journal
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -30,26 +55,88 @@ RECONNECT_ERRORS = [
 RECONNECT_INITIAL_DELAY = 10
 RECONNECT_MAX_DELAY = 60
 
+# When several hubs are discovered, connection attempts are raced: a new attempt is
+# started every CONNECT_STAGGER_DELAY seconds (or as soon as the previous one fails).
+CONNECT_STAGGER_DELAY = 0.25
 
-class PynoboError(Exception):
-    """Base class for all pynobo errors."""
+# Default seconds to wait for the hub to acknowledge a command.
+COMMAND_TIMEOUT = 5
 
+# Seconds to wait for the next response while loading the initial data, however long the load takes in total.
+INITIAL_DATA_IDLE_TIMEOUT = 5
 
-class PynoboConnectionError(PynoboError, OSError):
-    """Raised when the TCP connection to the hub fails or is lost.
+# Keep-alive round trips: number of recent samples kept, and the bucket upper bounds in seconds of nobo.rtt_histogram()
+RTT_SAMPLES = 128
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Min seconds to wait for the echo of a keep-alive, however fast the hub has been
+LIVENESS_MIN_TIMEOUT = 2
 
-    Also inherits OSError for back-compat: existing consumers that catch
-    OSError from asyncio.open_connection (e.g. Home Assistant's nobo_hub
-    rediscovery fallback) continue to work transparently.
-    """
+
+class _PendingCommand:
+    """A command waiting for the hub to echo it."""
+
+    __slots__ = ('opcode', 'key', 'future', 'span')
+
+    def __init__(self, opcode: str, key: Any, future: asyncio.Future[list[str]], span: Any = None) -> None:
+        self.opcode = opcode
+        self.key = key
+        self.future = future
+        # Tracing span from sending the command until it is acknowledged or fails
+        self.span = span
+
+
+class _Mutation:
+    """An optimistic change to a state record, saved before the hub has confirmed it."""
+
+    __slots__ = ('section', 'key', 'record', 'old', 'new')
+
+    def __init__(self, section: str, key: str, record: dict[str, Any], new: dict[str, Any]) -> None:
+        self.section = section
+        self.key = key
+        self.record = record
+        self.old = {field: record.get(field) for field in new}
+        self.new = new
+
+
+class _OverrideWindow:
+    """The target and parsed start and end time of an override, as time.time() timestamps."""
+
+    __slots__ = ('target_type', 'target_id', 'start', 'end')
+
+    def __init__(self, target_type: str, target_id: str, start: float | None, end: float | None) -> None:
+        self.target_type = target_type
+        self.target_id = target_id
+        self.start = start
+        self.end = end
+
+    def active(self, at: float) -> bool:
+        return (self.start is None or self.start <= at) and (self.end is None or at < self.end)
 
 
-class PynoboHandshakeError(PynoboError):
-    """Raised when the hub rejects the handshake (bad serial, wrong version)."""
+# All instances created with synchronous=True share one event loop running in a daemon thread.
+_sync_loop: asyncio.AbstractEventLoop | None = None
+_sync_thread: threading.Thread | None = None
+_sync_lock = threading.Lock()
 
 
-class PynoboValidationError(PynoboError, ValueError, TypeError):
-    """Raised for invalid parameters. Inherits ValueError and TypeError for back-compat."""
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    """Get the process-wide event loop for synchronous mode, starting its thread on first use."""
+    global _sync_loop, _sync_thread
+    with _sync_lock:
+        if _sync_loop is None or _sync_loop.is_closed():
+            _LOGGER.debug("Creating shared event loop and daemon thread")
+            _sync_loop = asyncio.new_event_loop()
+            _sync_thread = threading.Thread(target=_sync_loop.run_forever, name='pynobo', daemon=True)
+            _sync_thread.start()
+        return _sync_loop
+
+
+def _run_sync(coroutine: Any) -> Any:
+    """Run a coroutine on the shared event loop of synchronous mode, blocking until it is done."""
+    if threading.current_thread() is _sync_thread:
+        coroutine.close()
+        raise PynoboError('synchronous functions cannot be called from the event loop thread')
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_sync_loop()).result()
 
 
 class nobo:
@@ -61,11 +148,11 @@ class nobo:
         Some with sensible names, others not yet given better names.
         """
 
-        VERSION = '1.1'
+        VERSION = const.API_VERSION
 
-        START = 'HELLO'             #HELLO <version of command set> <Hub s.no.> <date and time in format 'yyyyMMddHHmmss'>
-        REJECT = 'REJECT'           #REJECT <reject code>
-        HANDSHAKE = 'HANDSHAKE'     #HANDSHAKE
+        START = const.HELLO         #HELLO <version of command set> <Hub s.no.> <date and time in format 'yyyyMMddHHmmss'>
+        REJECT = const.REJECT       #REJECT <reject code>
+        HANDSHAKE = const.HANDSHAKE #HANDSHAKE
 
         ADD_ZONE = 'A00'            # Adds Zone to hub database: A00 <Zone id> <Name> <Active week profile id> <Comfort temperature> <Eco temperature> <Allow overrides> <Active override id>
         ADD_COMPONENT = 'A01'       # Adds Component to hub database: A01 <Serial  number>  <Status> <Name> <Reverse on/off?> <Zoneld> <Active override Id> <Temperature sensor for zone>
@@ -111,7 +198,7 @@ class nobo:
         # HOI, zero or more H02, zero or more Y02, zero or more H03, zero or more H04 commands, one V06
         # message if <.:onne<.:ted v ia LAN (not Internet), and lastly a H05 message. 'll1e client  knows
         # that the Hub is tlnished  sending all info when it has received  the H05 mess3ge.
-        GET_ALL_INFO = 'G00'
+        GET_ALL_INFO = const.GET_ALL_INFO
 
         # (Never  used by the Nobo Energy  Control app- you should only use GOO.) Gets all Zones lrom hub.
         # Will trigger a series of H01 messages from the Hub.
@@ -134,7 +221,7 @@ class nobo:
         RESPONSE_COMPONENT_INFO = 'H02'     # Response with Component info, one per message: H02 <Serial number> <Status> <Name> <Reverse on/off?> <Zoneld> <Active override Id> <Temperature sensor for zone>
         RESPONSE_WEEK_PROFILE_INFO = 'H03'  # Response with Week Profile info, one per message: H03 <Week profile id> <Name> <Profile>
         RESPONSE_OVERRIDE_INFO = 'H04'      # Response with override info, one per message: H04 <Id> <Mode> <Type> <End time> <Start time> <Override target> <Override target ID>
-        RESPONSE_HUB_INFO = 'H05'           # G00 request complete signal + static info: H05 <Snr> <Name> <DefaultAwayOverrideLength> <ActiveOverrideid> <SoftwareVersion> <HardwareVersion> <ProductionDate>
+        RESPONSE_HUB_INFO = const.RESPONSE_HUB_INFO  # G00 request complete signal + static info: H05 <Snr> <Name> <DefaultAwayOverrideLength> <ActiveOverrideid> <SoftwareVersion> <HardwareVersion> <ProductionDate>
 
         EXECUTE_START_SEARCH = 'X00'
         EXECUTE_STOP_SEARCH = 'X01'
@@ -147,6 +234,23 @@ class nobo:
 
         RESPONSE_ERROR = 'E00'              # Other error messages than E00 may also be sent from the Hub (E01, E02 etc.): E00 <command> <message>
 
+        # The response echoed by the hub when a command has been executed
+        DICT_COMMAND_TO_RESPONSE = {
+            ADD_ZONE: RESPONSE_ADD_ZONE,
+            ADD_COMPONENT: RESPONSE_ADD_COMPONENT,
+            ADD_WEEK_PROFILE: RESPONSE_ADD_WEEK_PROFILE,
+            ADD_OVERRIDE: RESPONSE_ADD_OVERRIDE,
+            UPDATE_ZONE: RESPONSE_UPDATE_ZONE,
+            UPDATE_COMPONENT: RESPONSE_UPDATE_COMPONENT,
+            UPDATE_WEEK_PROFILE: RESPONSE_UPDATE_WEEK_PROFILE,
+            UPDATE_HUB_INFO: RESPONSE_UPDATE_HUB_INFO,
+            UPDATE_INTERNET_ACCESS: RESPONSE_UPDATE_INTERNET_ACCESS,
+            REMOVE_ZONE: RESPONSE_REMOVE_ZONE,
+            REMOVE_COMPONENT: RESPONSE_REMOVE_COMPONENT,
+            REMOVE_WEEK_PROFILE: RESPONSE_REMOVE_WEEK_PROFILE,
+        }
+        DICT_RESPONSE_TO_COMMAND = {response: command for command, response in DICT_COMMAND_TO_RESPONSE.items()}
+
         OVERRIDE_MODE_NORMAL = '0'
         OVERRIDE_MODE_COMFORT = '1'
         OVERRIDE_MODE_ECO = '2'
@@ -305,6 +409,18 @@ class nobo:
             """Return True if component has a temperature sensor."""
             return self._has_temp_sensor
 
+        def to_dict(self) -> dict[str, Any]:
+            """Return the model properties as a JSON compatible dictionary."""
+            return {
+                'model_id': self._model_id,
+                'type': self._type,
+                'name': self._name,
+                'supports_comfort': self._supports_comfort,
+                'supports_eco': self._supports_eco,
+                'requires_control_panel': self._requires_control_panel,
+                'has_temp_sensor': self._has_temp_sensor,
+            }
+
     MODELS = {
         "120": Model("120", Model.SWITCH, "RS 700"),
         "121": Model("121", Model.SWITCH, "RSX 700"),
@@ -369,6 +485,82 @@ class nobo:
                 if discover_ip and discover_serial:
                     self.hubs.add( (discover_ip, discover_serial) )
 
+    @dataclasses.dataclass(frozen=True)
+    class Snapshot:
+        """
+        Immutable view of the complete hub state, as returned by nobo.snapshot().
+
+        Sections and records that did not change between two snapshots are the same objects.
+        """
+
+        version: int
+        hub_info: Mapping[str, Any]
+        zones: Mapping[str, Mapping[str, Any]]
+        components: Mapping[str, Mapping[str, Any]]
+        week_profiles: Mapping[str, Mapping[str, Any]]
+        overrides: Mapping[str, Mapping[str, Any]]
+        temperatures: Mapping[str, str]
+
+    @dataclasses.dataclass(frozen=True)
+    class Event:
+        """
+        An update received from the hub, as delivered by nobo.events().
+
+        The kind tells what happened:
+
+        - response: a response from the hub, changing the state section and record key
+        - initial_data: a record of the initial data, as it is loaded when connecting
+        - zone_mode: the effective mode of a zone changed, also by the week profile, with
+          section zones, the zone id as key and an empty response
+        - override_activated, override_expired: the start or end time of an override passed,
+          with section overrides, the override id as key and an empty response
+        - rollback: a saved change was not confirmed by the hub and is rolled back, with the
+          section and key of the record, the rolled back fields as changed and an empty response
+
+        Responses that change nothing, like the hub repeating a record it has already sent, are
+        not published. The changed fields of the record are in `changed`, all of them for added
+        and removed records (None for responses that are not state records and for the kinds
+        without a response).
+        """
+
+        # State version after the update was applied
+        version: int
+        response: tuple[str, ...]
+        # The changed state section and record key, None if not applicable
+        section: str | None
+        key: str | None
+        kind: str = 'response'
+        changed: frozenset[str] | None = None
+
+    # The state section changed by each pushed response
+    _RESPONSE_SECTIONS = {
+        API.RESPONSE_ZONE_INFO: 'zones',
+        API.RESPONSE_ADD_ZONE: 'zones',
+        API.RESPONSE_UPDATE_ZONE: 'zones',
+        API.RESPONSE_REMOVE_ZONE: 'zones',
+        API.RESPONSE_COMPONENT_INFO: 'components',
+        API.RESPONSE_ADD_COMPONENT: 'components',
+        API.RESPONSE_UPDATE_COMPONENT: 'components',
+        API.RESPONSE_REMOVE_COMPONENT: 'components',
+        API.RESPONSE_WEEK_PROFILE_INFO: 'week_profiles',
+        API.RESPONSE_ADD_WEEK_PROFILE: 'week_profiles',
+        API.RESPONSE_UPDATE_WEEK_PROFILE: 'week_profiles',
+        API.RESPONSE_REMOVE_WEEK_PROFILE: 'week_profiles',
+        API.RESPONSE_OVERRIDE_INFO: 'overrides',
+        API.RESPONSE_ADD_OVERRIDE: 'overrides',
+        API.RESPONSE_REMOVE_OVERRIDE: 'overrides',
+        API.RESPONSE_HUB_INFO: 'hub_info',
+        API.RESPONSE_UPDATE_HUB_INFO: 'hub_info',
+        API.RESPONSE_COMPONENT_TEMP: 'temperatures',
+    }
+
+    # Keyword arguments accepted per item by the bulk APIs
+    _UPDATE_ZONE_ARGUMENTS = frozenset(['name', 'week_profile_id', 'temp_comfort_c', 'temp_eco_c', 'override_allowed'])
+    _OVERRIDE_ARGUMENTS = frozenset(['mode', 'type', 'target_type', 'target_id', 'end_time', 'start_time'])
+
+    # The state sections, in the order of the fields in Snapshot
+    STATE_SECTIONS = ('hub_info', 'zones', 'components', 'week_profiles', 'overrides', 'temperatures')
+
     hub_info: dict[str, Any]
     zones: dict[str, dict[str, Any]]
     components: dict[str, dict[str, Any]]
@@ -384,6 +576,14 @@ class nobo:
         loop: asyncio.AbstractEventLoop | None = None,
         synchronous: bool = True,
         timezone: datetime.tzinfo | None = None,
+        keep_alive_scheduler: KeepAliveScheduler | None = None,
+        transport: Transport | None = None,
+        probe_network: str | None = None,
+        tracer: Any = None,
+        journal: Journal | None = None,
+        command_scheduler: CommandScheduler | None = None,
+        temperature_deadband: float = 0,
+        temperature_min_interval: float = 0,
     ) -> None:
         """
         Initialize logger and dictionaries.
@@ -394,6 +594,19 @@ class nobo:
         :param loop: Deprecated
         :param synchronous: True/false for using the module synchronously. Deprecated, will be removed in 2.0.
         :param timezone: Timezone used for formatting timestamps (default None = local time)
+        :param keep_alive_scheduler: Shared scheduler sending keep-alives for many hubs, instead of
+            a keep_alive task per hub (default None)
+        :param transport: Opens the connection to the hub (default None = TCP)
+        :param probe_network: Network to probe for the hub when no UDP broadcast is received, e.g.
+            '192.168.1.0/24'. Requires the complete 12 digit serial number (default None)
+        :param tracer: OpenTelemetry compatible tracer, to trace connection phases and commands (default None)
+        :param journal: Journal to append every response from the hub to, see pynobo.journal (default None)
+        :param command_scheduler: Rate limit for commands sent to this hub, a CommandScheduler per hub
+            (default None = no limit)
+        :param temperature_deadband: Only notify a component temperature when it has changed by at
+            least this many °C since last notified, see set_temperature_filter() (default 0)
+        :param temperature_min_interval: Only notify a component temperature this many seconds after
+            it was last notified, see set_temperature_filter() (default 0)
         """
 
         self.serial = serial
@@ -410,15 +623,36 @@ class nobo:
         self.timezone = timezone
 
         self._callbacks: list[Callable[["nobo"], None]] = []
+        self._event_streams: list[EventStream] = []
         self._connection_callbacks: list[Callable[["nobo", bool], None]] = []
         self._connected: bool = False
         self._reader: asyncio.StreamReader | None = None
         self._writer: asyncio.StreamWriter | None = None
+        # Protocol state of the current connection
+        self._protocol = HubProtocol(serial, timezone)
         self._keep_alive_task: asyncio.Task[None] | None = None
+        self._keep_alive_scheduler = keep_alive_scheduler
+        self.transport = transport if transport is not None else TcpTransport()
+        self.probe_network = probe_network
+        self._tracer = tracer
+        self._journal = journal
+        self.command_scheduler = command_scheduler
+        self._keep_alive: bool = True
         self._socket_receive_task: asyncio.Task[None] | None = None
         self._last_recv_at: float = 0.0
+        # Round trips of keep-alive handshakes: recent samples, smoothed RTT and variation as in RFC 6298
+        self.keep_alive_rtts: collections.deque[float] = collections.deque(maxlen=RTT_SAMPLES)
+        self._srtt: float | None = None
+        self._rttvar: float = 0.0
+        self._keep_alive_sent_at: float | None = None
+        self._echo_timer: asyncio.TimerHandle | None = None
+        # Reconnects forced by a missing echo, referenced until done so they are not garbage collected
+        self._close_tasks: set[asyncio.Task[None]] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
 
         self._received_all_info = False
+        # Records received per state section (or opcode) by the current or last initial data load
+        self.initial_data_progress: collections.Counter[str] = collections.Counter()
         self.hub_info = {}
         self.zones = collections.OrderedDict()
         self.components = collections.OrderedDict()
@@ -426,6 +660,48 @@ class nobo:
         self.overrides = collections.OrderedDict()
         self.temperatures = collections.OrderedDict()
 
+        self._version = 0
+        self._section_versions = dict.fromkeys(nobo.STATE_SECTIONS, 0)
+        self._snapshot: nobo.Snapshot | None = None
+        self._snapshot_sections: dict[str, tuple[int, Mapping[str, Any]]] = {}
+        # Encoded JSON of the state and of each section, with the version it was encoded at
+        self._json: tuple[int, bytes] | None = None
+        self._json_sections: dict[str, tuple[int, bytes]] = {}
+        # Responses that changed nothing, per state section
+        self.suppressed_updates: collections.Counter[str] = collections.Counter()
+        # Fields saved before the hub has echoed the change, by (section, key)
+        self._unconfirmed: dict[tuple[str, str], set[str]] = {}
+        self._pending_commands: dict[str, collections.deque[_PendingCommand]] = {}
+        # Effective mode per zone for now, and the time.time() it expires at (None = until invalidated)
+        self._zone_modes: dict[str, tuple[str, float | None]] = {}
+        self._zone_mode_callbacks: list[Callable[["nobo", str, str], None]] = []
+        # Modes notified to zone mode callbacks, None until the hub is started
+        self._watched_zone_modes: dict[str, str] | None = None
+        self._changed_zone_modes: set[str] = set()
+        self._transitions: list[tuple[float, str]] = []
+        self._transition_timer: asyncio.TimerHandle | None = None
+        self._transition_at: float | None = None
+        self._transition_loop: asyncio.AbstractEventLoop | None = None
+        # Override index: parsed time windows, and the active or upcoming overrides per target
+        self._override_windows: dict[str, _OverrideWindow] = {}
+        self._zone_overrides: dict[str, list[str]] = {}
+        self._global_overrides: list[str] = []
+        # Upcoming (time, override id, kind) of override starts and ends, and the timer for the earliest
+        self._override_times: list[tuple[float, str, str]] = []
+        self._override_timer: asyncio.TimerHandle | None = None
+        self.error_counts: collections.Counter[str] = collections.Counter()
+        self.last_error: PynoboHubError | None = None
+        # Temperature deadband and minimum notify interval per component serial, None for the default
+        self._temperature_filters: dict[str | None, tuple[float, float]] = {}
+        self.set_temperature_filter(None, temperature_deadband, temperature_min_interval)
+        # Last notified temperature (NaN if not a number) and time.monotonic() per component serial
+        self._notified_temperatures: dict[str, tuple[float, float]] = {}
+        # Components with a change held back by the interval, and the timer notifying it when the
+        # interval has passed (None if there was no running event loop to schedule it on)
+        self._held_temperatures: dict[str, asyncio.TimerHandle | None] = {}
+        # Temperature updates stored but not notified, per component serial
+        self.suppressed_temperatures: collections.Counter[str] = collections.Counter()
+
         if synchronous:
             warnings.warn(
                 "synchronous mode is deprecated and will be removed in pynobo 2.0; "
@@ -433,18 +709,9 @@ class nobo:
                 DeprecationWarning,
                 stacklevel=2,
             )
-            # Run asyncio in a separate thread
-            try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                _LOGGER.debug("Creating new event loop")
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-            loop.run_until_complete(self.start())
-            _LOGGER.debug("Creating daemon thread")
-            thread = threading.Thread(target=lambda: loop.run_forever())
-            thread.setDaemon(True)
-            thread.start()
+            # Run asyncio in the background thread shared by all synchronous instances
+            self._loop = _get_sync_loop()
+            asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
 
     def register_callback(self, callback: Callable[["nobo"], None] = lambda *args, **kwargs: None) -> None:
         """
@@ -464,6 +731,72 @@ class nobo:
         """
         self._callbacks.remove(callback)
 
+    def set_temperature_filter(self, serial: str | None, deadband: float | None = None, min_interval: float | None = None) -> None:
+        """
+        Limit notifications of temperature updates (Y02) from a component. The latest temperature
+        is always stored, but callbacks and event streams are only notified when it has changed by
+        at least the deadband since last notified, and the minimum interval has passed. A change
+        held back by the interval is notified as soon as the interval has passed.
+
+        :param serial: the component serial number, or None for the default of all components
+        :param deadband: smallest change in °C to notify (default None = the default, or 0)
+        :param min_interval: minimum seconds between notifications (default None = the default, or 0)
+        """
+        default_deadband, default_interval = self._temperature_filters.get(serial, self._temperature_filters.get(None, (0, 0)))
+        deadband = default_deadband if deadband is None else deadband
+        min_interval = default_interval if min_interval is None else min_interval
+        if deadband < 0 or min_interval < 0:
+            raise PynoboValidationError(f'Temperature deadband and interval must not be negative: {deadband}, {min_interval}')
+        self._temperature_filters[serial] = (deadband, min_interval)
+
+    def events(self, maxsize: int = 1000, overflow: str = 'coalesce') -> EventStream:
+        """
+        Subscribe to updates from the hub, as an alternative to callbacks:
+
+            async with hub.events() as events:
+                async for event in events:
+                    ...
+
+        Each subscriber has its own bounded queue, so a slow consumer never blocks receiving from
+        the hub. Events are published for the same updates as callbacks are called for.
+
+        :param maxsize: max number of queued events (default 1000)
+        :param overflow: what to do when the queue is full: 'drop_oldest', 'drop_newest' or 'coalesce'
+            (default). With coalesce a queued event is replaced by a newer event for the same record,
+            and the oldest event is dropped if the queue is still full.
+
+        :return: the subscription, an async iterator of nobo.Event
+        """
+        stream = EventStream(self, maxsize, overflow)
+        self._event_streams.append(stream)
+        return stream
+
+    def _publish(self, response: list[str], kind: str = 'response', changed: frozenset[str] | None = None) -> None:
+        """Publish an update from the hub to the event streams."""
+        if not self._event_streams:
+            return
+        section = nobo._RESPONSE_SECTIONS.get(response[0])
+        key = response[1] if section not in (None, 'hub_info') and len(response) > 1 else None
+        event = nobo.Event(self._version, tuple(response), section, key, kind, changed)
+        for stream in self._event_streams:
+            stream._put(event)
+
+    def _publish_zone_mode(self, zone_id: str) -> None:
+        """Publish a change of the effective mode of a zone to the event streams."""
+        if not self._event_streams:
+            return
+        event = nobo.Event(self._version, (), 'zones', zone_id, 'zone_mode')
+        for stream in self._event_streams:
+            stream._put(event)
+
+    def _publish_rollback(self, mutation: _Mutation) -> None:
+        """Publish a rolled back change of a record to the event streams."""
+        if not self._event_streams:
+            return
+        event = nobo.Event(self._version, (), mutation.section, mutation.key, 'rollback', frozenset(mutation.new))
+        for stream in self._event_streams:
+            stream._put(event)
+
     @property
     def connected(self) -> bool:
         """Whether the hub is currently connected."""
@@ -491,34 +824,47 @@ class nobo:
 
     async def connect(self) -> None:
         """Connect to Ecohub, either by scanning or directly."""
-        connected = False
-        if self.discover:
-            _LOGGER.info('Looking for Nobø Ecohub with serial: %s and ip: %s', self.serial, self.ip)
-            discovered_hubs = await self.async_discover_hubs(serial=self.serial, ip=self.ip)
-            if not discovered_hubs:
-                _LOGGER.error('Failed to discover any Nobø Ecohubs')
-                raise PynoboConnectionError('Failed to discover any Nobø Ecohubs')
-            while discovered_hubs:
-                (discover_ip, discover_serial) = discovered_hubs.pop()
-                connected = await self.async_connect_hub(discover_ip, discover_serial)
-                if connected:
-                    break  # We connect to the first valid hub, no reason to try the rest
-        else:
-            # check if we have an IP
-            if not self.ip:
-                _LOGGER.error('Could not connect, no ip address provided')
-                raise PynoboValidationError('Could not connect, no ip address provided')
+        with self._span('connect', discover=self.discover):
+            connected = False
+            if self.discover:
+                _LOGGER.info('Looking for Nobø Ecohub with serial: %s and ip: %s', self.serial, self.ip)
+                with self._span('discover'):
+                    discovered_hubs = await self._async_find_hubs(self.serial)
+                if not discovered_hubs:
+                    _LOGGER.error('Failed to discover any Nobø Ecohubs')
+                    raise PynoboConnectionError('Failed to discover any Nobø Ecohubs')
+                # We connect to the first valid hub, no reason to keep the rest
+                connected = await self.async_connect_first_hub(discovered_hubs)
+            else:
+                # check if we have an IP
+                if not self.ip:
+                    _LOGGER.error('Could not connect, no ip address provided')
+                    raise PynoboValidationError('Could not connect, no ip address provided')
+
+                # check if we have a valid serial before we start connection
+                if len(self.serial) != 12:
+                    _LOGGER.error('Could not connect, no valid serial number provided')
+                    raise PynoboValidationError('Could not connect, no valid serial number provided')
 
-            # check if we have a valid serial before we start connection
-            if len(self.serial) != 12:
-                _LOGGER.error('Could not connect, no valid serial number provided')
-                raise PynoboValidationError('Could not connect, no valid serial number provided')
+                connected = await self.async_connect_hub(self.ip, self.serial)
 
-            connected = await self.async_connect_hub(self.ip, self.serial)
+            if not connected:
+                _LOGGER.error('Could not connect to Nobø Ecohub')
+                raise PynoboConnectionError(f'Failed to connect to Nobø Ecohub with serial: {self.serial} and ip: {self.ip}')
 
-        if not connected:
-            _LOGGER.error('Could not connect to Nobø Ecohub')
-            raise PynoboConnectionError(f'Failed to connect to Nobø Ecohub with serial: {self.serial} and ip: {self.ip}')
+    def _span(self, name: str, **attributes: Any) -> ContextManager[Any]:
+        """
+        Trace a phase as a span nested in the current span, if there is a tracer.
+
+        :param name: the phase, the span is named pynobo.<name>
+        :param attributes: span attributes, prefixed with nobo.
+        """
+        if self._tracer is None:
+            return nullcontext()
+        return self._tracer.start_as_current_span(f'pynobo.{name}', attributes=self._span_attributes(attributes))
+
+    def _span_attributes(self, attributes: dict[str, Any]) -> dict[str, Any]:
+        return {'nobo.serial': self.serial, **{f'nobo.{key}': value for key, value in attributes.items()}}
 
     async def start(self) -> None:
         """Discover Ecohub and start the TCP client."""
@@ -527,12 +873,23 @@ class nobo:
             await self.connect()
 
         # Start the tasks to send keep-alive and receive data
-        self._keep_alive_task = asyncio.create_task(self.keep_alive())
+        if self._keep_alive_scheduler is not None:
+            self._keep_alive_scheduler.register(self)
+        else:
+            self._keep_alive_task = asyncio.create_task(self.keep_alive())
         self._socket_receive_task = asyncio.create_task(self.socket_receive())
+        self._watch_zone_modes()
         _LOGGER.info('connected to Nobø Ecohub')
 
     async def stop(self) -> None:
         """Stop the keep-alive and receiver tasks and close the connection to Nobø Ecohub."""
+        self._unwatch_zone_modes()
+        for timer in self._held_temperatures.values():
+            if timer is not None:
+                timer.cancel()
+        self._held_temperatures = {}
+        if self._keep_alive_scheduler is not None:
+            self._keep_alive_scheduler.unregister(self)
         if self._keep_alive_task:
             self._keep_alive_task.cancel()
             with suppress(asyncio.CancelledError):
@@ -542,16 +899,23 @@ class nobo:
             with suppress(asyncio.CancelledError):
                 await self._socket_receive_task
         await self.close()
+        for stream in list(self._event_streams):
+            stream.close()
         _LOGGER.info('disconnected from Nobø Ecohub')
 
     async def close(self) -> None:
         """Close the connection to Nobø Ecohub."""
+        if self._echo_timer is not None:
+            self._echo_timer.cancel()
+            self._echo_timer = None
+        self._keep_alive_sent_at = None
         if self._writer:
             self._writer.close()
             with suppress(ConnectionError):
                 await self._writer.wait_closed()
             self._writer = None
             _LOGGER.info('connection closed')
+        self._fail_pending_commands(PynoboConnectionError('Connection to Nobø Ecohub closed'))
         self._set_connected(False)
 
     def connect_hub(self, ip: str, serial: str) -> bool:
@@ -561,12 +925,7 @@ class nobo:
             DeprecationWarning,
             stacklevel=2,
         )
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        return loop.run_until_complete(self.async_connect_hub(ip, serial))
+        return _run_sync(self.async_connect_hub(ip, serial))
 
     async def async_connect_hub(self, ip: str, serial: str) -> bool:
         """
@@ -575,79 +934,151 @@ class nobo:
         :param ip: The ecohub ip address to connect to
         :param serial: The complete 12 digit serial number of the hub to connect to
         """
-        if len(serial) != 12 or not serial.isdigit():
-            raise PynoboValidationError(f'Invalid serial number: {serial}')
+        with self._span('connect_hub', ip=ip):
+            if not await self._async_handshake(ip, serial):
+                return False
+            await self._async_complete_connect(ip, serial)
+            return True
 
-        try:
-            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(ip, 27779), timeout=5)
-        except (OSError, asyncio.TimeoutError) as e:
-            raise PynoboConnectionError(f'Failed to connect to Nobø Ecohub at {ip}') from e
+    async def async_connect_first_hub(
+        self,
+        hubs: set[tuple[str, str]],
+        stagger: float = CONNECT_STAGGER_DELAY,
+    ) -> bool:
+        """
+        Race connection attempts to several hubs and keep the first one completing the handshake.
+
+        Attempts are started `stagger` seconds apart, or as soon as the previous attempt fails.
+        The first hub to answer HANDSHAKE wins, the remaining attempts are cancelled and their
+        connections closed.
 
-        # start handshake: "HELLO <version of command set> <Hub s.no.> <date and time in format 'yyyyMMddHHmmss'>\r"
-        now = datetime.datetime.now(self.timezone).strftime('%Y%m%d%H%M%S')
-        await self.async_send_command([nobo.API.START, nobo.API.VERSION, serial, now])
+        :param hubs: set of (ip, serial) tuples, e.g. as returned by async_discover_hubs
+        :param stagger: seconds to wait before starting the next attempt (default CONNECT_STAGGER_DELAY)
 
-        # receive the response data (4096 is recommended buffer size)
+        :return: True if connected to one of the hubs
+        """
+        candidates = sorted(hubs)
+        if len(candidates) == 1:
+            return await self.async_connect_hub(*candidates[0])
+
+        attempts: dict[asyncio.Task[bool], nobo] = {}
+        pending: set[asyncio.Task[bool]] = set()
+        winner: nobo | None = None
+        handshake_error: PynoboHandshakeError | None = None
         try:
-            response = await asyncio.wait_for(self.get_response(), timeout=5)
-        except asyncio.TimeoutError as e:
-            raise PynoboConnectionError(f'Timed out waiting for handshake response from {ip}') from e
-        _LOGGER.debug('first handshake response: %s', response)
-
-        # successful response is "HELLO <its version of command set>\r"
-        if response[0] == nobo.API.START:
-            # send “REJECT\r” if command set is not supported? No need to abort if Hub is ok with the mismatch?
-            if response[1] != nobo.API.VERSION:
-                #await self.async_send_command([nobo.API.REJECT])
-                _LOGGER.warning('api version might not match, hub: v%s, pynobo: v%s', response[1], nobo.API.VERSION)
-                warnings.warn(f'api version might not match, hub: v{response[1]}, pynobo: v{nobo.API.VERSION}') #overkill?
-
-            # send/receive handshake complete
-            await self.async_send_command([nobo.API.HANDSHAKE])
+            while winner is None and (candidates or pending):
+                if candidates:
+                    (ip, serial) = candidates.pop(0)
+                    probe = nobo(serial, ip=ip, discover=False, synchronous=False, timezone=self.timezone,
+                                 transport=self.transport, tracer=self._tracer)
+                    task = asyncio.create_task(probe._async_handshake(ip, serial))
+                    attempts[task] = probe
+                    pending.add(task)
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=stagger if candidates else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    probe = attempts[task]
+                    try:
+                        if task.result() and winner is None:
+                            winner = probe
+                    except PynoboHandshakeError as e:
+                        _LOGGER.warning('Handshake with %s failed: %s', probe.ip, e)
+                        handshake_error = handshake_error or e
+                    except PynoboConnectionError as e:
+                        _LOGGER.warning('Failed to connect to %s: %s', probe.ip, e)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for probe in attempts.values():
+                if probe is not winner:
+                    await probe.close()
+
+        if winner is None:
+            if handshake_error is not None:
+                raise handshake_error
+            return False
+
+        # Take over the winning connection
+        self._reader, self._writer, self._protocol = winner._reader, winner._writer, winner._protocol
+        winner._reader, winner._writer = None, None
+        await self._async_complete_connect(winner.ip, winner.serial)
+        return True
+
+    async def _async_handshake(self, ip: str, serial: str) -> bool:
+        """
+        Open the connection and perform the HELLO/HANDSHAKE sequence.
+
+        :return: True if the hub accepted the handshake, False if it rejected us
+        """
+        if len(serial) != 12 or not serial.isdigit():
+            raise PynoboValidationError(f'Invalid serial number: {serial}')
+
+        with self._span('tcp_connect', ip=ip):
+            try:
+                self._reader, self._writer = await asyncio.wait_for(self.transport.open_connection(ip, HUB_PORT), timeout=5)
+            except (OSError, asyncio.TimeoutError) as e:
+                raise PynoboConnectionError(f'Failed to connect to Nobø Ecohub at {ip}') from e
+
+        protocol = self._protocol = HubProtocol(serial, self.timezone)
+        with self._span('hello', ip=ip):
+            protocol.hello()
+            await self._async_write_protocol()
+            # receive the response data (4096 is recommended buffer size)
             try:
                 response = await asyncio.wait_for(self.get_response(), timeout=5)
             except asyncio.TimeoutError as e:
-                raise PynoboConnectionError(f'Timed out waiting for final handshake response from {ip}') from e
-            _LOGGER.debug('second handshake response: %s', response)
-
-            if response[0] == nobo.API.HANDSHAKE:
-                # Connect OK, store full serial for reconnect
-                self.hub_ip = ip
-                self.hub_serial = serial
+                raise PynoboConnectionError(f'Timed out waiting for handshake response from {ip}') from e
+            _LOGGER.debug('first handshake response: %s', response)
+            try:
+                protocol.handle(response)
+            except PynoboHandshakeError as e:
+                _LOGGER.error('%s', e)
+                raise
 
-                # Get initial data
-                try:
-                    await asyncio.wait_for(self._get_initial_data(), timeout=5)
-                except asyncio.TimeoutError as e:
-                    raise PynoboConnectionError(f'Timed out waiting for initial data from {ip}') from e
-                # Fire connection callback before data callback so consumers
-                # that gate on `connected` see the transition before the data
-                # arrives and don't have to handle a "data while disconnected"
-                # window during reconnect.
-                self._set_connected(True)
-                for callback in self._callbacks:
-                    callback(self)
-                return True
-            else:
-                # Something went wrong...
-                _LOGGER.error('Final handshake not as expected %s', response)
-                await self.close()
-                raise PynoboHandshakeError(f'Final handshake not as expected {response}')
-        if response[0] == nobo.API.REJECT:
+        if protocol.state == HubProtocol.REJECTED:
             # This may not be the hub we are looking for
-
-            # Reject response: "REJECT <reject code>\r"
-            # 0=Client command set version too old (or too new!).
-            # 1=Hub serial number mismatch.
-            # 2=Wrong number of arguments.
-            # 3=Timestamp incorrectly formatted
             _LOGGER.warning('connection to hub rejected: %s', response)
             await self.close()
             return False
 
-        # Unexpected response
-        _LOGGER.error('connection to hub rejected: %s', response)
-        raise PynoboHandshakeError(f'connection to hub rejected: {response}')
+        # send/receive handshake complete
+        with self._span('handshake', ip=ip):
+            await self._async_write_protocol()
+            try:
+                response = await asyncio.wait_for(self.get_response(), timeout=5)
+            except asyncio.TimeoutError as e:
+                raise PynoboConnectionError(f'Timed out waiting for final handshake response from {ip}') from e
+            _LOGGER.debug('second handshake response: %s', response)
+            try:
+                protocol.handle(response)
+            except PynoboHandshakeError as e:
+                # Something went wrong...
+                _LOGGER.error('%s', e)
+                await self.close()
+                raise
+        return True
+
+    async def _async_complete_connect(self, ip: str, serial: str) -> None:
+        """Load the initial data after a successful handshake and notify consumers."""
+        # Connect OK, store full serial for reconnect
+        self.hub_ip = ip
+        self.hub_serial = serial
+
+        # Get initial data
+        with self._span('initial_data', ip=ip):
+            await self._get_initial_data()
+        # Fire connection callback before data callback so consumers
+        # that gate on `connected` see the transition before the data
+        # arrives and don't have to handle a "data while disconnected"
+        # window during reconnect.
+        with self._span('callbacks'):
+            self._set_connected(True)
+            for callback in self._callbacks:
+                callback(self)
 
     async def reconnect_hub(self) -> None:
         """Keep trying to reconnect to the hub, with exponential backoff.
@@ -661,35 +1092,30 @@ class nobo:
         # Pause keep alive during reconnect
         self._keep_alive = False
         delay = RECONNECT_INITIAL_DELAY
-        while True:
-            _LOGGER.debug('waiting %ds before next reconnect attempt', delay)
-            await asyncio.sleep(delay)
-            try:
-                if self.discover:
-                    # Reconnect using complete serial, but allow ip to change unless originally provided
-                    discovered_hubs = await self.async_discover_hubs(
-                        ip=self.ip, serial=self.hub_serial, rediscover=True,
+        with self._span('reconnect'):
+            for attempt in itertools.count(1):
+                _LOGGER.debug('waiting %ds before next reconnect attempt', delay)
+                await asyncio.sleep(delay)
+                try:
+                    with self._span('reconnect_attempt', attempt=attempt, delay=delay):
+                        if self.discover:
+                            # Reconnect using complete serial, but allow ip to change unless originally provided
+                            with self._span('discover'):
+                                discovered_hubs = await self._async_find_hubs(self.hub_serial, rediscover=True)
+                            connected = await self.async_connect_first_hub(discovered_hubs)
+                        else:
+                            connected = await self.async_connect_hub(self.ip, self.serial)
+                except PynoboHandshakeError:
+                    raise  # unrecoverable — propagate so socket_receive's outer arm can stop() us
+                except PynoboConnectionError as e:
+                    _LOGGER.info(
+                        "reconnect attempt failed: %s; retrying in %ds",
+                        e, min(delay * 2, RECONNECT_MAX_DELAY),
                     )
                     connected = False
-                    while discovered_hubs and not connected:
-                        (discover_ip, discover_serial) = discovered_hubs.pop()
-                        try:
-                            connected = await self.async_connect_hub(discover_ip, discover_serial)
-                        except PynoboConnectionError as inner:
-                            _LOGGER.warning("Failed to connect to %s: %s", discover_ip, inner)
-                else:
-                    connected = await self.async_connect_hub(self.ip, self.serial)
-            except PynoboHandshakeError:
-                raise  # unrecoverable — propagate so socket_receive's outer arm can stop() us
-            except PynoboConnectionError as e:
-                _LOGGER.info(
-                    "reconnect attempt failed: %s; retrying in %ds",
-                    e, min(delay * 2, RECONNECT_MAX_DELAY),
-                )
-                connected = False
-            if connected:
-                break
-            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                if connected:
+                    break
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
 
         self._keep_alive = True
         _LOGGER.info('reconnected to Nobø Hub')
@@ -707,12 +1133,7 @@ class nobo:
             DeprecationWarning,
             stacklevel=2,
         )
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        return loop.run_until_complete(nobo.async_discover_hubs(serial, ip, autodiscover_wait))
+        return _run_sync(nobo.async_discover_hubs(serial, ip, autodiscover_wait))
 
     @staticmethod
     async def async_discover_hubs(
@@ -766,6 +1187,85 @@ class nobo:
             transport.close()
         return protocol.hubs
 
+    async def _async_find_hubs(self, serial: str, rediscover: bool = False) -> set[tuple[str, str]]:
+        """
+        Discover hubs by UDP broadcast, falling back to probing probe_network if none is received.
+
+        :param serial: The last 3 digits of the Ecohub serial number or the complete 12 digit serial number
+        :param rediscover: if true, and there is no network to probe, wait until the hub is discovered
+        """
+        if self.probe_network is None or len(serial) != 12:
+            return await self.async_discover_hubs(serial=serial, ip=self.ip, rediscover=rediscover)
+        discovered_hubs = await self.async_discover_hubs(serial=serial, ip=self.ip)
+        if not discovered_hubs:
+            _LOGGER.info('no broadcast received from hub, probing %s', self.probe_network)
+            discovered_hubs = await self.async_probe_hubs(self.probe_network, serial, transport=self.transport)
+            if self.ip:
+                discovered_hubs = {(ip, serial) for (ip, serial) in discovered_hubs if ip == self.ip}
+        return discovered_hubs
+
+    @staticmethod
+    async def async_probe_hubs(
+        network: str,
+        serial: str,
+        concurrency: int = 256,
+        connect_timeout: float = 0.5,
+        hello_timeout: float = 2.0,
+        transport: Transport | None = None,
+    ) -> set[tuple[str, str]]:
+        """
+        Find Nobø Ecohubs by probing the TCP port of every address in a network.
+
+        An alternative to async_discover_hubs when UDP broadcasts from the hub don't reach this
+        host, e.g. on a different network segment. Every address accepting a connection is
+        confirmed with a HELLO, which the hub only accepts with its own serial number.
+
+        :param network: the network to probe, e.g. '192.168.1.0/24'
+        :param serial: The complete 12 digit serial number of the hub
+        :param concurrency: max number of addresses probed at the same time (default 256)
+        :param connect_timeout: seconds to wait for each connection (default 0.5)
+        :param hello_timeout: seconds to wait for the hub to answer HELLO (default 2.0)
+        :param transport: Opens the connections (default None = TCP)
+
+        :return: a set of (ip, serial) of the hubs found, like async_discover_hubs
+        """
+        if len(serial) != 12 or not serial.isdigit():
+            raise PynoboValidationError(f'Probing requires the complete 12 digit serial number, not {serial}')
+        try:
+            hosts = list(ipaddress.ip_network(network, strict=False).hosts())
+        except ValueError as e:
+            raise PynoboValidationError(f'Invalid network: {network}') from e
+        if transport is None:
+            transport = TcpTransport()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(ip: str) -> bool:
+            async with semaphore:
+                try:
+                    reader, writer = await asyncio.wait_for(transport.open_connection(ip, HUB_PORT), timeout=connect_timeout)
+                except (OSError, asyncio.TimeoutError):
+                    return False
+                protocol = HubProtocol(serial)
+                try:
+                    protocol.hello()
+                    writer.write(protocol.data_to_send())
+                    await writer.drain()
+                    response = await asyncio.wait_for(reader.readuntil(SEPARATOR), timeout=hello_timeout)
+                    _LOGGER.debug('probe response from %s: %s', ip, response)
+                    protocol.receive_data(response)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, PynoboHandshakeError):
+                    return False
+                finally:
+                    writer.close()
+                    with suppress(OSError):
+                        await writer.wait_closed()
+                # The hub only answers HELLO, and not REJECT, with its own serial number
+                return protocol.state == HubProtocol.HANDSHAKE
+
+        ips = [str(host) for host in hosts]
+        found = await asyncio.gather(*(probe(ip) for ip in ips))
+        return {(ip, serial) for ip, hub in zip(ips, found) if hub}
+
     @staticmethod
     def _reuse_port() -> bool:
         """
@@ -793,19 +1293,119 @@ class nobo:
             await asyncio.sleep(interval)
             if not self._keep_alive:
                 continue
-            # If nothing has come back from the hub within 2× the interval, the link is
-            # dead (e.g. silent network drop — WiFi off, hub unplugged). Close the writer
-            # to force readuntil in socket_receive() to EOF, routing into reconnect_hub().
+            # If the hub has not echoed the last handshake in time, the link is dead (e.g.
+            # silent network drop — WiFi off, hub unplugged). Close the writer to force
+            # readuntil in socket_receive() to EOF, routing into reconnect_hub().
             # NOTE: this liveness check relies on the hub echoing HANDSHAKE at the app layer.
             # If HANDSHAKE is ever replaced with the spec's KEEPALIVE, investigate how the
             # message is acknowledged by the hub.
-            if time.monotonic() - self._last_recv_at > 2 * interval:
-                _LOGGER.info('no response from hub in %ss, forcing reconnect', 2 * interval)
+            if self._liveness_expired(interval):
+                _LOGGER.info('no response from hub in %.1fs, forcing reconnect', time.monotonic() - self._last_recv_at)
                 await self.close()
                 continue
+            self._keep_alive_sent(interval)
             await self.async_send_command([nobo.API.HANDSHAKE])
 
+    def keep_alive_timeout(self, interval: float = 14) -> float:
+        """
+        Get how long to wait for the hub to echo a keep-alive handshake, from the measured round trips:
+        the smoothed RTT plus four times its variation, at least LIVENESS_MIN_TIMEOUT and at most
+        the interval. Until a round trip has been measured, two intervals.
+
+        :param interval: seconds between each handshake. Default 14.
+        """
+        if self._srtt is None:
+            return 2 * interval
+        return min(interval, max(LIVENESS_MIN_TIMEOUT, self._srtt + 4 * self._rttvar))
+
+    def rtt_histogram(self) -> dict[float, int]:
+        """
+        Get a histogram of the recent keep-alive round trips.
+
+        :return: the number of samples per bucket, by the upper bound of the bucket in seconds (RTT_BUCKETS, then inf)
+        """
+        buckets = (*RTT_BUCKETS, float('inf'))
+        histogram = dict.fromkeys(buckets, 0)
+        for rtt in self.keep_alive_rtts:
+            histogram[buckets[bisect.bisect_left(RTT_BUCKETS, rtt)]] += 1
+        return histogram
+
+    def _keep_alive_sent(self, interval: float) -> None:
+        """Note that a keep-alive handshake is sent, and check for the echo when it is due."""
+        self._keep_alive_sent_at = time.monotonic()
+        if self._echo_timer is not None:
+            self._echo_timer.cancel()
+            self._echo_timer = None
+        timeout = self.keep_alive_timeout(interval)
+        if timeout < interval:
+            # Check before the next keep-alive, to detect a dead link sooner
+            self._echo_timer = asyncio.get_running_loop().call_later(timeout, self._check_echo, interval)
+
+    def _keep_alive_echoed(self) -> None:
+        """Measure the round trip of the keep-alive handshake echoed by the hub."""
+        if self._keep_alive_sent_at is None:
+            return
+        rtt = time.monotonic() - self._keep_alive_sent_at
+        self._keep_alive_sent_at = None
+        if self._echo_timer is not None:
+            self._echo_timer.cancel()
+            self._echo_timer = None
+        self.keep_alive_rtts.append(rtt)
+        if self._srtt is None:
+            self._srtt, self._rttvar = rtt, rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+
+    def _check_echo(self, interval: float) -> None:
+        self._echo_timer = None
+        if self._writer is not None and self._keep_alive and self._liveness_expired(interval):
+            _LOGGER.info('no echo of keep-alive from hub in %.1fs, forcing reconnect', time.monotonic() - self._keep_alive_sent_at)
+            task = asyncio.get_running_loop().create_task(self.close())
+            self._close_tasks.add(task)
+            task.add_done_callback(self._close_tasks.discard)
+
+    def _liveness_expired(self, interval: float) -> bool:
+        """
+        Return True if nothing has been received from the hub since a keep-alive handshake that is
+        overdue (see keep_alive_timeout), or within 2× the keep-alive interval.
+        """
+        now = time.monotonic()
+        sent_at = self._keep_alive_sent_at
+        if sent_at is not None and self._last_recv_at < sent_at and now - sent_at > self.keep_alive_timeout(interval):
+            return True
+        return now - self._last_recv_at > 2 * interval
+
+    def run_blocking(self, coroutine: Any, timeout: float | None = None) -> Any:
+        """
+        Run a coroutine on the background event loop of a synchronous instance and wait for it.
+
+        Errors raised by the coroutine are raised in the calling thread, e.g.
+        `hub.run_blocking(hub.async_update_zone('1', temp_comfort_c=22))`.
+
+        :param coroutine: the coroutine to run, e.g. from one of the async_* methods
+        :param timeout: seconds to wait for the result (default None = wait forever)
+
+        :return: the result of the coroutine
+        """
+        if self._loop is None:
+            coroutine.close()
+            raise PynoboError('run_blocking requires an instance created with synchronous=True')
+        if threading.current_thread() is _sync_thread:
+            coroutine.close()
+            raise PynoboError('run_blocking cannot be called from the event loop thread')
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
     def _create_task(self, target: Any) -> None:
+        if self._loop is not None:
+            future = asyncio.run_coroutine_threadsafe(target, self._loop)
+            future.add_done_callback(self._log_task_error)
+            return
         try:
             loop = asyncio.get_running_loop()
         except RuntimeError:
@@ -813,6 +1413,11 @@ class nobo:
             asyncio.set_event_loop(loop)
         loop.call_soon_threadsafe(lambda: loop.create_task(target))
 
+    @staticmethod
+    def _log_task_error(future: concurrent.futures.Future[Any]) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            _LOGGER.error('background command failed: %s', future.exception(), exc_info=future.exception())
+
     def send_command(self, commands: list[Any]) -> None:
         warnings.warn(
             "nobo.send_command is deprecated and will be removed in pynobo 2.0; "
@@ -830,27 +1435,243 @@ class nobo:
         """
         if not self._writer:
             return
+        with self._span('send', command=str(commands[0])):
+            if self.command_scheduler is not None:
+                lane = CommandScheduler.KEEP_ALIVE if commands[0] == nobo.API.HANDSHAKE else CommandScheduler.COMMAND
+                await self.command_scheduler.acquire(1, lane)
+                if not self._writer:
+                    return  # Lost the connection while waiting
+            await self._async_write([commands])
+
+    async def _async_write_protocol(self) -> None:
+        """Write the data queued by the protocol, e.g. the handshake, and wait for it to drain."""
+        try:
+            self._writer.write(self._protocol.data_to_send())
+            await self._writer.drain()
+        except OSError as e:
+            await self._lost_connection(e)
 
-        _LOGGER.debug('sending: %s', commands)
-
-        # Convert integers to string
-        for idx, c in enumerate(commands):
-            if isinstance(c, int):
-                commands[idx] = str(c)
-
-        message = ' '.join(commands).encode('utf-8')
+    async def _async_write(self, commands_list: list[list[Any]]) -> None:
+        """Write one or more commands to the hub, and wait once for all of them to drain."""
         try:
-            self._writer.write(message + b'\r')
+            for commands in commands_list:
+                self._write_command(commands)
             await self._writer.drain()
-        except ConnectionError as e:
-            _LOGGER.info('lost connection to hub (%s)', e)
-            await self.close()
+        except OSError as e:
+            await self._lost_connection(e)
+
+    async def _lost_connection(self, error: OSError) -> None:
+        """
+        Close the connection after a failed write, so socket_receive reconnects. Besides connection
+        errors, e.g. ETIMEDOUT when the hub has not acknowledged the data within TCP_USER_TIMEOUT.
+        """
+        if not isinstance(error, ConnectionError) and error.errno not in RECONNECT_ERRORS:
+            raise error
+        _LOGGER.info('lost connection to hub (%s)', error)
+        await self.close()
+
+    async def _async_send_commands(
+        self,
+        commands_list: list[list[Any]],
+        wait: bool,
+        timeout: float,
+        mutations: list[list[_Mutation]] | None = None,
+    ) -> list[PynoboError | None]:
+        """
+        Send commands in a single pipelined write, optionally waiting for the hub to acknowledge them.
+        With a command scheduler, the commands are written in as many writes as the rate limit
+        requires, in the bulk lane, and each command is timed from when it is written.
+
+        :param mutations: for each command, the optimistic changes to roll back if it fails
+
+        :return: for each command, None if acknowledged (or sent, if not waiting), otherwise the error,
+            e.g. PynoboConnectionError if not connected
+        """
+        futures = []
+        mutations = mutations or [[]] * len(commands_list)
+        while len(futures) < len(commands_list):
+            start = len(futures)
+            count = len(commands_list) - start
+            with self._span('send', command=str(commands_list[start][0]), count=count):
+                if self.command_scheduler is not None and self._writer:
+                    count = await self.command_scheduler.acquire(count, CommandScheduler.BULK)
+                chunk = commands_list[start:start + count]
+                chunk_futures = [self._track_command(commands, timeout) for commands in chunk]
+                for future, command_mutations in zip(chunk_futures, mutations[start:start + count]):
+                    self._track_mutations(future, command_mutations)
+                futures += chunk_futures
+                if self._writer:
+                    await self._async_write(chunk)
+                else:
+                    for future in chunk_futures:
+                        future.set_exception(PynoboConnectionError('Not connected to Nobø Ecohub'))
+        if not wait:
+            # Commands that could not be written have failed already
+            return [future.exception() if future.done() and not future.cancelled() else None for future in futures]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return [result if isinstance(result, BaseException) else None for result in results]
+
+    @staticmethod
+    def _ack_key(fields: list[str]) -> Any:
+        """The part of a command or its response identifying what it applies to, None if assigned by the hub."""
+        if fields[0] in (nobo.API.ADD_OVERRIDE, nobo.API.RESPONSE_ADD_OVERRIDE):
+            return (fields[6], fields[7])  # target type and id, override id is assigned by the hub
+        if fields[0] in (nobo.API.ADD_ZONE, nobo.API.RESPONSE_ADD_ZONE, nobo.API.ADD_WEEK_PROFILE, nobo.API.RESPONSE_ADD_WEEK_PROFILE):
+            return None
+        return fields[1] if len(fields) > 1 else None
+
+    def _track_command(self, commands: list[Any], timeout: float) -> asyncio.Future[list[str]]:
+        """
+        Register a command as waiting for the hub to echo it.
+
+        :return: a future resolved with the echoed response, or failed with PynoboTimeoutError after timeout
+        """
+        loop = asyncio.get_running_loop()
+        pending = _PendingCommand(commands[0], self._ack_key([str(c) for c in commands]), loop.create_future())
+        if self._tracer is not None:
+            attributes = {'command': pending.opcode}
+            if pending.key is not None:
+                attributes['key'] = str(pending.key)
+            pending.span = self._tracer.start_span('pynobo.command', attributes=self._span_attributes(attributes))
+        self._pending_commands.setdefault(pending.opcode, collections.deque()).append(pending)
+        timer = loop.call_later(timeout, self._expire_command, pending, timeout)
+        pending.future.add_done_callback(lambda _future: self._command_done(pending, timer))
+        return pending.future
+
+    def _expire_command(self, pending: _PendingCommand, timeout: float) -> None:
+        if not pending.future.done():
+            pending.future.set_exception(PynoboTimeoutError(f'No acknowledgement of {pending.opcode} {pending.key} within {timeout}s'))
+
+    def _command_done(self, pending: _PendingCommand, timer: asyncio.TimerHandle) -> None:
+        timer.cancel()
+        queue = self._pending_commands.get(pending.opcode)
+        if queue and pending in queue:
+            queue.remove(pending)
+        if not pending.future.cancelled():
+            pending.future.exception()  # Retrieved here, so unawaited failures are not logged by asyncio
+        if pending.span is not None:
+            if pending.future.cancelled():
+                pending.span.set_attribute('nobo.outcome', 'cancelled')
+            elif pending.future.exception() is not None:
+                pending.span.set_attribute('nobo.outcome', type(pending.future.exception()).__name__)
+                pending.span.record_exception(pending.future.exception())
+            else:
+                pending.span.set_attribute('nobo.outcome', 'acknowledged')
+            pending.span.end()
+
+    def _acknowledge_command(self, response: list[str]) -> None:
+        """Resolve the oldest pending command acknowledged by a response from the hub."""
+        queue = self._pending_commands.get(nobo.API.DICT_RESPONSE_TO_COMMAND.get(response[0]))
+        if not queue:
+            return
+        key = self._ack_key(response)
+        for pending in queue:
+            if not pending.future.done() and (pending.key is None or pending.key == key):
+                queue.remove(pending)
+                pending.future.set_result(response)
+                return
+
+    def _track_mutations(self, future: asyncio.Future[list[str]], mutations: list[_Mutation]) -> None:
+        """Roll back optimistic changes if their command fails, times out or the connection is lost."""
+        if mutations:
+            future.add_done_callback(lambda _future: self._settle_mutations(_future, mutations))
+
+    def _settle_mutations(self, future: asyncio.Future[list[str]], mutations: list[_Mutation]) -> None:
+        for mutation in mutations:
+            self._unconfirmed.pop((mutation.section, mutation.key), None)
+        if not future.cancelled() and future.exception() is None:
+            return  # Confirmed, the echo from the hub has replaced the record
+        rolled_back = False
+        for mutation in mutations:
+            # Leave the record alone if it has been replaced by the hub or changed again since
+            if getattr(self, mutation.section).get(mutation.key) is not mutation.record:
+                continue
+            if any(mutation.record.get(field) != value for field, value in mutation.new.items()):
+                continue
+            mutation.record.update(mutation.old)
+            self._invalidate_zone_modes(mutation.section, mutation.record)
+            self._touch(mutation.section)
+            self._publish_rollback(mutation)
+            rolled_back = True
+            _LOGGER.warning('rolled back %s %s to %s: %s', mutation.section, mutation.key, mutation.old,
+                            'cancelled' if future.cancelled() else future.exception())
+        if rolled_back:
+            for callback in self._callbacks:
+                callback(self)
+
+    def _handle_hub_error(self, response: list[str]) -> None:
+        """Fail the oldest pending command matching an error response: E00 <command> <message>."""
+        error = PynoboHubError(response[0], response[1] if len(response) > 1 else '', ' '.join(response[2:]))
+        self.error_counts[error.command] += 1
+        self.last_error = error
+        for pending in self._pending_commands.get(error.command, ()):
+            if not pending.future.done():
+                self._pending_commands[error.command].remove(pending)
+                pending.future.set_exception(error)
+                _LOGGER.warning('hub failed to execute %s %s: %s', error.command, pending.key, error)
+                return
+        _LOGGER.error('error from hub: %s', error)
+
+    def _fail_pending_commands(self, error: PynoboError) -> None:
+        """Fail all commands waiting for the hub, e.g. when the connection is lost."""
+        for queue in list(self._pending_commands.values()):
+            for pending in list(queue):
+                if not pending.future.done():
+                    pending.future.set_exception(error)
+
+    def _write_command(self, commands: list[Any]) -> None:
+        """
+        Encode a command and buffer it on the writer, without waiting for it to drain.
+
+        :param commands: list of commands, either strings or integers
+        """
+        _LOGGER.debug('sending: %s', commands)
+        self._writer.write(encode_command(commands))
 
     async def _get_initial_data(self) -> None:
+        """
+        Load all information from the hub, for as long as it keeps sending. Records are counted
+        in initial_data_progress and published to event streams as they arrive.
+        """
         self._received_all_info = False
-        await self.async_send_command([nobo.API.GET_ALL_INFO])
-        while not self._received_all_info:
-            self.response_handler(await self.get_response())
+        self.initial_data_progress = collections.Counter()
+        self._protocol.request_initial_data()
+        await self._async_write_protocol()
+        # A single watchdog for the whole load rather than a timeout per record: it re-arms itself
+        # while records keep coming, and cancels the load once nothing has arrived for the timeout.
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        self._last_recv_at = time.monotonic()
+        idle = False
+
+        def check_idle() -> None:
+            nonlocal watchdog, idle
+            remaining = self._last_recv_at + INITIAL_DATA_IDLE_TIMEOUT - time.monotonic()
+            if remaining > 0:
+                watchdog = loop.call_later(remaining, check_idle)
+            else:
+                idle = True
+                task.cancel()
+
+        watchdog = loop.call_later(INITIAL_DATA_IDLE_TIMEOUT, check_idle)
+        try:
+            while self._protocol.state != HubProtocol.CONNECTED:
+                response = await self.get_response()
+                self._protocol.handle(response)
+                changed = self.response_handler(response)
+                self.initial_data_progress[nobo._RESPONSE_SECTIONS.get(response[0], response[0])] += 1
+                if changed is None or changed:
+                    self._publish(response, 'initial_data', changed)
+        except asyncio.CancelledError:
+            if not idle:
+                raise
+            if hasattr(task, 'uncancel'):  # Python 3.11+
+                task.uncancel()
+            raise PynoboConnectionError(
+                f'Timed out waiting for initial data from {self.hub_ip} after receiving {dict(self.initial_data_progress)}'
+            ) from None
+        finally:
+            watchdog.cancel()
 
     async def get_response(self) -> list[str]:
         """
@@ -859,14 +1680,13 @@ class nobo:
         :return: a single response as a list of strings where each string is a field
         """
         try:
-            message = await self._reader.readuntil(b'\r')
-            message = message[:-1]
+            message = await self._reader.readuntil(SEPARATOR)
         except ConnectionError as e:
             _LOGGER.info('lost connection to hub (%s)', e)
             await self.close()
             raise PynoboConnectionError(f'Lost connection to Nobø Ecohub: {e}') from e
         self._last_recv_at = time.monotonic()
-        response  = message.decode('utf-8').split(' ')
+        response = decode_response(message)
         _LOGGER.debug('received: %s', response)
         return response
 
@@ -876,14 +1696,17 @@ class nobo:
                 try:
                     response = await self.get_response()
                     if response[0] == nobo.API.HANDSHAKE:
-                        pass # Handshake, no action needed
-                    elif response[0] == 'E':
-                        _LOGGER.error('error! what did you do? %s', response)
-                        # TODO: Raise something here?
-                    else:
+                        self._keep_alive_echoed()
+                    elif response[0].startswith('E'):
+                        # Only fails the command causing the error, no need to notify callbacks
                         self.response_handler(response)
+                    else:
+                        changed = self.response_handler(response)
+                        if changed is not None and not changed:
+                            continue  # Nothing new, e.g. the hub repeating a record
                         for callback in self._callbacks:
                             callback(self)
+                        self._publish(response, changed=changed)
                 except asyncio.IncompleteReadError:
                     _LOGGER.info('connection to hub closed by peer; reconnecting')
                     self._set_connected(False)
@@ -915,13 +1738,29 @@ class nobo:
             # Just disconnect (instead of risking an infinite reconnect loop)
             await self.stop()
 
-    def response_handler(self, response: list[str]) -> None:
+    def response_handler(self, response: list[str]) -> frozenset[str] | None:
         """
         Handle the response(s) from the hub and update the dictionaries accordingly.
 
+        Records equal to the stored record are not stored again, and counted in suppressed_updates,
+        as are temperatures held back by the temperature filter (stored, but not to be notified).
+
         :param response: list of strings where each string is a field
+
+        :return: the changed fields of the record, empty if there is nothing to notify, or None if
+            the response is not a state record
         """
 
+        if self._journal is not None:
+            try:
+                self._journal.append(getattr(self, 'hub_serial', self.serial), response)
+            except Exception as e:
+                # Journaling must never stop the state from being updated
+                _LOGGER.error('failed to journal response %s: %s', response, e)
+
+        self._acknowledge_command(response)
+        changed = None
+
         # All info incoming, clear existing info
         if response[0] == nobo.API.RESPONSE_SENDING_ALL_INFO:
             self._received_all_info = False
@@ -930,12 +1769,20 @@ class nobo:
             self.components = {}
             self.week_profiles = {}
             self.overrides = {}
+            for override_id in list(self._override_windows):
+                self._index_override(override_id, None)
+            self._invalidate_zone_modes('zones', None)
+            self._touch('hub_info', 'zones', 'components', 'week_profiles', 'overrides')
 
         # The added/updated info messages
         elif response[0] in [nobo.API.RESPONSE_ZONE_INFO, nobo.API.RESPONSE_ADD_ZONE , nobo.API.RESPONSE_UPDATE_ZONE]:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_ZONE, response[1:]))
-            self.zones[dicti['zone_id']] = dicti
-            _LOGGER.info('added/updated zone: %s', dicti['name'])
+            changed = self._changed_fields('zones', dicti['zone_id'], self.zones.get(dicti['zone_id'], {}), dicti)
+            if changed:
+                self.zones[dicti['zone_id']] = dicti
+                self._invalidate_zone_modes('zones', dicti)
+                self._touch('zones')
+                _LOGGER.info('added/updated zone: %s', dicti['name'])
 
         elif response[0] in [nobo.API.RESPONSE_COMPONENT_INFO, nobo.API.RESPONSE_ADD_COMPONENT , nobo.API.RESPONSE_UPDATE_COMPONENT]:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_COMPONENT, response[1:]))
@@ -943,7 +1790,10 @@ class nobo:
                 dicti['zone_id'] = dicti['tempsensor_for_zone_id']
             serial = dicti['serial']
             model_id = serial[:3]
-            if model_id in nobo.MODELS:
+            old = self.components.get(serial, {})
+            if 'model' in old:
+                dicti['model'] = old['model']
+            elif model_id in nobo.MODELS:
                 dicti['model'] = nobo.MODELS[model_id]
             else:
                 dicti['model'] = nobo.Model(
@@ -951,51 +1801,93 @@ class nobo:
                     nobo.Model.UNKNOWN,
                     f'Unknown (serial number: {serial[:3]} {serial[3:6]} {serial[6:9]} {serial[9:]})'
                 )
-            self.components[dicti['serial']] = dicti
-            _LOGGER.info('added/updated component: %s', dicti['name'])
+            changed = self._changed_fields('components', serial, old, dicti)
+            if changed:
+                self.components[dicti['serial']] = dicti
+                self._touch('components')
+                _LOGGER.info('added/updated component: %s', dicti['name'])
 
         elif response[0] in [nobo.API.RESPONSE_WEEK_PROFILE_INFO, nobo.API.RESPONSE_ADD_WEEK_PROFILE, nobo.API.RESPONSE_UPDATE_WEEK_PROFILE]:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_WEEK_PROFILE, response[1:]))
             dicti['profile'] = response[-1].split(',')
-            self.week_profiles[dicti['week_profile_id']] = dicti
-            _LOGGER.info('added/updated week profile: %s', dicti['name'])
+            changed = self._changed_fields('week_profiles', dicti['week_profile_id'], self.week_profiles.get(dicti['week_profile_id'], {}), dicti)
+            if changed:
+                self.week_profiles[dicti['week_profile_id']] = dicti
+                self._invalidate_zone_modes('week_profiles', dicti)
+                self._touch('week_profiles')
+                _LOGGER.info('added/updated week profile: %s', dicti['name'])
 
         elif response[0] in [nobo.API.RESPONSE_OVERRIDE_INFO, nobo.API.RESPONSE_ADD_OVERRIDE]:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_OVERRIDE, response[1:]))
-            self.overrides[dicti['override_id']] = dicti
-            _LOGGER.info('added/updated override: id %s', dicti['override_id'])
+            changed = self._changed_fields('overrides', dicti['override_id'], self.overrides.get(dicti['override_id'], {}), dicti)
+            if changed:
+                self._invalidate_zone_modes('overrides', self.overrides.get(dicti['override_id']))
+                self.overrides[dicti['override_id']] = dicti
+                self._index_override(dicti['override_id'], dicti)
+                self._invalidate_zone_modes('overrides', dicti)
+                self._touch('overrides')
+                _LOGGER.info('added/updated override: id %s', dicti['override_id'])
 
         elif response[0] in [nobo.API.RESPONSE_HUB_INFO, nobo.API.RESPONSE_UPDATE_HUB_INFO]:
-            self.hub_info = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_HUB, response[1:]))
-            _LOGGER.info('updated hub info: %s', self.hub_info)
+            dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_HUB, response[1:]))
+            changed = self._changed_fields('hub_info', None, self.hub_info, dicti)
+            if changed:
+                self.hub_info = dicti
+                self._touch('hub_info')
+                _LOGGER.info('updated hub info: %s', self.hub_info)
             if response[0] == nobo.API.RESPONSE_HUB_INFO:
                 self._received_all_info = True
 
         # The removed info messages
         elif response[0] == nobo.API.RESPONSE_REMOVE_ZONE:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_ZONE, response[1:]))
-            self.zones.pop(dicti['zone_id'], None)
-            _LOGGER.info('removed zone: %s', dicti['name'])
+            changed = self._removed_fields('zones', self.zones.pop(dicti['zone_id'], None))
+            if changed:
+                self._invalidate_zone_modes('zones', dicti)
+                self._touch('zones')
+                _LOGGER.info('removed zone: %s', dicti['name'])
 
         elif response[0] == nobo.API.RESPONSE_REMOVE_COMPONENT:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_COMPONENT, response[1:]))
-            self.components.pop(dicti['serial'], None)
-            _LOGGER.info('removed component: %s', dicti['name'])
+            changed = self._removed_fields('components', self.components.pop(dicti['serial'], None))
+            if changed:
+                self._touch('components')
+                _LOGGER.info('removed component: %s', dicti['name'])
 
         elif response[0] == nobo.API.RESPONSE_REMOVE_WEEK_PROFILE:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_WEEK_PROFILE, response[1:]))
-            self.week_profiles.pop(dicti['week_profile_id'], None)
-            _LOGGER.info('removed week profile: %s', dicti['name'])
+            changed = self._removed_fields('week_profiles', self.week_profiles.pop(dicti['week_profile_id'], None))
+            if changed:
+                self._invalidate_zone_modes('week_profiles', dicti)
+                self._touch('week_profiles')
+                _LOGGER.info('removed week profile: %s', dicti['name'])
 
         elif response[0] == nobo.API.RESPONSE_REMOVE_OVERRIDE:
             dicti = collections.OrderedDict(zip(nobo.API.STRUCT_KEYS_OVERRIDE, response[1:]))
-            self.overrides.pop(dicti['override_id'], None)
-            _LOGGER.info('removed override: %s', dicti['override_id'])
+            removed = self.overrides.pop(dicti['override_id'], None)
+            changed = self._removed_fields('overrides', removed)
+            if changed:
+                self._index_override(dicti['override_id'], None)
+                self._invalidate_zone_modes('overrides', removed)
+                self._touch('overrides')
+                _LOGGER.info('removed override: %s', dicti['override_id'])
 
         # Component temperature data
         elif response[0] == nobo.API.RESPONSE_COMPONENT_TEMP:
-            self.temperatures[response[1]] = response[2]
-            _LOGGER.info('updated temperature from %s: %s', response[1], response[2])
+            serial, temperature = response[1], response[2]
+            changed = frozenset()
+            if self.temperatures.get(serial) != temperature:
+                self.temperatures[serial] = temperature
+                self._touch('temperatures')
+                _LOGGER.info('updated temperature from %s: %s', serial, temperature)
+                if self._notify_temperature(serial, temperature):
+                    changed = frozenset(('temperature',))
+            elif serial in self._held_temperatures and self._notify_temperature(serial, temperature):
+                # The same value again, after a change held back by the interval
+                changed = frozenset(('temperature',))
+            if not changed:
+                self.suppressed_updates['temperatures'] += 1
+                self.suppressed_temperatures[serial] += 1
 
         # Internet settings
         elif response[0] == nobo.API.RESPONSE_UPDATE_INTERNET_ACCESS:
@@ -1005,10 +1897,312 @@ class nobo:
                 encryption_key = (encryption_key << 8) + int(response[i])
             _LOGGER.info('internet enabled: %s, key: %s', internet_access, hex(encryption_key))
 
+        # Error executing a command
+        elif response[0].startswith('E'):
+            self._handle_hub_error(response)
+
         else:
             _LOGGER.warning('behavior undefined for this response: %s', response)
             warnings.warn(f'behavior undefined for this response: {response}') #overkill?
 
+        return changed
+
+    def _changed_fields(self, section: str, key: str | None, old: Mapping[str, Any], new: Mapping[str, Any]) -> frozenset[str]:
+        """
+        Compare a received record with the stored record field by field, counting duplicates.
+
+        Fields saved before the hub echoed the change count as changed, as the saved change was
+        never notified.
+        """
+        unconfirmed = self._unconfirmed.pop((section, key), ())
+        changed = frozenset(field for field, value in new.items() if field in unconfirmed or old.get(field) != value)
+        if not changed:
+            self.suppressed_updates[section] += 1
+        return changed
+
+    def _notify_temperature(self, serial: str, temperature: str) -> bool:
+        """
+        Whether a stored temperature passes the deadband and interval of the component. A change
+        arriving before the interval has passed is held back, and notified when it has passed.
+        """
+        deadband, min_interval = self._temperature_filters.get(serial) or self._temperature_filters[None]
+        try:
+            value = float(temperature)
+        except ValueError:
+            value = math.nan
+        now = time.monotonic()
+        notified = self._notified_temperatures.get(serial)
+        if notified is not None:
+            last_value, last_at = notified
+            if round(abs(value - last_value), 6) < deadband:
+                self._release_temperature(serial)  # Back within the deadband, nothing left to notify
+                return False
+            if now - last_at < min_interval:
+                self._hold_temperature(serial, last_at + min_interval - now)
+                return False
+        self._release_temperature(serial)
+        self._notified_temperatures[serial] = (value, now)
+        return True
+
+    def _hold_temperature(self, serial: str, delay: float) -> None:
+        """Schedule the notification of a held back temperature, unless already scheduled."""
+        if self._held_temperatures.get(serial) is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._held_temperatures[serial] = None  # Notified by the next update instead
+            return
+        self._held_temperatures[serial] = loop.call_later(delay, self._flush_temperature, serial)
+
+    def _release_temperature(self, serial: str) -> None:
+        timer = self._held_temperatures.pop(serial, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _flush_temperature(self, serial: str) -> None:
+        """Notify a temperature held back by the interval, once the interval has passed."""
+        self._held_temperatures[serial] = None
+        temperature = self.temperatures.get(serial)
+        if temperature is None:
+            self._held_temperatures.pop(serial)
+            return
+        if self._notify_temperature(serial, temperature):
+            for callback in self._callbacks:
+                callback(self)
+            self._publish([nobo.API.RESPONSE_COMPONENT_TEMP, serial, temperature], changed=frozenset(('temperature',)))
+
+    def _removed_fields(self, section: str, removed: Mapping[str, Any] | None) -> frozenset[str]:
+        """The fields of a removed record, counting removals of unknown records as duplicates."""
+        if removed is None:
+            self.suppressed_updates[section] += 1
+            return frozenset()
+        return frozenset(removed)
+
+    def _touch(self, *sections: str) -> None:
+        """Bump the state version and the version of the changed sections."""
+        self._version += 1
+        for section in sections:
+            self._section_versions[section] = self._version
+
+    def _invalidate_zone_modes(self, section: str, record: Mapping[str, Any] | None) -> None:
+        """Forget the cached mode of the zones affected by a changed zone, week profile or override record."""
+        if record is None:
+            if section == 'overrides':
+                return  # Removing an unknown override changes nothing
+            zone_ids = set(self._zone_modes) | set(self._watched_zone_modes or ()) | set(self.zones)
+        elif section == 'zones':
+            zone_ids = {record['zone_id']}
+        elif section == 'week_profiles':
+            zone_ids = {zone_id for zone_id, zone in self.zones.items() if zone['week_profile_id'] == record['week_profile_id']}
+        elif section == 'overrides':
+            if record['target_type'] == nobo.API.OVERRIDE_TARGET_ZONE:
+                zone_ids = {record['target_id']}
+            else:
+                zone_ids = set(self._zone_modes) | set(self.zones)
+        for zone_id in zone_ids:
+            self._zone_modes.pop(zone_id, None)
+        if self._watched_zone_modes is not None and zone_ids:
+            # Check for mode changes once the current batch of responses has been handled
+            if not self._changed_zone_modes:
+                self._transition_loop.call_soon(self._check_zone_modes)
+            self._changed_zone_modes |= zone_ids
+
+    def register_zone_mode_callback(self, callback: Callable[["nobo", str, str], None]) -> None:
+        """
+        Register a callback notified when the effective mode of a zone changes, also when changed by
+        the week profile. Called with the nobo instance, the zone id and the new mode. Only called
+        while the hub is started. The callback MUST be safe to call from the event loop.
+
+        :param callback: a callback method
+        """
+        self._zone_mode_callbacks.append(callback)
+
+    def deregister_zone_mode_callback(self, callback: Callable[["nobo", str, str], None]) -> None:
+        """
+        Deregister a previously registered zone mode callback.
+
+        :param callback: a callback method
+        """
+        self._zone_mode_callbacks.remove(callback)
+
+    def _watch_zone_modes(self) -> None:
+        """Start notifying zone mode changes, with a timer at the next week profile transition."""
+        if self._watched_zone_modes is not None:
+            return
+        self._transition_loop = asyncio.get_running_loop()
+        self._watched_zone_modes = {}
+        self._changed_zone_modes = set(self.zones)
+        self._check_zone_modes()
+        self._schedule_override_time()
+
+    def _unwatch_zone_modes(self) -> None:
+        if self._override_timer is not None:
+            self._override_timer.cancel()
+            self._override_timer = None
+        if self._transition_timer is not None:
+            self._transition_timer.cancel()
+        self._transition_timer = None
+        self._transition_at = None
+        self._transitions = []
+        self._watched_zone_modes = None
+        self._changed_zone_modes = set()
+
+    def _check_zone_modes(self) -> None:
+        """Find the zones changing mode, notify consumers and schedule the next transitions."""
+        if self._watched_zone_modes is None:
+            return
+        zone_ids, self._changed_zone_modes = self._changed_zone_modes, set()
+        now = time.time()
+        while self._transitions and self._transitions[0][0] <= now:
+            zone_ids.add(heapq.heappop(self._transitions)[1])
+        changed = []
+        for zone_id in sorted(zone_ids):
+            try:
+                mode = self.get_current_zone_mode(zone_id)
+            except KeyError:
+                # Removed zone, or its week profile is not known yet
+                self._watched_zone_modes.pop(zone_id, None)
+                continue
+            expires = self._zone_modes[zone_id][1]
+            if expires is not None:
+                heapq.heappush(self._transitions, (expires, zone_id))
+            previous = self._watched_zone_modes.get(zone_id)
+            self._watched_zone_modes[zone_id] = mode
+            if previous is not None and previous != mode:
+                changed.append((zone_id, mode))
+        # Drop entries for zones rescheduled to another time
+        self._transitions = list({(when, zone_id) for (when, zone_id) in self._transitions
+                                  if zone_id in self._zone_modes and self._zone_modes[zone_id][1] == when})
+        heapq.heapify(self._transitions)
+        self._schedule_transition()
+        for zone_id, mode in changed:
+            _LOGGER.info('zone %s changed mode to %s', zone_id, mode)
+            for callback in self._zone_mode_callbacks:
+                callback(self, zone_id, mode)
+            self._publish_zone_mode(zone_id)
+
+    def _schedule_transition(self) -> None:
+        """Keep a single timer for the earliest transition."""
+        when = self._transitions[0][0] if self._transitions else None
+        if when == self._transition_at:
+            return
+        if self._transition_timer is not None:
+            self._transition_timer.cancel()
+            self._transition_timer = None
+        self._transition_at = when
+        if when is not None:
+            self._transition_timer = self._transition_loop.call_later(max(0.0, when - time.time()), self._on_transition)
+
+    def _on_transition(self) -> None:
+        self._transition_timer = None
+        self._transition_at = None
+        self._check_zone_modes()
+
+    @property
+    def version(self) -> int:
+        """Monotonically increasing version of the hub state, bumped on every change."""
+        return self._version
+
+    def snapshot(self) -> nobo.Snapshot:
+        """
+        Get an immutable, versioned view of the complete hub state.
+
+        Can be called from any thread. Sections and records are copied on write: an unchanged
+        hub returns the same snapshot object, and a new snapshot only copies the sections that
+        changed, sharing unchanged records with the previous snapshot.
+
+        :return: the current hub state
+        """
+        version = self._version
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        sections = {}
+        for section in nobo.STATE_SECTIONS:
+            # Read the section version before copying, so a concurrent change is never missed
+            section_version = self._section_versions[section]
+            cached = self._snapshot_sections.get(section)
+            if cached is None or cached[0] != section_version:
+                cached = (section_version, self._freeze_section(section, cached[1] if cached else None))
+                self._snapshot_sections[section] = cached
+            sections[section] = cached[1]
+        snapshot = nobo.Snapshot(version=version, **sections)
+        self._snapshot = snapshot
+        return snapshot
+
+    def _freeze_section(self, section: str, previous: Mapping[str, Any] | None) -> Mapping[str, Any]:
+        """Return a read-only copy of a state section, reusing unchanged records from `previous`."""
+        # dict() copies are atomic, so this is safe while the event loop thread updates the state
+        data = dict(getattr(self, section))
+        if section in ('hub_info', 'temperatures'):
+            return types.MappingProxyType(data)
+        frozen = {}
+        for key, record in data.items():
+            record = dict(record)
+            if 'profile' in record:
+                record['profile'] = tuple(record['profile'])
+            cached = previous.get(key) if previous is not None else None
+            frozen[key] = cached if cached == record else types.MappingProxyType(record)
+        return types.MappingProxyType(frozen)
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Get the complete hub state as JSON compatible dictionaries, see to_json().
+
+        :return: a new copy of the state, safe to modify
+        """
+        return json.loads(self.to_json())
+
+    def to_json(self) -> bytes:
+        """
+        Get the complete hub state encoded as JSON:
+
+            {"version": 42, "hub_info": {...}, "zones": {"1": {...}}, "components": {...},
+             "week_profiles": {...}, "overrides": {...}, "temperatures": {"186170024143": "21.5"}}
+
+        Sections and records are keyed as in snapshot(), and field values are strings as sent by the
+        hub, except the profile of a week profile (a list of strings) and the model of a component
+        (the properties of nobo.Model). Can be called from any thread. The encoded state is cached:
+        an unchanged hub returns the same bytes, and only the sections that changed are encoded again.
+
+        :return: the state as UTF-8 encoded JSON
+        """
+        version = self._version
+        cached = self._json
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        parts = [b'{"version":%d' % version]
+        for section in nobo.STATE_SECTIONS:
+            # Read the section version before encoding, so a concurrent change is never missed
+            section_version = self._section_versions[section]
+            encoded = self._json_sections.get(section)
+            if encoded is None or encoded[0] != section_version:
+                data = json.dumps(self._export_section(section), ensure_ascii=False, separators=(',', ':'))
+                encoded = (section_version, data.encode('utf-8'))
+                self._json_sections[section] = encoded
+            parts.append(b',"%s":%s' % (section.encode('ascii'), encoded[1]))
+        parts.append(b'}')
+        data = b''.join(parts)
+        self._json = (version, data)
+        return data
+
+    def _export_section(self, section: str) -> dict[str, Any]:
+        """Return a JSON compatible copy of a state section."""
+        # dict() copies are atomic, so this is safe while the event loop thread updates the state
+        data = dict(getattr(self, section))
+        if section in ('hub_info', 'temperatures'):
+            return {key: str(value) for key, value in data.items()}
+        return {key: {field: nobo._export_value(value) for field, value in dict(record).items()} for key, record in data.items()}
+
+    @staticmethod
+    def _export_value(value: Any) -> Any:
+        if isinstance(value, nobo.Model):
+            return value.to_dict()
+        if isinstance(value, (list, tuple)):
+            return [str(item) for item in value]
+        return str(value)
+
     def create_override(
         self,
         mode: str,
@@ -1034,6 +2228,7 @@ class nobo:
         target_id: str = '-1',
         end_time: str = '-1',
         start_time: str = '-1',
+        wait: bool = False,
     ) -> None:
         """
         Override hub/zones/components. Use OVERRIDE_MODE_NORMAL to disable an existing override.
@@ -1044,7 +2239,53 @@ class nobo:
         :param target_id: the target id (default -1)
         :param end_time: the end time (default -1), format YYYYMMDDhhmm, where mm must be in whole 15 minutes
         :param start_time: the start time (default -1), format YYYYMMDDhhmm, where mm must be in whole 15 minutes
+        :param wait: wait for the hub to acknowledge the override, raising PynoboHubError or PynoboTimeoutError on failure (default False)
         """
+        command = self._build_override_command(mode, type, target_type, target_id, end_time, start_time)
+        [mutations] = self._save_overrides([command])
+        future = self._track_command(command, COMMAND_TIMEOUT)
+        self._track_mutations(future, mutations)
+        await self.async_send_command(command)
+        if wait:
+            await future
+
+    async def async_create_overrides(
+        self,
+        overrides: list[dict[str, str]],
+        wait: bool = False,
+        timeout: float = COMMAND_TIMEOUT,
+    ) -> list[PynoboError | None]:
+        """
+        Create several overrides with a single write to the hub.
+
+        All overrides are validated before anything is sent.
+
+        :param overrides: list of dicts with the arguments of async_create_override, e.g.
+            [{'mode': API.OVERRIDE_MODE_ECO, 'type': API.OVERRIDE_TYPE_CONSTANT, 'target_type': API.OVERRIDE_TARGET_ZONE, 'target_id': '1'}]
+        :param wait: wait for the hub to acknowledge all overrides (default False)
+        :param timeout: seconds to wait for the acknowledgements (default COMMAND_TIMEOUT)
+
+        :return: for each override, None if created (or sent, if not waiting), otherwise the error
+        """
+        commands = []
+        for override in overrides:
+            unknown = override.keys() - nobo._OVERRIDE_ARGUMENTS
+            if unknown:
+                raise PynoboValidationError(f'Unknown override arguments {sorted(unknown)}')
+            commands.append(self._build_override_command(**override))
+        mutations = self._save_overrides(commands)
+        return await self._async_send_commands(commands, wait, timeout, mutations)
+
+    def _build_override_command(
+        self,
+        mode: str,
+        type: str,
+        target_type: str,
+        target_id: str = '-1',
+        end_time: str = '-1',
+        start_time: str = '-1',
+    ) -> list[str]:
+        """Validate the arguments of async_create_override and build the command."""
         if not mode in nobo.API.OVERRIDE_MODES:
             raise PynoboValidationError(f'Unknown override mode {mode}')
         if not type in nobo.API.OVERRIDE_TYPES:
@@ -1063,12 +2304,27 @@ class nobo:
                 raise PynoboValidationError(f'Illegal start_time: {start_time}: Cannot parse')
             if not nobo.API.time_is_quarter(end_time[-2:]):
                 raise PynoboValidationError(f'Illegal start_time {end_time}: Must be in whole 15 minutes')
-        command = [nobo.API.ADD_OVERRIDE, '1', mode, type, end_time, start_time, target_type, target_id]
-        await self.async_send_command(command)
-        for o in self.overrides: # Save override before command has finished executing
-            if self.overrides[o]['target_id'] == target_id:
-                self.overrides[o]['mode'] = mode
-                self.overrides[o]['type'] = type
+        return [nobo.API.ADD_OVERRIDE, '1', mode, type, end_time, start_time, target_type, target_id]
+
+    def _save_overrides(self, commands: list[list[str]]) -> list[list[_Mutation]]:
+        """
+        Save override mode and type before the commands have finished executing.
+
+        :return: for each command, the changes to roll back if the command fails
+        """
+        targets = {command[7]: index for index, command in enumerate(commands)}
+        mutations: list[list[_Mutation]] = [[] for _command in commands]
+        for override_id, override in self.overrides.items():
+            index = targets.get(override['target_id'])
+            if index is not None:
+                mutation = _Mutation('overrides', override_id, override, {'mode': commands[index][2], 'type': commands[index][3]})
+                override.update(mutation.new)
+                self._unconfirmed.setdefault(('overrides', override_id), set()).update(mutation.new)
+                self._invalidate_zone_modes('overrides', override)
+                mutations[index].append(mutation)
+        if any(mutations):
+            self._touch('overrides')
+        return mutations
 
     def update_zone(
         self,
@@ -1095,6 +2351,7 @@ class nobo:
         temp_comfort_c: int | str | None = None,
         temp_eco_c: int | str | None = None,
         override_allowed: str | None = None,
+        wait: bool = False,
     ) -> None:
         """
         Update the name, week profile, temperature or override allowing for a zone.
@@ -1105,6 +2362,57 @@ class nobo:
         :param temp_comfort_c: the new comfort temperature (default None)
         :param temp_eco_c: the new eco temperature (default None)
         :param override_allowed: the new override allow setting (default None)
+        :param wait: wait for the hub to acknowledge the update, raising PynoboHubError or PynoboTimeoutError on failure (default False)
+        """
+        command, saved = self._build_update_zone_command(zone_id, name, week_profile_id, temp_comfort_c, temp_eco_c, override_allowed)
+        mutations = self._save_zone(zone_id, saved)
+        future = self._track_command(command, COMMAND_TIMEOUT)
+        self._track_mutations(future, mutations)
+        await self.async_send_command(command)
+        if wait:
+            await future
+
+    async def async_update_zones(
+        self,
+        changes: dict[str, dict[str, Any]],
+        wait: bool = False,
+        timeout: float = COMMAND_TIMEOUT,
+    ) -> dict[str, PynoboError | None]:
+        """
+        Update several zones with a single write to the hub.
+
+        All changes are validated before anything is sent.
+
+        :param changes: dict of zone id to a dict with the arguments of async_update_zone, e.g.
+            {'1': {'temp_comfort_c': 22}, '2': {'temp_eco_c': 16}}
+        :param wait: wait for the hub to acknowledge all updates (default False)
+        :param timeout: seconds to wait for the acknowledgements (default COMMAND_TIMEOUT)
+
+        :return: dict of zone id to None if updated (or sent, if not waiting), otherwise the error
+        """
+        commands = {}
+        for zone_id, zone_changes in changes.items():
+            unknown = zone_changes.keys() - nobo._UPDATE_ZONE_ARGUMENTS
+            if unknown:
+                raise PynoboValidationError(f'Unknown zone update arguments {sorted(unknown)}')
+            commands[zone_id] = self._build_update_zone_command(zone_id, **zone_changes)
+        mutations = [self._save_zone(zone_id, saved) for zone_id, (_command, saved) in commands.items()]
+        results = await self._async_send_commands([command for command, _saved in commands.values()], wait, timeout, mutations)
+        return dict(zip(commands, results))
+
+    def _build_update_zone_command(
+        self,
+        zone_id: str,
+        name: str | None = None,
+        week_profile_id: str | None = None,
+        temp_comfort_c: int | str | None = None,
+        temp_eco_c: int | str | None = None,
+        override_allowed: str | None = None,
+    ) -> tuple[list[Any], dict[str, Any]]:
+        """
+        Validate the arguments of async_update_zone and build the command.
+
+        :return: the command, and the settings to save before the command has finished executing
         """
 
         if not zone_id in self.zones:
@@ -1112,6 +2420,7 @@ class nobo:
 
         # Initialize command with the current zone settings
         command = [nobo.API.UPDATE_ZONE] + list(self.zones[zone_id].values())
+        saved = {}
 
         # Replace command with arguments that are not None.
         if name:
@@ -1126,11 +2435,11 @@ class nobo:
         if temp_comfort_c:
             nobo.API.validate_temperature(temp_comfort_c)
             command[4] = temp_comfort_c
-            self.zones[zone_id]['temp_comfort_c'] = temp_comfort_c # Save setting before sending command
+            saved['temp_comfort_c'] = temp_comfort_c
         if temp_eco_c:
             nobo.API.validate_temperature(temp_eco_c)
             command[5] = temp_eco_c
-            self.zones[zone_id]['temp_eco_c'] = temp_eco_c # Save setting before sending command
+            saved['temp_eco_c'] = temp_eco_c
         if override_allowed:
             if override_allowed != nobo.API.OVERRIDE_NOT_ALLOWED and override_allowed != nobo.API.OVERRIDE_ALLOWED:
                 raise PynoboValidationError(f'Illegal value for override allowed: {override_allowed}')
@@ -1138,7 +2447,22 @@ class nobo:
         if int(command[4]) < int(command[5]):
             raise PynoboValidationError(f'Comfort temperature({command[4]}°C) cannot be less than eco temperature({command[5]}°C)')
 
-        await self.async_send_command(command)
+        return command, saved
+
+    def _save_zone(self, zone_id: str, saved: dict[str, Any]) -> list[_Mutation]:
+        """
+        Save zone settings before the command has finished executing.
+
+        :return: the changes to roll back if the command fails
+        """
+        if not saved:
+            return []
+        mutation = _Mutation('zones', zone_id, self.zones[zone_id], saved)
+        mutation.record.update(saved)
+        self._unconfirmed.setdefault(('zones', zone_id), set()).update(saved)
+        self._invalidate_zone_modes('zones', mutation.record)
+        self._touch('zones')
+        return [mutation]
 
 
     async def async_add_week_profile(self, name: str, profile: list[str] | None = None) -> None:
@@ -1252,33 +2576,146 @@ class nobo:
         )
         return nobo.API.DICT_WEEK_PROFILE_STATUS_TO_NAME[status]
 
-    def get_zone_override_mode(self, zone_id: str) -> str:
+    def _parse_override_time(self, value: str) -> float | None:
+        """Parse a start or end time of an override (yyyyMMddHHmm or -1) to a timestamp."""
+        if value == '-1':
+            return None
+        return datetime.datetime.strptime(value, '%Y%m%d%H%M').replace(tzinfo=self.timezone).timestamp()
+
+    def _index_override(self, override_id: str, record: Mapping[str, Any] | None) -> None:
+        """Update the override index for an added or updated override record, or a removed override (None)."""
+        window = self._override_windows.pop(override_id, None)
+        if window is not None:
+            with suppress(ValueError):
+                self._override_target_list(window, create=False).remove(override_id)
+        if record is None:
+            return
+        try:
+            start = self._parse_override_time(record['start_time'])
+            end = self._parse_override_time(record['end_time'])
+        except ValueError:
+            _LOGGER.warning('invalid time in override %s: %s - %s', override_id, record['start_time'], record['end_time'])
+            start = end = None
+        window = self._override_windows[override_id] = _OverrideWindow(record['target_type'], record['target_id'], start, end)
+        now = time.time()
+        if end is None or end > now:
+            self._override_target_list(window).append(override_id)
+        for when, kind in ((start, 'override_activated'), (end, 'override_expired')):
+            if when is not None and when > now:
+                heapq.heappush(self._override_times, (when, override_id, kind))
+        if self._watched_zone_modes is not None:
+            self._schedule_override_time()
+
+    def _override_target_list(self, window: _OverrideWindow, create: bool = True) -> list[str]:
+        """The list of indexed overrides for the target of an override."""
+        if window.target_type == nobo.API.OVERRIDE_TARGET_GLOBAL:
+            return self._global_overrides
+        if window.target_type == nobo.API.OVERRIDE_TARGET_ZONE:
+            if create:
+                return self._zone_overrides.setdefault(window.target_id, [])
+            return self._zone_overrides.get(window.target_id, [])
+        return []  # Component overrides are not used for zone modes
+
+    def _schedule_override_time(self) -> None:
+        """Keep a timer for the earliest upcoming start or end of an override."""
+        if self._override_timer is not None:
+            self._override_timer.cancel()
+            self._override_timer = None
+        if self._override_times:
+            delay = max(0.0, self._override_times[0][0] - time.time())
+            self._override_timer = self._transition_loop.call_later(delay, self._on_override_time)
+
+    def _on_override_time(self) -> None:
+        """Publish the overrides starting or ending now, and prune ended overrides from the index."""
+        self._override_timer = None
+        now = time.time()
+        while self._override_times and self._override_times[0][0] <= now:
+            when, override_id, kind = heapq.heappop(self._override_times)
+            window = self._override_windows.get(override_id)
+            if window is None or when != (window.start if kind == 'override_activated' else window.end):
+                continue  # Removed or changed since
+            if kind == 'override_expired':
+                with suppress(ValueError):
+                    self._override_target_list(window, create=False).remove(override_id)
+            _LOGGER.info('%s: %s', kind.replace('_', ' '), override_id)
+            self._invalidate_zone_modes('overrides', {'target_type': window.target_type, 'target_id': window.target_id})
+            if self._event_streams:
+                event = nobo.Event(self._version, (), 'overrides', override_id, kind)
+                for stream in self._event_streams:
+                    stream._put(event)
+        self._schedule_override_time()
+
+    def _next_override_time(self, zone_id: str, at: float) -> float | None:
+        """Get the next start or end after a time of the overrides that can affect a zone."""
+        override_ids = list(self._zone_overrides.get(zone_id, ()))
+        if self._global_overrides and self.zones[zone_id]['override_allowed'] == '1':
+            override_ids += self._global_overrides
+        times = [when for override_id in override_ids
+                 for when in (self._override_windows[override_id].start, self._override_windows[override_id].end)
+                 if when is not None and when > at]
+        return min(times, default=None)
+
+    def get_override_window(self, override_id: str) -> tuple[datetime.datetime | None, datetime.datetime | None]:
+        """
+        Get the start and end time of an override.
+
+        :param override_id: the override id in question
+
+        :return: start and end time in timezone from initialization, None if not limited
         """
-        Get the override mode of a zone.
+        window = self._override_windows[override_id]
+        return tuple(None if when is None else datetime.datetime.fromtimestamp(when, self.timezone)
+                     for when in (window.start, window.end))
+
+    def _next_week_profile_transition(self, week_profile_id: str, dt: datetime.datetime) -> datetime.datetime:
+        """
+        Get the time of the next entry of a week profile after a certain time, at the latest the
+        next midnight, where the profile of the next weekday starts.
+        """
+        profile = self.week_profiles[week_profile_id]['profile']
+        target = (dt.hour*100) + dt.minute
+        weekday = 0
+        for timestamp in profile[1:]:
+            if timestamp[:4] == '0000':
+                weekday += 1
+                if weekday > dt.weekday():
+                    break
+            elif weekday == dt.weekday() and int(timestamp[:4]) > target:
+                return dt.replace(hour=int(timestamp[:2]), minute=int(timestamp[2:4]), second=0, microsecond=0)
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+
+    def get_zone_override_mode(self, zone_id: str, now: datetime.datetime | None = None) -> str:
+        """
+        Get the override mode of a zone. Overrides with a start or end time only apply within that time.
 
         :param zone_id: the zone id in question
+        :param now: datetime for the override mode in question (defaults to now)
 
         :return: the override mode for the zone
         """
+        at = time.time() if now is None else now.timestamp()
         mode = nobo.API.NAME_NORMAL
-        for o in self.overrides:
-            if self.overrides[o]['mode'] == '0':
-                continue # "normal" overrides
-            elif (self.overrides[o]['target_type'] == nobo.API.OVERRIDE_TARGET_ZONE
-                  and self.overrides[o]['target_id'] == zone_id):
-                mode = nobo.API.DICT_OVERRIDE_MODE_TO_NAME[self.overrides[o]['mode']]
+        for override_id in self._zone_overrides.get(zone_id, ()):
+            override = self.overrides[override_id]
+            if override['mode'] != nobo.API.OVERRIDE_MODE_NORMAL and self._override_windows[override_id].active(at):
+                mode = nobo.API.DICT_OVERRIDE_MODE_TO_NAME[override['mode']]
                 # Takes precedence over global override
                 break
-            elif (self.zones[zone_id]['override_allowed'] == '1'
-                  and self.overrides[o]['target_type'] == nobo.API.OVERRIDE_TARGET_GLOBAL):
-                mode = nobo.API.DICT_OVERRIDE_MODE_TO_NAME[self.overrides[o]['mode']]
+        else:
+            if self._global_overrides and self.zones[zone_id]['override_allowed'] == '1':
+                # The last global override takes precedence
+                for override_id in reversed(self._global_overrides):
+                    override = self.overrides[override_id]
+                    if override['mode'] != nobo.API.OVERRIDE_MODE_NORMAL and self._override_windows[override_id].active(at):
+                        mode = nobo.API.DICT_OVERRIDE_MODE_TO_NAME[override['mode']]
+                        break
 
         _LOGGER.debug('Current override for zone %s is %s', self.zones[zone_id]['name'], mode)
         return mode
 
     def get_current_zone_mode(self, zone_id: str, now: datetime.datetime | None = None) -> str:
         """
-        Get the mode of a zone at a certain time. If the zone is overridden only now is possible.
+        Get the mode of a zone at a certain time.
 
         :param zone_id: the zone id in question
         :param now: datetime for the status in question (defaults to now in timezone from initialization)
@@ -1286,11 +2723,26 @@ class nobo:
         :return: the mode for the zone
         """
         if now is None:
-            now = datetime.datetime.now(self.timezone)
-        current_mode = self.get_zone_override_mode(zone_id)
+            # The mode only changes with the state or at the next transition of the week profile
+            cached = self._zone_modes.get(zone_id)
+            at = time.time()
+            if cached is not None and (cached[1] is None or at < cached[1]):
+                return cached[0]
+            now = datetime.datetime.fromtimestamp(at, self.timezone)
+            cache = True
+        else:
+            cache = False
+        current_mode = self.get_zone_override_mode(zone_id, now)
+        expires = self._next_override_time(zone_id, now.timestamp()) if cache else None
         if current_mode == nobo.API.NAME_NORMAL:
             # no override - find mode from week profile
-            current_mode = self.get_week_profile_status(self.zones[zone_id]['week_profile_id'], now)
+            week_profile_id = self.zones[zone_id]['week_profile_id']
+            current_mode = self.get_week_profile_status(week_profile_id, now)
+            if cache:
+                transition = self._next_week_profile_transition(week_profile_id, now).timestamp()
+                expires = transition if expires is None else min(expires, transition)
+        if cache:
+            self._zone_modes[zone_id] = (current_mode, expires)
 
         _LOGGER.debug(
             'Current mode for zone %s at %s is %s',
@@ -1338,3 +2790,365 @@ class nobo:
         if current_temperature:
             _LOGGER.debug('Current temperature for zone %s is %s', self.zones[zone_id]['name'], current_temperature)
         return current_temperature
+
+
+class KeepAliveScheduler:
+    """
+    Send keep-alive handshakes and check liveness for many hubs from a single timer.
+
+    Instead of a keep_alive task per hub, registered hubs are kept in a heap ordered by
+    when they are next due. A single timer fires for the earliest hub and services every
+    hub due within `resolution` seconds in one pass. New hubs are spread evenly over the
+    interval so they don't all fire together.
+
+    Usage: `nobo(serial, ..., keep_alive_scheduler=KeepAliveScheduler.for_loop())`.
+    """
+
+    _instances: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, KeepAliveScheduler] = weakref.WeakKeyDictionary()
+
+    def __init__(self, interval: float = 14, resolution: float = 0.5) -> None:
+        """
+        :param interval: seconds between each handshake per hub. Default 14.
+        :param resolution: hubs due within this many seconds are serviced in the same wakeup. Default 0.5.
+        """
+        self.interval = interval
+        self.resolution = resolution
+        self.wakeups = 0
+        self._heap: list[tuple[float, int, nobo]] = []
+        self._entries: dict[nobo, int] = {}
+        self._sequence = itertools.count()
+        self._slot = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._timer_at: float | None = None
+        # Reconnects forced for silent hubs, referenced until done so they are not garbage collected
+        self._close_tasks: set[asyncio.Task[None]] = set()
+
+    @classmethod
+    def for_loop(cls, loop: asyncio.AbstractEventLoop | None = None) -> KeepAliveScheduler:
+        """
+        Get the shared scheduler for an event loop, creating it if needed.
+
+        :param loop: the event loop (default the running loop)
+        """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        scheduler = cls._instances.get(loop)
+        if scheduler is None:
+            scheduler = cls._instances[loop] = cls()
+        return scheduler
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def register(self, hub: nobo) -> None:
+        """
+        Start sending keep-alives to a hub.
+
+        :param hub: a connected nobo instance
+        """
+        self._loop = asyncio.get_running_loop()
+        hub._keep_alive = True
+        hub._last_recv_at = time.monotonic()
+        # Van der Corput sequence (0, 1/2, 1/4, 3/4, ...) gives an even spread for any number of hubs
+        offset, denominator, slot = 0.0, 1.0, self._slot
+        while slot:
+            denominator *= 2
+            slot, remainder = divmod(slot, 2)
+            offset += remainder / denominator
+        self._slot += 1
+        self._push(hub, self._loop.time() + self.interval * (1 - offset))
+
+    def unregister(self, hub: nobo) -> None:
+        """
+        Stop sending keep-alives to a hub. Its heap entry is discarded when it comes due.
+
+        :param hub: a registered nobo instance
+        """
+        self._entries.pop(hub, None)
+        if not self._entries and self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_at = None
+            self._heap.clear()
+
+    def _push(self, hub: nobo, due: float) -> None:
+        sequence = next(self._sequence)
+        self._entries[hub] = sequence
+        heapq.heappush(self._heap, (due, sequence, hub))
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """(Re)arm the timer for the earliest entry in the heap."""
+        if not self._heap:
+            return
+        due = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer_at <= due:
+                return
+            self._timer.cancel()
+        self._timer_at = due
+        self._timer = self._loop.call_at(due, self._run)
+
+    def _run(self) -> None:
+        """Service every hub due now, then re-arm the timer."""
+        self._timer = self._timer_at = None
+        self.wakeups += 1
+        now = self._loop.time()
+        while self._heap and self._heap[0][0] <= now + self.resolution:
+            due, sequence, hub = heapq.heappop(self._heap)
+            if self._entries.get(hub) != sequence:
+                continue  # unregistered or rescheduled
+            try:
+                self._service(hub)
+            except Exception:
+                _LOGGER.exception('keep-alive failed for hub %s', hub.serial)
+            sequence = next(self._sequence)
+            self._entries[hub] = sequence
+            heapq.heappush(self._heap, (due + self.interval, sequence, hub))
+        self._schedule()
+
+    def _service(self, hub: nobo) -> None:
+        """Check liveness and send a handshake to a single hub, as in nobo.keep_alive."""
+        if not hub._keep_alive or hub._writer is None:
+            return
+        if hub._liveness_expired(self.interval):
+            _LOGGER.info('no response from hub in %.1fs, forcing reconnect', time.monotonic() - hub._last_recv_at)
+            task = self._loop.create_task(hub.close())
+            self._close_tasks.add(task)
+            task.add_done_callback(self._close_tasks.discard)
+            return
+        hub._keep_alive_sent(self.interval)
+        # The handshake is tiny, so it is buffered without waiting for the writer to drain
+        if hub.command_scheduler is not None:
+            hub.command_scheduler.take(1, CommandScheduler.KEEP_ALIVE)
+        hub._write_command([nobo.API.HANDSHAKE])
+
+
+class _CommandWaiter:
+    """Commands waiting in a lane of a CommandScheduler."""
+
+    __slots__ = ('future', 'count', 'queued_at')
+
+    def __init__(self, future: asyncio.Future[int], count: int, queued_at: float) -> None:
+        self.future = future
+        self.count = count
+        self.queued_at = queued_at
+
+
+class CommandScheduler:
+    """
+    Limit the rate of commands sent to a hub, with priority lanes.
+
+    Commands take a token from a bucket holding up to `burst` tokens, refilled at `rate` tokens
+    per second. When the bucket is empty, commands wait in their lane, and the lanes are served
+    in order:
+
+    - keep_alive: keep-alive handshakes, which never wait but still take their token
+    - command: single commands, e.g. async_update_zone
+    - bulk: the bulk functions, e.g. async_update_zones, sent as tokens become available
+
+    Usage: `nobo(serial, ..., command_scheduler=CommandScheduler(rate=5, burst=10))`, one per hub.
+    """
+
+    KEEP_ALIVE = 'keep_alive'
+    COMMAND = 'command'
+    BULK = 'bulk'
+    LANES = (KEEP_ALIVE, COMMAND, BULK)
+
+    def __init__(self, rate: float = 5, burst: int = 10) -> None:
+        """
+        :param rate: commands per second in the long run. Default 5.
+        :param burst: commands that can be sent at once after being idle. Default 10.
+        """
+        if rate <= 0:
+            raise PynoboValidationError(f'rate must be positive, not {rate}')
+        if burst < 1:
+            raise PynoboValidationError(f'burst must be at least 1, not {burst}')
+        self.rate = rate
+        self.burst = burst
+        # Commands sent, and the total and max seconds they waited, per lane
+        self.sent = dict.fromkeys(CommandScheduler.LANES, 0)
+        self.wait_total = dict.fromkeys(CommandScheduler.LANES, 0.0)
+        self.wait_max = dict.fromkeys(CommandScheduler.LANES, 0.0)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lanes: dict[str, collections.deque[_CommandWaiter]] = {lane: collections.deque() for lane in CommandScheduler.LANES}
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def queue_depth(self) -> dict[str, int]:
+        """Number of commands waiting, per lane."""
+        return {lane: sum(waiter.count for waiter in waiters) for lane, waiters in self._lanes.items()}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record(self, lane: str, count: int, waited: float) -> None:
+        self.sent[lane] += count
+        self.wait_total[lane] += waited * count
+        self.wait_max[lane] = max(self.wait_max[lane], waited)
+
+    def take(self, count: int, lane: str) -> int:
+        """
+        Take tokens for up to count commands without waiting. The keep-alive lane always gets all
+        of them, leaving the bucket in debt if needed.
+
+        :return: the number of commands that may be sent now, 0 if they must wait
+        """
+        if lane not in self._lanes:
+            raise PynoboValidationError(f'lane must be one of {", ".join(CommandScheduler.LANES)}, not {lane}')
+        self._refill()
+        if lane == CommandScheduler.KEEP_ALIVE:
+            granted = count
+        elif any(self._lanes.values()):
+            return 0  # Don't overtake commands already waiting
+        else:
+            granted = min(count, int(self._tokens))
+        self._tokens -= granted
+        if granted:
+            self._record(lane, granted, 0.0)
+        return granted
+
+    async def acquire(self, count: int, lane: str) -> int:
+        """
+        Wait until at least one of count commands may be sent.
+
+        :param count: the number of commands to send
+        :param lane: the lane to wait in, one of LANES
+
+        :return: the number of commands that may be sent now, at least 1
+        """
+        granted = self.take(count, lane)
+        if granted:
+            return granted
+        loop = asyncio.get_running_loop()
+        waiter = _CommandWaiter(loop.create_future(), count, time.monotonic())
+        self._lanes[lane].append(waiter)
+        self._dispatch()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._tokens += waiter.future.result()  # Granted, but not used
+            with suppress(ValueError):
+                self._lanes[lane].remove(waiter)
+            self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        """Grant tokens to the waiting commands in lane order, and wait for the next token if needed."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        for lane, waiters in self._lanes.items():
+            while waiters:
+                waiter = waiters[0]
+                if waiter.future.done():
+                    waiters.popleft()
+                    continue
+                granted = min(waiter.count, int(self._tokens))
+                if not granted:
+                    delay = (1 - self._tokens) / self.rate
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                    return
+                waiters.popleft()
+                self._tokens -= granted
+                self._record(lane, granted, time.monotonic() - waiter.queued_at)
+                waiter.future.set_result(granted)
+
+
+class EventStream:
+    """
+    Subscription to updates from a hub, see nobo.events().
+
+    Events are queued in a bounded queue owned by the subscription. Publishing never blocks: when
+    the queue is full, events are dropped according to the overflow policy and counted in
+    `dropped` (and `coalesced` for events replaced by a newer event for the same record).
+    """
+
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    COALESCE = 'coalesce'
+    OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+    def __init__(self, hub: nobo, maxsize: int, overflow: str) -> None:
+        if overflow not in EventStream.OVERFLOW_POLICIES:
+            raise PynoboValidationError(f'overflow must be one of {", ".join(EventStream.OVERFLOW_POLICIES)}, not {overflow}')
+        if maxsize < 1:
+            raise PynoboValidationError(f'maxsize must be at least 1, not {maxsize}')
+        self.hub = hub
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.coalesced = 0
+        # Queued events by (section, key) when coalescing, else by a running number
+        self._queue: collections.OrderedDict[Any, nobo.Event] = collections.OrderedDict()
+        self._sequence = itertools.count()
+        self._waiter: asyncio.Future[None] | None = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _put(self, event: nobo.Event) -> None:
+        if self._closed:
+            return
+        if self.overflow == EventStream.COALESCE:
+            key = (event.kind, event.section, event.key) if event.section is not None else next(self._sequence)
+            replaced = self._queue.pop(key, None)
+            if replaced is not None:
+                self.coalesced += 1
+                # Keep the fields changed by the replaced event, None if either changed unknown fields
+                if replaced.changed is None or event.changed is None:
+                    event = dataclasses.replace(event, changed=None)
+                else:
+                    event = dataclasses.replace(event, changed=replaced.changed | event.changed)
+        else:
+            key = next(self._sequence)
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == EventStream.DROP_NEWEST:
+                return
+            self._queue.popitem(last=False)
+        self._queue[key] = event
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self) -> None:
+        """Unsubscribe. Events already queued are still delivered, then iteration stops."""
+        if not self._closed:
+            self._closed = True
+            with suppress(ValueError):
+                self.hub._event_streams.remove(self)
+            self._wake()
+
+    def __aiter__(self) -> EventStream:
+        return self
+
+    async def __anext__(self) -> nobo.Event:
+        while not self._queue:
+            if self._closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._queue.popitem(last=False)[1]
+
+    async def __aenter__(self) -> EventStream:
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
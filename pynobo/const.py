@@ -0,0 +1,13 @@
+"""
+Commands and responses of the hub API used to set up a connection, shared by `nobo.API` and the
+sans-I/O protocol in `pynobo.protocol`.
+"""
+
+# Version of the command set, sent with HELLO
+API_VERSION = '1.1'
+
+HELLO = 'HELLO'             # HELLO <version of command set> <Hub s.no.> <date and time in format 'yyyyMMddHHmmss'>
+REJECT = 'REJECT'           # REJECT <reject code>
+HANDSHAKE = 'HANDSHAKE'     # HANDSHAKE
+GET_ALL_INFO = 'G00'        # Ask the hub to send all its information, ending with H05
+RESPONSE_HUB_INFO = 'H05'   # G00 request complete signal + static info
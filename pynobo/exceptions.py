@@ -0,0 +1,46 @@
+"""
+Errors raised by pynobo, all subclasses of `PynoboError`.
+
+Re-exported by the package, so they are usually imported from `pynobo` itself.
+"""
+from __future__ import annotations
+
+
+class PynoboError(Exception):
+    """Base class for all pynobo errors."""
+
+
+class PynoboConnectionError(PynoboError, OSError):
+    """Raised when the TCP connection to the hub fails or is lost.
+
+    Also inherits OSError for back-compat: existing consumers that catch
+    OSError from asyncio.open_connection (e.g. Home Assistant's nobo_hub
+    rediscovery fallback) continue to work transparently.
+    """
+
+
+class PynoboHandshakeError(PynoboError):
+    """Raised when the hub rejects the handshake (bad serial, wrong version)."""
+
+
+class PynoboValidationError(PynoboError, ValueError, TypeError):
+    """Raised for invalid parameters. Inherits ValueError and TypeError for back-compat."""
+
+
+class PynoboTimeoutError(PynoboError, TimeoutError):
+    """Raised when the hub does not acknowledge a command in time."""
+
+
+class PynoboHubError(PynoboError):
+    """Raised when the hub answers a command with an error (E00, E01, ...)."""
+
+    def __init__(self, code: str, command: str, message: str) -> None:
+        """
+        :param code: the error response code, e.g. E00
+        :param command: the command the hub failed to execute, e.g. U00
+        :param message: the error message from the hub
+        """
+        super().__init__(f'{code} {command} {message}'.rstrip())
+        self.code = code
+        self.command = command
+        self.message = message
@@ -0,0 +1,198 @@
+"""
+Append-only binary journal of every response received from hubs.
+
+A `Journal` is fed every response handled by the hubs it is passed to, and appends a compact
+record per response to files in a directory:
+
+    journal = Journal('/var/lib/pynobo/journal')
+    hub = nobo('123123123123', synchronous=False, journal=journal)
+    ...
+    journal.close()
+
+    for record in read_journal('/var/lib/pynobo/journal'):
+        print(record.timestamp, record.serial, record.opcode, record.fields)
+
+Appending only encodes the record into a buffer; a background thread writes the buffer to disk,
+fsyncs it in batches and rotates to a new file when the current file is full.
+
+File layout: the magic `PYNOBOJ1`, followed by records of
+
+    length (I), CRC-32 of the payload (I), payload
+
+where the payload is the timestamp (d, seconds since the epoch) followed by the UTF-8 encoded
+hub serial, opcode and fields separated by spaces (fields never contain spaces). Reading stops
+at the first incomplete or corrupt record, e.g. a record torn by a crash.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, NamedTuple
+
+from .exceptions import PynoboError
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'PYNOBOJ1'
+RECORD = struct.Struct('<II')
+TIMESTAMP = struct.Struct('<d')
+FILE_PREFIX = 'pynobo-'
+FILE_SUFFIX = '.journal'
+
+
+class JournalRecord(NamedTuple):
+    """A response from a hub, as read from the journal."""
+
+    timestamp: float
+    serial: str
+    opcode: str
+    fields: tuple[str, ...]
+
+
+def _journal_files(directory: str) -> list[str]:
+    """The journal files in a directory, oldest first."""
+    names = [name for name in os.listdir(directory) if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+class Journal:
+    """Append responses from hubs to journal files, writing and fsyncing in a background thread."""
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_files: int | None = None,
+        flush_interval: float = 1.0,
+        fsync: bool = True,
+    ) -> None:
+        """
+        Open a new journal file in the directory and start the writer thread.
+
+        :param directory: directory for the journal files, created if missing
+        :param max_bytes: rotate to a new file when the current file reaches this size (default 64 MiB)
+        :param max_files: remove the oldest files when there are more (default None = keep all)
+        :param flush_interval: seconds between each batch written to disk (default 1.0)
+        :param fsync: fsync every batch (default True)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.records = 0
+        # Records appended after the journal was closed, which are dropped
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = _journal_files(directory)
+        self._index = int(os.path.basename(existing[-1])[len(FILE_PREFIX):-len(FILE_SUFFIX)]) if existing else 0
+        self._file = None
+        self._open_next()
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='pynobo-journal', daemon=True)
+        self._thread.start()
+
+    def append(self, serial: str, response: list[str], timestamp: float | None = None) -> None:
+        """
+        Add a response to the journal. Only encodes the record, it is written by the writer thread.
+        Records appended after the journal is closed are dropped and counted in `dropped`.
+
+        :param serial: serial number of the hub sending the response
+        :param response: the response, as a list of fields starting with the opcode
+        :param timestamp: when the response was received (default None = now)
+        """
+        if self._closed:
+            if not self.dropped:
+                _LOGGER.warning('journal %s is closed, dropping records', self.directory)
+            self.dropped += 1
+            return
+        payload = TIMESTAMP.pack(time.time() if timestamp is None else timestamp) + ' '.join([serial, *response]).encode('utf-8')
+        with self._lock:
+            self._buffer += RECORD.pack(len(payload), zlib.crc32(payload))
+            self._buffer += payload
+            self.records += 1
+
+    def flush(self) -> None:
+        """Write the buffered records to disk now, blocking until done."""
+        with self._write_lock:
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+            if data:
+                self._write(data)
+
+    def close(self) -> None:
+        """Write the remaining records to disk and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                _LOGGER.error('failed to write journal: %s', e)
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        if self._file.tell() >= self.max_bytes:
+            self._file.close()
+            self._open_next()
+
+    def _open_next(self) -> None:
+        self._index += 1
+        path = os.path.join(self.directory, f'{FILE_PREFIX}{self._index:08d}{FILE_SUFFIX}')
+        self._file = open(path, 'xb')
+        self._file.write(MAGIC)
+        if self.max_files is not None:
+            for old in _journal_files(self.directory)[:-self.max_files]:
+                os.remove(old)
+
+
+def read_journal_file(path: str) -> Iterator[JournalRecord]:
+    """
+    Read the records of a journal file, in order.
+
+    :param path: the journal file
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise PynoboError(f'{path} is not a pynobo journal')
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            length, crc = RECORD.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc or length < TIMESTAMP.size:
+                _LOGGER.warning('stopped reading %s at corrupt or incomplete record', path)
+                return
+            [timestamp] = TIMESTAMP.unpack_from(payload)
+            serial, opcode, *fields = payload[TIMESTAMP.size:].decode('utf-8').split(' ')
+            yield JournalRecord(timestamp, serial, opcode, tuple(fields))
+
+
+def read_journal(directory: str) -> Iterator[JournalRecord]:
+    """
+    Replay the records of all journal files in a directory, oldest first.
+
+    :param directory: the journal directory
+    """
+    for path in _journal_files(directory):
+        yield from read_journal_file(path)
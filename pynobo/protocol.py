@@ -0,0 +1,170 @@
+"""
+Sans-I/O core of the hub protocol: bytes in, responses out; commands in, bytes out.
+
+`HubProtocol` frames the byte stream from a hub into responses, encodes commands and tracks the
+connection through the handshake and initial data load:
+
+    idle -> hello -> handshake -> ready -> initial_data -> connected
+              \\-> rejected
+
+It does no I/O and has no event loop, so the same object can be driven by asyncio (as `nobo`
+does), by threads, from a journal replay or by a benchmark harness:
+
+    protocol = HubProtocol('102000022151')
+    protocol.hello()
+    sock.sendall(protocol.data_to_send())
+    while protocol.state != HubProtocol.READY:
+        protocol.receive_data(sock.recv(4096))
+        sock.sendall(protocol.data_to_send())
+    protocol.request_initial_data()
+    ...
+
+Responses are returned as lists of fields, the same as `nobo.get_response()`. To keep state from
+them without connecting, pass them to `nobo.response_handler()` of an instance that is never
+started.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import warnings
+from typing import Any
+
+from . import const
+from .exceptions import PynoboHandshakeError
+
+_LOGGER = logging.getLogger(__name__)
+
+# Every command and response ends with a carriage return
+SEPARATOR = b'\r'
+
+
+def encode_command(commands: list[Any]) -> bytes:
+    """
+    Encode a command for the hub.
+
+    :param commands: the command and its fields, either strings or integers
+
+    :return: the encoded command, with separator
+    """
+    return ' '.join([str(c) if isinstance(c, int) else c for c in commands]).encode('utf-8') + SEPARATOR
+
+
+def decode_response(frame: bytes) -> list[str]:
+    """
+    Decode a single response from the hub.
+
+    :param frame: the response, with or without separator
+
+    :return: the response as a list of fields
+    """
+    if frame.endswith(SEPARATOR):
+        frame = frame[:-1]
+    return frame.decode('utf-8').split(' ')
+
+
+class HubProtocol:
+    """The protocol state of one connection to a hub, with no I/O."""
+
+    IDLE = 'idle'
+    HELLO = 'hello'                 # HELLO sent, waiting for the hub to answer
+    HANDSHAKE = 'handshake'         # HANDSHAKE sent, waiting for the echo
+    READY = 'ready'                 # Handshake complete
+    INITIAL_DATA = 'initial_data'   # G00 sent, waiting for H05
+    CONNECTED = 'connected'         # Initial data received
+    REJECTED = 'rejected'           # The hub answered HELLO with REJECT
+
+    def __init__(self, serial: str, timezone: datetime.tzinfo | None = None) -> None:
+        """
+        :param serial: the complete 12 digit serial number of the hub
+        :param timezone: timezone of the timestamp sent with HELLO (default None = local time)
+        """
+        self.serial = serial
+        self.timezone = timezone
+        self.state = HubProtocol.IDLE
+        # The response to REJECT, if rejected
+        self.reject_code: str | None = None
+        self._buffer = bytearray()
+        self._outgoing = bytearray()
+
+    def hello(self, now: datetime.datetime | None = None) -> None:
+        """
+        Start the handshake: HELLO <version of command set> <hub serial> <yyyyMMddHHmmss>
+
+        :param now: the timestamp to send (default None = now)
+        """
+        if now is None:
+            now = datetime.datetime.now(self.timezone)
+        self.send_command([const.HELLO, const.API_VERSION, self.serial, now.strftime('%Y%m%d%H%M%S')])
+        self.state = HubProtocol.HELLO
+
+    def request_initial_data(self) -> None:
+        """Request all information from the hub, after the handshake is complete."""
+        self.send_command([const.GET_ALL_INFO])
+        self.state = HubProtocol.INITIAL_DATA
+
+    def send_command(self, commands: list[Any]) -> None:
+        """
+        Queue a command to send to the hub, see data_to_send().
+
+        :param commands: the command and its fields, either strings or integers
+        """
+        self._outgoing += encode_command(commands)
+
+    def data_to_send(self) -> bytes:
+        """Get the bytes queued for the hub, emptying the queue."""
+        data, self._outgoing = bytes(self._outgoing), bytearray()
+        return data
+
+    def receive_data(self, data: bytes) -> list[list[str]]:
+        """
+        Feed bytes received from the hub.
+
+        :param data: any number of bytes, complete responses or not
+
+        :return: the complete responses received, each handled by handle()
+        """
+        self._buffer += data
+        responses = []
+        start = 0
+        while (end := self._buffer.find(SEPARATOR, start)) >= 0:
+            response = decode_response(bytes(self._buffer[start:end]))
+            start = end + 1
+            self.handle(response)
+            responses.append(response)
+        del self._buffer[:start]
+        return responses
+
+    def handle(self, response: list[str]) -> None:
+        """
+        Advance the connection state by a response already framed, e.g. read with readuntil.
+
+        :param response: the response as a list of fields
+
+        :raises PynoboHandshakeError: if the hub answers the handshake unexpectedly
+        """
+        if self.state == HubProtocol.HELLO:
+            # successful response is "HELLO <its version of command set>"
+            if response[0] == const.HELLO:
+                if len(response) > 1 and response[1] != const.API_VERSION:
+                    _LOGGER.warning('api version might not match, hub: v%s, pynobo: v%s', response[1], const.API_VERSION)
+                    warnings.warn(f'api version might not match, hub: v{response[1]}, pynobo: v{const.API_VERSION}')
+                self.send_command([const.HANDSHAKE])
+                self.state = HubProtocol.HANDSHAKE
+            elif response[0] == const.REJECT:
+                # Reject response: "REJECT <reject code>"
+                # 0=Client command set version too old (or too new!).
+                # 1=Hub serial number mismatch.
+                # 2=Wrong number of arguments.
+                # 3=Timestamp incorrectly formatted
+                self.reject_code = response[1] if len(response) > 1 else None
+                self.state = HubProtocol.REJECTED
+            else:
+                raise PynoboHandshakeError(f'connection to hub rejected: {response}')
+        elif self.state == HubProtocol.HANDSHAKE:
+            if response[0] != const.HANDSHAKE:
+                raise PynoboHandshakeError(f'Final handshake not as expected {response}')
+            self.state = HubProtocol.READY
+        elif self.state == HubProtocol.INITIAL_DATA:
+            if response[0] == const.RESPONSE_HUB_INFO:
+                self.state = HubProtocol.CONNECTED
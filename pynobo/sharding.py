@@ -0,0 +1,371 @@
+"""
+Sharded runtime spreading hub connections over several worker processes.
+
+Each worker process runs its own event loop with the hub connections assigned to it by hub
+serial. Every response a worker receives from a hub is streamed back to the parent, where it
+is applied to a proxy `nobo` instance for the hub. The parent therefore has the same read API
+as a single `nobo` (dictionaries, snapshots, helper functions and callbacks), and commands sent
+through a proxy are routed to the worker owning the hub. When a worker dies, its hubs are moved
+to the remaining workers.
+
+    async def main():
+        runtime = ShardedHubs(workers=4)
+        await runtime.start()
+        hub = runtime.add_hub('123123123123', ip='10.0.0.128')
+        ...
+        await runtime.stop()
+
+    if __name__ == '__main__':
+        asyncio.run(main())
+
+Worker processes are started with the `spawn` method by default, so the main module must be
+guarded by `if __name__ == '__main__':`.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import threading
+import zlib
+from typing import Any
+
+from . import (
+    RECONNECT_INITIAL_DELAY,
+    RECONNECT_MAX_DELAY,
+    PynoboConnectionError,
+    PynoboError,
+    PynoboHandshakeError,
+    nobo,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _WorkerHub(nobo):
+    """A hub connection in a worker process, forwarding every response to the parent."""
+
+    def __init__(self, serial: str, ip: str | None, discover: bool, worker: _Worker) -> None:
+        super().__init__(serial, ip=ip, discover=discover, synchronous=False)
+        self._worker = worker
+        self.register_connection_callback(lambda _hub, connected: worker.emit(('connected', serial, connected)))
+
+    def response_handler(self, response: list[str]) -> frozenset[str] | None:
+        changed = super().response_handler(response)
+        self._worker.emit(('response', self.serial, response))
+        return changed
+
+
+class _Worker:
+    """Runs in a worker process: owns the hub connections and executes commands from the parent."""
+
+    def __init__(self, index: int, commands: Any, events: Any) -> None:
+        self.index = index
+        self.commands = commands
+        self.events = events
+        self.hubs: dict[str, _WorkerHub] = {}
+        self._start_tasks: dict[str, asyncio.Task[None]] = {}
+        self._buffer: list[tuple[str, str, Any]] = []
+
+    def emit(self, event: tuple[str, str, Any]) -> None:
+        """Queue an event for the parent. Events are sent in batches, once per loop iteration."""
+        if not self._buffer:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._buffer.append(event)
+
+    def _flush(self) -> None:
+        if self._buffer:
+            events, self._buffer = self._buffer, []
+            self.events.put((self.index, events))
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, self.commands.get)
+            if command[0] == 'stop':
+                break
+            elif command[0] == 'add':
+                self.add(*command[1:])
+            elif command[0] == 'remove':
+                await self.remove(command[1])
+            elif command[0] == 'write':
+                await self.write(*command[1:])
+        for serial in list(self.hubs):
+            await self.remove(serial)
+        self._flush()
+
+    def add(self, serial: str, ip: str | None, discover: bool) -> None:
+        hub = self.hubs[serial] = _WorkerHub(serial, ip, discover, self)
+        self._start_tasks[serial] = asyncio.create_task(self._start(hub))
+
+    async def _start(self, hub: _WorkerHub) -> None:
+        """Connect the hub, retrying with backoff like reconnect_hub until it succeeds."""
+        delay = RECONNECT_INITIAL_DELAY
+        while True:
+            try:
+                await hub.start()
+                return
+            except PynoboHandshakeError as e:
+                _LOGGER.error('hub %s rejected handshake, giving up: %s', hub.serial, e)
+                self.emit(('error', hub.serial, str(e)))
+                return
+            except (PynoboError, OSError) as e:
+                _LOGGER.info('failed to connect to hub %s: %s; retrying in %ds', hub.serial, e, delay)
+                self.emit(('error', hub.serial, str(e)))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def remove(self, serial: str) -> None:
+        hub = self.hubs.pop(serial, None)
+        task = self._start_tasks.pop(serial, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if hub is not None:
+            await hub.stop()
+
+    async def write(self, serial: str, data: bytes) -> None:
+        """Write raw commands from a proxy to the hub. Dropped if the hub is not connected."""
+        hub = self.hubs.get(serial)
+        if hub is None or hub._writer is None:
+            return
+        try:
+            hub._writer.write(data)
+            await hub._writer.drain()
+        except ConnectionError as e:
+            _LOGGER.info('lost connection to hub (%s)', e)
+            await hub.close()
+
+
+def _run_worker(index: int, commands: Any, events: Any) -> None:
+    """Entry point of a worker process."""
+    # The parent decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_Worker(index, commands, events).run())
+
+
+class _ShardWriter:
+    """Stands in for the StreamWriter of a proxy, routing the written commands to the owning worker."""
+
+    def __init__(self, runtime: ShardedHubs, serial: str) -> None:
+        self._runtime = runtime
+        self._serial = serial
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+
+    async def drain(self) -> None:
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self._runtime._route(self._serial, data)
+
+    def close(self) -> None:
+        pass
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+class ShardedHub(nobo):
+    """
+    Proxy for a hub connected in a worker process.
+
+    The state is kept up to date from the responses streamed from the worker, so all the read
+    functions, snapshots and callbacks of nobo work as for a directly connected hub. Commands are
+    routed to the worker owning the hub.
+    """
+
+    def __init__(self, runtime: ShardedHubs, serial: str, ip: str | None, discover: bool) -> None:
+        super().__init__(serial, ip=ip, discover=discover, synchronous=False)
+        self._writer = _ShardWriter(runtime, serial)
+
+    async def start(self) -> None:
+        raise PynoboError('Sharded hubs are connected by their worker, use ShardedHubs.add_hub()')
+
+    async def close(self) -> None:
+        """The connection is owned by the worker, only reflect that it is gone."""
+        self._fail_pending_commands(PynoboConnectionError('Connection to Nobø Ecohub closed'))
+        self._set_connected(False)
+
+    def _apply_response(self, response: list[str]) -> None:
+        changed = self.response_handler(response)
+        # Like socket_receive: errors only fail the command causing them, responses changing
+        # nothing are not notified, and data callbacks during the initial load are deferred
+        # until the worker reports the hub as connected.
+        if self.connected and not response[0].startswith('E') and (changed is None or changed):
+            for callback in self._callbacks:
+                callback(self)
+            self._publish(response, changed=changed)
+
+    def _apply_connected(self, connected: bool) -> None:
+        if connected:
+            self._set_connected(True)
+            self._watch_zone_modes()
+            for callback in self._callbacks:
+                callback(self)
+        else:
+            self._fail_pending_commands(PynoboConnectionError('Connection to Nobø Ecohub lost'))
+            self._set_connected(False)
+
+
+class _Shard:
+    """A worker process and its command queue, as seen from the parent."""
+
+    def __init__(self, index: int, process: Any, commands: Any) -> None:
+        self.index = index
+        self.process = process
+        self.commands = commands
+        # Done when the process has exited, set by the watcher thread of ShardedHubs
+        self.exited: asyncio.Future[None] | None = None
+
+
+class ShardedHubs:
+    """Spread hub connections over a pool of worker processes by hub serial."""
+
+    def __init__(self, workers: int | None = None, context: str = 'spawn') -> None:
+        """
+        :param workers: number of worker processes (default the number of CPUs)
+        :param context: multiprocessing start method (default spawn)
+        """
+        self.hubs: dict[str, ShardedHub] = {}
+        self._workers = workers or multiprocessing.cpu_count()
+        self._context = multiprocessing.get_context(context)
+        self._shards: dict[int, _Shard] = {}
+        self._owner: dict[str, int] = {}
+        self._events: Any = None
+        self._reader: threading.Thread | None = None
+        self._watcher: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopping = False
+
+    def __getitem__(self, serial: str) -> ShardedHub:
+        return self.hubs[serial]
+
+    async def start(self) -> None:
+        """Start the worker processes."""
+        self._loop = asyncio.get_running_loop()
+        self._events = self._context.Queue()
+        for index in range(self._workers):
+            commands = self._context.Queue()
+            process = self._context.Process(
+                target=_run_worker, args=(index, commands, self._events), name=f'pynobo-{index}', daemon=True,
+            )
+            process.start()
+            shard = self._shards[index] = _Shard(index, process, commands)
+            shard.exited = self._loop.create_future()
+        self._reader = threading.Thread(target=self._read_events, name='pynobo-events', daemon=True)
+        self._reader.start()
+        self._watcher = threading.Thread(target=self._watch, args=(list(self._shards.values()),), name='pynobo-workers', daemon=True)
+        self._watcher.start()
+
+    async def stop(self) -> None:
+        """Disconnect all hubs and stop the worker processes."""
+        self._stopping = True
+        shards = list(self._shards.values())
+        for shard in shards:
+            shard.commands.put(('stop',))
+        exited = [shard.exited for shard in shards if shard.exited is not None]
+        if exited:
+            await asyncio.wait(exited, timeout=10)
+        for shard in shards:
+            if shard.process.is_alive():
+                shard.process.terminate()
+        if exited:
+            await asyncio.wait(exited)
+        self._shards.clear()
+        if self._events is not None:
+            self._events.put(None)
+            await self._loop.run_in_executor(None, self._reader.join)
+        for hub in self.hubs.values():
+            await hub.stop()
+
+    def add_hub(self, serial: str, ip: str | None = None, discover: bool = False) -> ShardedHub:
+        """
+        Connect a hub in one of the workers.
+
+        :param serial: The complete 12 digit serial number of the hub
+        :param ip: IP address of the hub, required unless discover is True
+        :param discover: True/false for using UDP autodiscovery for the IP (default False)
+
+        :return: the proxy for the hub
+        """
+        if serial in self.hubs:
+            raise PynoboError(f'Hub {serial} already added')
+        hub = self.hubs[serial] = ShardedHub(self, serial, ip, discover)
+        self._assign(serial)
+        return hub
+
+    async def remove_hub(self, serial: str) -> None:
+        """
+        Disconnect a hub and forget it.
+
+        :param serial: the serial number the hub was added with
+        """
+        hub = self.hubs.pop(serial)
+        index = self._owner.pop(serial, None)
+        if index in self._shards:
+            self._shards[index].commands.put(('remove', serial))
+        await hub.stop()
+
+    def _assign(self, serial: str) -> None:
+        """Assign a hub to a live worker by its serial, and tell the worker to connect it."""
+        live = sorted(self._shards)
+        if not live:
+            _LOGGER.error('no live workers left for hub %s', serial)
+            self._owner.pop(serial, None)
+            return
+        index = live[zlib.crc32(serial.encode()) % len(live)]
+        self._owner[serial] = index
+        hub = self.hubs[serial]
+        self._shards[index].commands.put(('add', serial, hub.ip, hub.discover))
+
+    def _route(self, serial: str, data: bytes) -> None:
+        """Send raw commands written by a proxy to the worker owning the hub."""
+        index = self._owner.get(serial)
+        if index in self._shards:
+            self._shards[index].commands.put(('write', serial, data))
+
+    def _watch(self, shards: list[_Shard]) -> None:
+        """Wait for worker processes to exit, in one thread for all workers."""
+        waiting = {shard.process.sentinel: shard for shard in shards}
+        while waiting:
+            for sentinel in multiprocessing.connection.wait(list(waiting)):
+                self._loop.call_soon_threadsafe(self._exited, waiting.pop(sentinel))
+
+    def _exited(self, shard: _Shard) -> None:
+        """Move the hubs of a worker to the remaining workers when it dies."""
+        shard.process.join()  # Reap the process, it has already exited
+        shard.exited.set_result(None)
+        if self._stopping:
+            return
+        _LOGGER.error('worker %s died with exit code %s, moving its hubs', shard.index, shard.process.exitcode)
+        self._shards.pop(shard.index, None)
+        for serial, index in list(self._owner.items()):
+            if index == shard.index:
+                self.hubs[serial]._apply_connected(False)
+                self._assign(serial)
+
+    def _read_events(self) -> None:
+        """Forward event batches from the workers to the event loop, in a thread."""
+        while True:
+            batch = self._events.get()
+            if batch is None:
+                return
+            self._loop.call_soon_threadsafe(self._dispatch, *batch)
+
+    def _dispatch(self, index: int, events: list[tuple[str, str, Any]]) -> None:
+        for kind, serial, payload in events:
+            # Ignore late events from a worker that no longer owns the hub
+            if self._owner.get(serial) != index:
+                continue
+            hub = self.hubs[serial]
+            if kind == 'response':
+                hub._apply_response(payload)
+            elif kind == 'connected':
+                hub._apply_connected(payload)
+            elif kind == 'error':
+                _LOGGER.warning('hub %s: %s', serial, payload)
@@ -0,0 +1,278 @@
+"""
+Export live temperatures and zone modes to shared memory for other processes.
+
+`SharedStateExporter` keeps a fixed-layout table in a `multiprocessing.shared_memory` block up
+to date from a connected `nobo`: the temperature of every component, and the effective mode and
+setpoint of every zone. `SharedStateReader` maps the block in another process and reads single
+values without any copy of the hub state, I/O or connection to the hub.
+
+Writes are guarded by a seqlock: the writer makes the sequence number odd while it updates the
+table and even when done, and readers retry until they have read a consistent table.
+
+Layout (little endian):
+
+    header    magic (8s), sequence (Q), generation (I), max components (I), max zones (I),
+              components (I), zones (I), padding to 64 bytes
+    component serial (12s), padding (4x), temperature (d, NaN if unknown)
+    zone      zone id (8s), mode (B), padding (7x), setpoint (d, NaN if unknown)
+
+The generation is bumped whenever components or zones are added or removed, so readers know
+when to rebuild their serial and zone id to slot mappings.
+"""
+from __future__ import annotations
+
+import math
+from multiprocessing import resource_tracker, shared_memory
+import struct
+import sys
+
+from . import PynoboError, nobo
+
+MAGIC = b'PYNOBO\x00\x01'
+HEADER = struct.Struct('<8sQIIIII')
+HEADER_SIZE = 64
+COMPONENT = struct.Struct('<12s4xd')
+ZONE = struct.Struct('<8sB7xd')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+# Sequence and generation, read together by readers
+VERSION = struct.Struct('<QI')
+
+# Zone modes, by their code in the table
+MODES = (None, nobo.API.NAME_OFF, nobo.API.NAME_AWAY, nobo.API.NAME_ECO, nobo.API.NAME_COMFORT)
+MODE_CODES = {mode: code for code, mode in enumerate(MODES)}
+
+# The hub keeps zones in away mode at a fixed 7°C
+AWAY_TEMPERATURE = 7.0
+
+
+def _size(max_components: int, max_zones: int) -> int:
+    return HEADER_SIZE + max_components * COMPONENT.size + max_zones * ZONE.size
+
+
+class SharedStateExporter:
+    """
+    Write component temperatures and zone modes of a hub to a shared memory table.
+
+    The table is updated by the data and zone mode callbacks of the hub.
+    """
+
+    def __init__(self, hub: nobo, name: str | None = None, max_components: int = 256, max_zones: int = 64) -> None:
+        """
+        Create the shared memory block and register a callback keeping it up to date.
+
+        :param hub: the hub to export
+        :param name: name of the shared memory block (default None = generated, see the name attribute)
+        :param max_components: number of component slots in the table (default 256)
+        :param max_zones: number of zone slots in the table (default 64)
+        """
+        self.hub = hub
+        self.max_components = max_components
+        self.max_zones = max_zones
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=_size(max_components, max_zones))
+        self._buf = self._shm.buf
+        self._sequence = 0
+        self._generation = 0
+        self._layout: tuple[tuple[str, ...], tuple[str, ...]] = ((), ())
+        HEADER.pack_into(self._buf, 0, MAGIC, 0, 0, max_components, max_zones, 0, 0)
+        self.update()
+        hub.register_callback(self._on_update)
+        hub.register_zone_mode_callback(self._on_zone_mode)
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block, to pass to SharedStateReader."""
+        return self._shm.name
+
+    def _on_update(self, hub: nobo) -> None:
+        self.update()
+
+    def _on_zone_mode(self, hub: nobo, zone_id: str, mode: str) -> None:
+        self.update()
+
+    def update(self) -> None:
+        """Write the current temperatures and zone modes to the table."""
+        serials = tuple(self.hub.components)[:self.max_components]
+        zone_ids = tuple(self.hub.zones)[:self.max_zones]
+        zones = [(zone_id, *self._zone_mode(zone_id)) for zone_id in zone_ids]
+
+        self._begin()
+        try:
+            if (serials, zone_ids) != self._layout:
+                self._layout = (serials, zone_ids)
+                self._generation += 1
+                HEADER.pack_into(self._buf, 0, MAGIC, self._sequence, self._generation,
+                                 self.max_components, self.max_zones, len(serials), len(zone_ids))
+            offset = HEADER_SIZE
+            for serial in serials:
+                temperature = self.hub.get_current_component_temperature(serial)
+                COMPONENT.pack_into(self._buf, offset, serial.encode(), math.nan if temperature is None else float(temperature))
+                offset += COMPONENT.size
+            offset = HEADER_SIZE + self.max_components * COMPONENT.size
+            for zone_id, mode, setpoint in zones:
+                ZONE.pack_into(self._buf, offset, zone_id.encode(), MODE_CODES.get(mode, 0), setpoint)
+                offset += ZONE.size
+        finally:
+            self._end()
+
+    def _zone_mode(self, zone_id: str) -> tuple[str | None, float]:
+        """Get the effective mode and setpoint of a zone."""
+        try:
+            mode = self.hub.get_current_zone_mode(zone_id)
+        except KeyError:
+            return None, math.nan  # e.g. the week profile of the zone is not known yet
+        zone = self.hub.zones[zone_id]
+        if mode == nobo.API.NAME_COMFORT:
+            return mode, float(zone['temp_comfort_c'])
+        if mode == nobo.API.NAME_ECO:
+            return mode, float(zone['temp_eco_c'])
+        if mode == nobo.API.NAME_AWAY:
+            return mode, AWAY_TEMPERATURE
+        return mode, math.nan
+
+    def _begin(self) -> None:
+        self._sequence += 1
+        SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, self._sequence)
+
+    def _end(self) -> None:
+        self._sequence += 1
+        SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self, unlink: bool = True) -> None:
+        """
+        Stop exporting and release the shared memory block.
+
+        :param unlink: also remove the block, so readers can no longer attach (default True)
+        """
+        self.hub.deregister_callback(self._on_update)
+        self.hub.deregister_zone_mode_callback(self._on_zone_mode)
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class SharedStateReader:
+    """Read component temperatures and zone modes exported by a SharedStateExporter."""
+
+    def __init__(self, name: str, retries: int = 10000) -> None:
+        """
+        Attach to the shared memory block of an exporter.
+
+        :param name: the name of the block, see SharedStateExporter.name
+        :param retries: how many times to retry a read while the exporter is writing (default 10000)
+        """
+        if sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            # Only the exporter owns the block, don't let the resource tracker of this process remove it
+            register, resource_tracker.register = resource_tracker.register, lambda *args: None
+            try:
+                self._shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        self._buf = self._shm.buf
+        self.retries = retries
+        magic, _sequence, _generation, self.max_components, self.max_zones, _components, _zones = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise PynoboError(f'{name} is not a pynobo shared state table')
+        self._zone_offset = HEADER_SIZE + self.max_components * COMPONENT.size
+        self._generation = -1
+        self._component_slots: dict[str, int] = {}
+        self._zone_slots: dict[str, int] = {}
+
+    def _read(self, slots: str, key: str, unpack_from) -> tuple | None:
+        """
+        Read the struct in the slot of a key consistently, retrying while the exporter is writing.
+
+        The slot is looked up again on every attempt, after rebuilding the mappings if the layout
+        has changed, so a read never returns the value now in the slot the key used to have.
+
+        :param slots: name of the slot mapping to look the key up in, _component_slots or _zone_slots
+        :param key: the serial number or zone id
+        :param unpack_from: unpacks the struct from the buffer at an offset
+
+        :return: the unpacked struct, or None if the key is not exported
+        """
+        buf = self._buf
+        for _ in range(self.retries):
+            before, generation = VERSION.unpack_from(buf, SEQUENCE_OFFSET)
+            if before & 1:
+                continue
+            if generation != self._generation:
+                self._remap()
+                continue
+            offset = getattr(self, slots).get(key)
+            value = None if offset is None else unpack_from(buf, offset)
+            [after] = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+            if before == after:
+                return value
+        raise PynoboError('Shared state table is busy')
+
+    def _remap(self) -> None:
+        """Rebuild the serial and zone id to slot mappings after the layout has changed."""
+        buf = self._buf
+        for _ in range(self.retries):
+            [before] = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+            if before & 1:
+                continue
+            _magic, _sequence, generation, _max_components, _max_zones, components, zones = HEADER.unpack_from(buf, 0)
+            component_slots = {
+                COMPONENT.unpack_from(buf, HEADER_SIZE + slot * COMPONENT.size)[0].rstrip(b'\x00').decode(): HEADER_SIZE + slot * COMPONENT.size
+                for slot in range(components)
+            }
+            zone_slots = {
+                ZONE.unpack_from(buf, self._zone_offset + slot * ZONE.size)[0].rstrip(b'\x00').decode(): self._zone_offset + slot * ZONE.size
+                for slot in range(zones)
+            }
+            [after] = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+            if before == after:
+                self._generation, self._component_slots, self._zone_slots = generation, component_slots, zone_slots
+                return
+        raise PynoboError('Shared state table is busy')
+
+    @property
+    def serials(self) -> list[str]:
+        """Serial numbers of the exported components."""
+        self._remap()
+        return list(self._component_slots)
+
+    @property
+    def zone_ids(self) -> list[str]:
+        """Ids of the exported zones."""
+        self._remap()
+        return list(self._zone_slots)
+
+    def temperature(self, serial: str) -> float | None:
+        """
+        Get the current temperature of a component.
+
+        :param serial: the serial number of the component
+
+        :return: the temperature, or None if unknown
+        """
+        value = self._read('_component_slots', serial, COMPONENT.unpack_from)
+        if value is None:
+            return None
+        temperature = value[1]
+        return None if math.isnan(temperature) else temperature
+
+    def zone(self, zone_id: str) -> tuple[str | None, float | None]:
+        """
+        Get the effective mode and setpoint of a zone.
+
+        :param zone_id: the zone id
+
+        :return: the mode (comfort, eco, away or off) and setpoint, each None if unknown
+        """
+        value = self._read('_zone_slots', zone_id, ZONE.unpack_from)
+        if value is None:
+            return None, None
+        _zone_id, mode, setpoint = value
+        return MODES[mode], None if math.isnan(setpoint) else setpoint
+
+    def close(self) -> None:
+        """Detach from the shared memory block."""
+        self._buf = None
+        self._shm.close()
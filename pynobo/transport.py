@@ -0,0 +1,173 @@
+"""
+Transports opening the byte stream to a hub.
+
+A transport opens a connection and returns a reader and writer pair with the subset of the
+`asyncio.StreamReader`/`asyncio.StreamWriter` API used by `nobo`: `readuntil()` on the reader,
+and `write()`, `drain()`, `close()`, `wait_closed()` and `get_extra_info()` on the writer.
+
+`TcpTransport` connects to real hubs and is the default. `MemoryTransport` connects to hub
+simulators in the same process with no sockets, for tests and benchmarks:
+
+    transport = MemoryTransport()
+    transport.listen('10.0.0.1', handle_session)  # like the callback of asyncio.start_server
+    hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, transport=transport)
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import logging
+import socket
+from typing import Any, Awaitable, Callable
+
+_LOGGER = logging.getLogger(__name__)
+
+# TCP port of the hub API
+HUB_PORT = 27779
+
+
+class Transport(abc.ABC):
+    """Opens connections to hubs. Subclasses implement open_connection()."""
+
+    @abc.abstractmethod
+    async def open_connection(self, ip: str, port: int = HUB_PORT) -> tuple[Any, Any]:
+        """
+        Open a connection to a hub.
+
+        :param ip: IP address of the hub
+        :param port: port of the hub API (default HUB_PORT)
+
+        :return: reader and writer for the connection
+        :raises OSError: if the connection could not be opened
+        """
+
+
+class TcpTransport(Transport):
+    """Connects to hubs over TCP."""
+
+    def __init__(
+        self,
+        keepalive: bool = False,
+        keepalive_idle: int = 5,
+        keepalive_interval: int = 2,
+        keepalive_count: int = 3,
+        user_timeout: float = 10,
+    ) -> None:
+        """
+        :param keepalive: let the kernel detect dead connections with TCP keepalive probes, and fail
+            writes not acknowledged by the hub in time, with errno ETIMEDOUT (default False)
+        :param keepalive_idle: seconds without traffic before the first probe (default 5)
+        :param keepalive_interval: seconds between probes (default 2)
+        :param keepalive_count: unanswered probes before the connection is dead (default 3)
+        :param user_timeout: seconds sent data may stay unacknowledged, Linux only (default 10)
+        """
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.user_timeout = user_timeout
+
+    async def open_connection(self, ip: str, port: int = HUB_PORT) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.open_connection(ip, port)
+        if self.keepalive:
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                self._set_keepalive(sock)
+        return reader, writer
+
+    def _set_keepalive(self, sock: socket.socket) -> None:
+        """Set the keepalive options supported by the platform on a connected socket."""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # TCP_KEEPIDLE is called TCP_KEEPALIVE on macOS
+        idle = getattr(socket, 'TCP_KEEPIDLE', getattr(socket, 'TCP_KEEPALIVE', None))
+        options = [
+            (idle, self.keepalive_idle),
+            (getattr(socket, 'TCP_KEEPINTVL', None), self.keepalive_interval),
+            (getattr(socket, 'TCP_KEEPCNT', None), self.keepalive_count),
+            (getattr(socket, 'TCP_USER_TIMEOUT', None), int(self.user_timeout * 1000)),
+        ]
+        for option, value in options:
+            if option is not None:
+                try:
+                    sock.setsockopt(socket.IPPROTO_TCP, option, value)
+                except OSError as e:
+                    _LOGGER.debug('could not set TCP option %s: %s', option, e)
+
+
+class MemoryWriter:
+    """Writer end of an in-memory connection, feeding the reader of the other end."""
+
+    def __init__(self, peer: asyncio.StreamReader) -> None:
+        self._peer = peer
+        self._closed = False
+
+    def write(self, data: bytes) -> None:
+        if self._closed:
+            raise ConnectionResetError('Connection closed')
+        self._peer.feed_data(data)
+
+    async def drain(self) -> None:
+        if self._closed:
+            raise ConnectionResetError('Connection closed')
+
+    def is_closing(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._peer.feed_eof()
+
+    async def wait_closed(self) -> None:
+        pass
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return default
+
+
+def memory_pipe() -> tuple[tuple[asyncio.StreamReader, MemoryWriter], tuple[asyncio.StreamReader, MemoryWriter]]:
+    """
+    Create a connected pair of in-memory streams.
+
+    :return: (reader, writer) for each end of the connection
+    """
+    a, b = asyncio.StreamReader(), asyncio.StreamReader()
+    return (a, MemoryWriter(b)), (b, MemoryWriter(a))
+
+
+class MemoryTransport(Transport):
+    """Connects to hub simulators in the same process, with no sockets."""
+
+    def __init__(self) -> None:
+        self._handlers: dict[tuple[str, int], Callable[[asyncio.StreamReader, MemoryWriter], Awaitable[None]]] = {}
+        self._sessions: set[asyncio.Task[None]] = set()
+
+    def listen(
+        self,
+        ip: str,
+        handler: Callable[[asyncio.StreamReader, MemoryWriter], Awaitable[None]],
+        port: int = HUB_PORT,
+    ) -> None:
+        """
+        Accept connections to an address. The handler is run in a task for every connection, with
+        the reader and writer of the hub end, like the callback of asyncio.start_server.
+
+        :param ip: the address to listen on
+        :param handler: coroutine function serving a connection
+        :param port: the port to listen on (default HUB_PORT)
+        """
+        self._handlers[(ip, port)] = handler
+
+    def unlisten(self, ip: str, port: int = HUB_PORT) -> None:
+        """Stop accepting connections to an address. Open connections are not closed."""
+        self._handlers.pop((ip, port), None)
+
+    async def open_connection(self, ip: str, port: int = HUB_PORT) -> tuple[asyncio.StreamReader, MemoryWriter]:
+        handler = self._handlers.get((ip, port))
+        if handler is None:
+            raise ConnectionRefusedError(f'Nothing listening on {ip}:{port}')
+        client, server = memory_pipe()
+        task = asyncio.create_task(handler(*server))
+        self._sessions.add(task)
+        task.add_done_callback(self._sessions.discard)
+        return client
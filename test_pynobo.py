@@ -1,17 +1,60 @@
 import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import datetime
 import errno
+import os
 import pathlib
+import socket
+import tempfile
+import threading
+import time
 import unittest
 from contextlib import suppress
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 
 from pynobo import (
+    LIVENESS_MIN_TIMEOUT,
+    CommandScheduler,
+    KeepAliveScheduler,
     PynoboConnectionError,
     PynoboError,
     PynoboHandshakeError,
+    PynoboHubError,
+    PynoboTimeoutError,
     PynoboValidationError,
+    _get_sync_loop,
     nobo,
 )
+from pynobo.journal import Journal, JournalRecord, read_journal
+from pynobo.protocol import HubProtocol, decode_response, encode_command
+from pynobo.sharding import ShardedHubs, _Shard
+from pynobo.shm import SEQUENCE, SEQUENCE_OFFSET, SharedStateExporter, SharedStateReader
+from pynobo.transport import MemoryTransport, TcpTransport, Transport
+
+WEEK_PROFILE = '00000,06001,08000,15001,23000,00000,06001,08000,15001,23000,00000,06001,08000,15001,23000,00000,06001,08000,15001,23000,00000,06001,08000,15001,23000,00000,08001,23000,00000,08001,23000'
+
+INITIAL_DATA = [
+    ['H00'],
+    ['H01', '1', 'Living\u00a0room', '1', '22', '16', '1', '-1'],
+    ['H01', '2', 'Bedroom', '1', '20', '15', '1', '-1'],
+    ['H02', '186170024143', '0', 'Heater', '0', '1', '-1', '-1'],
+    ['H02', '234001021010', '0', 'Panel', '0', '2', '-1', '-1'],
+    ['H03', '1', 'Default', WEEK_PROFILE],
+    ['H04', '4', '0', '0', '-1', '-1', '0', '-1'],
+    ['Y02', '186170024143', '21.5'],
+    ['H05', '102000022151', 'My\u00a0hub', '0', '4', '11123610_rev._1', '20180119', '20180119'],
+]
+
+
+def _make_loaded_hub(**kwargs):
+    """Return a hub with the state from INITIAL_DATA, without connecting."""
+    hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, **kwargs)
+    for response in INITIAL_DATA:
+        hub.response_handler(list(response))
+    return hub
+
 
 class TestValidation(unittest.TestCase):
 
@@ -421,5 +464,1358 @@ class TestSocketReceiveReconnect(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(order, ['connection', 'data'])
 
 
+
+class TestConnectFirstHub(unittest.IsolatedAsyncioTestCase):
+
+    def _fake_handshake(self, behaviour, writers):
+        """Return an _async_handshake replacement driven by ip -> behaviour."""
+        async def fake_handshake(probe, ip, _serial):
+            writer = MagicMock(spec=asyncio.StreamWriter)
+            writer.wait_closed = AsyncMock()
+            probe._writer = writer
+            writers[ip] = writer
+            result = behaviour[ip]
+            if result == 'hang':
+                await asyncio.Event().wait()
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return fake_handshake
+
+    async def _race(self, behaviour, stagger=0.01):
+        hub = nobo('123', synchronous=False)
+        writers = {}
+        completed = []
+
+        async def fake_complete(ip, serial):
+            completed.append((ip, serial))
+
+        hub._async_complete_connect = fake_complete
+        hubs = {(ip, '123456789012') for ip in behaviour}
+        with patch.object(nobo, '_async_handshake', self._fake_handshake(behaviour, writers)):
+            result = await asyncio.wait_for(hub.async_connect_first_hub(hubs, stagger=stagger), timeout=1)
+        return hub, result, writers, completed
+
+    async def test_first_completed_handshake_wins_and_stale_attempt_is_closed(self):
+        hub, result, writers, completed = await self._race({'10.0.0.1': 'hang', '10.0.0.2': True})
+
+        self.assertTrue(result)
+        self.assertEqual(completed, [('10.0.0.2', '123456789012')])
+        self.assertIs(hub._writer, writers['10.0.0.2'])
+        writers['10.0.0.1'].close.assert_called_once()
+        writers['10.0.0.2'].close.assert_not_called()
+
+    async def test_failed_attempts_fall_through_to_next_candidate(self):
+        hub, result, writers, completed = await self._race({
+            '10.0.0.1': False,
+            '10.0.0.2': PynoboConnectionError('unreachable'),
+            '10.0.0.3': True,
+        }, stagger=10)
+
+        self.assertTrue(result)
+        self.assertEqual(completed, [('10.0.0.3', '123456789012')])
+
+    async def test_all_rejected_returns_false(self):
+        _hub, result, _writers, completed = await self._race({'10.0.0.1': False, '10.0.0.2': False})
+
+        self.assertFalse(result)
+        self.assertEqual(completed, [])
+
+    async def test_handshake_error_propagates_when_no_hub_connects(self):
+        with self.assertRaises(PynoboHandshakeError):
+            await self._race({'10.0.0.1': PynoboHandshakeError('bad'), '10.0.0.2': False})
+
+
+
+class TestKeepAliveScheduler(unittest.IsolatedAsyncioTestCase):
+
+    def _make_hub(self, scheduler):
+        hub = nobo('123456789012', ip='10.0.0.1', discover=False, synchronous=False,
+                   keep_alive_scheduler=scheduler)
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.wait_closed = AsyncMock()
+        return hub
+
+    async def test_handshakes_sent_to_all_hubs_in_shared_wakeups(self):
+        scheduler = KeepAliveScheduler(interval=0.05, resolution=0.05)
+        hubs = [self._make_hub(scheduler) for _ in range(8)]
+        for hub in hubs:
+            scheduler.register(hub)
+            # Pretend the hub keeps echoing so the liveness check stays happy
+            hub._writer.write.side_effect = lambda _data, hub=hub: setattr(hub, '_last_recv_at', time.monotonic())
+
+        await asyncio.sleep(0.22)
+
+        for hub in hubs:
+            self.assertGreaterEqual(hub._writer.write.call_count, 3)
+            hub._writer.write.assert_called_with(b'HANDSHAKE\r')
+        # One timer services several hubs per wakeup
+        self.assertLess(scheduler.wakeups, sum(hub._writer.write.call_count for hub in hubs))
+        for hub in hubs:
+            scheduler.unregister(hub)
+        self.assertEqual(len(scheduler), 0)
+
+    async def test_silent_hub_is_closed(self):
+        scheduler = KeepAliveScheduler(interval=0.02, resolution=0)
+        hub = self._make_hub(scheduler)
+        events = []
+        hub.register_connection_callback(lambda _h, state: events.append(state))
+        hub._set_connected(True)
+        writer = hub._writer
+        scheduler.register(hub)
+
+        await asyncio.sleep(0.1)
+
+        writer.close.assert_called_once()
+        self.assertEqual(events, [True, False])
+        # The close task is released when done
+        self.assertEqual(scheduler._close_tasks, set())
+        scheduler.unregister(hub)
+
+    async def test_unregistered_hub_is_not_serviced(self):
+        scheduler = KeepAliveScheduler(interval=0.02, resolution=0)
+        hub = self._make_hub(scheduler)
+        scheduler.register(hub)
+        scheduler.unregister(hub)
+
+        await asyncio.sleep(0.05)
+
+        hub._writer.write.assert_not_called()
+
+    async def test_for_loop_returns_shared_instance(self):
+        self.assertIs(KeepAliveScheduler.for_loop(), KeepAliveScheduler.for_loop())
+
+
+
+class TestKeepAliveRtt(unittest.IsolatedAsyncioTestCase):
+
+    def _make_hub(self):
+        hub = nobo('123456789012', ip='10.0.0.1', discover=False, synchronous=False)
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.wait_closed = AsyncMock()
+        hub._last_recv_at = time.monotonic()
+        return hub
+
+    async def test_round_trips_are_measured(self):
+        hub = self._make_hub()
+        self.assertEqual(hub.keep_alive_timeout(14), 28)
+        for rtt in (0.03, 0.04, 3):
+            hub._keep_alive_sent_at = time.monotonic() - rtt
+            hub._keep_alive_echoed()
+        hub._keep_alive_echoed()  # Not sent by keep-alive
+
+        self.assertEqual(len(hub.keep_alive_rtts), 3)
+        histogram = hub.rtt_histogram()
+        self.assertEqual((histogram[0.05], histogram[5], histogram[float('inf')]), (2, 1, 0))
+        # Bounded by the interval, and by LIVENESS_MIN_TIMEOUT
+        self.assertEqual(hub.keep_alive_timeout(1), 1)
+        self.assertGreater(hub.keep_alive_timeout(14), 2)
+        hub.keep_alive_rtts.clear()
+        hub._srtt, hub._rttvar = 0.01, 0.001
+        self.assertEqual(hub.keep_alive_timeout(14), LIVENESS_MIN_TIMEOUT)
+
+    async def test_missing_echo_is_detected_before_next_keep_alive(self):
+        hub = self._make_hub()
+        writer = hub._writer
+        hub._srtt, hub._rttvar = 0.01, 0.002
+        with patch('pynobo.LIVENESS_MIN_TIMEOUT', 0.01):
+            # Echoed in time
+            hub._keep_alive_sent(1)
+            await asyncio.sleep(0.005)
+            hub._last_recv_at = time.monotonic()
+            hub._keep_alive_echoed()
+            await asyncio.sleep(0.05)
+            writer.close.assert_not_called()
+
+            hub._keep_alive_sent(1)
+            await asyncio.sleep(0.05)
+        writer.close.assert_called_once()
+        self.assertIsNone(hub._writer)
+        # The close task is released when done
+        self.assertEqual(hub._close_tasks, set())
+
+
+class TestSynchronousMode(unittest.TestCase):
+
+    def _make_sync_hub(self):
+        with self.assertWarns(DeprecationWarning):
+            return nobo('123456789012', ip='10.0.0.1', discover=False)
+
+    def test_instances_share_one_background_loop(self):
+        with patch.object(nobo, 'start', new_callable=AsyncMock):
+            threads_before = threading.active_count()
+            hubs = [self._make_sync_hub() for _ in range(5)]
+
+        self.assertIsNotNone(hubs[0]._loop)
+        self.assertTrue(all(hub._loop is hubs[0]._loop for hub in hubs))
+        self.assertLessEqual(threading.active_count(), threads_before + 1)
+
+    def test_run_blocking_returns_result_and_raises_errors(self):
+        with patch.object(nobo, 'start', new_callable=AsyncMock):
+            hub = self._make_sync_hub()
+
+        async def answer():
+            return 42
+
+        self.assertEqual(hub.run_blocking(answer()), 42)
+        with self.assertRaises(PynoboValidationError):
+            hub.run_blocking(hub.async_update_zone('unknown', temp_comfort_c=22))
+
+    def test_run_blocking_requires_synchronous_instance(self):
+        hub = nobo('123', discover=False, synchronous=False)
+        with self.assertRaises(PynoboError):
+            hub.run_blocking(hub.async_send_command(['HANDSHAKE']))
+
+    def test_deprecated_functions_run_on_the_shared_loop(self):
+        transport = MemoryTransport()
+        transport.listen('10.0.0.1', _simulate_hub)
+        hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, transport=transport)
+        loop = _get_sync_loop()
+        with patch('asyncio.new_event_loop') as new_event_loop, \
+                patch.object(nobo, 'async_discover_hubs', new_callable=AsyncMock, return_value={('10.0.0.1', '102000022151')}):
+            with self.assertWarns(DeprecationWarning):
+                self.assertTrue(hub.connect_hub('10.0.0.1', '102000022151'))
+            with self.assertWarns(DeprecationWarning):
+                self.assertEqual(nobo.discover_hubs('102000022'), {('10.0.0.1', '102000022151')})
+        new_event_loop.assert_not_called()
+        self.assertEqual(hub.hub_info['name'], 'My\u00a0hub')
+        asyncio.run_coroutine_threadsafe(hub.close(), loop).result()
+
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_unchanged_hub_returns_same_snapshot(self):
+        hub = _make_loaded_hub()
+        snapshot = hub.snapshot()
+        self.assertIs(hub.snapshot(), snapshot)
+        self.assertEqual(snapshot.version, hub.version)
+        self.assertEqual(snapshot.zones['1']['temp_comfort_c'], '22')
+        self.assertEqual(snapshot.temperatures['186170024143'], '21.5')
+
+    def test_snapshot_is_immutable(self):
+        snapshot = _make_loaded_hub().snapshot()
+        with self.assertRaises(TypeError):
+            snapshot.zones['3'] = {}
+        with self.assertRaises(TypeError):
+            snapshot.zones['1']['name'] = 'Kitchen'
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            snapshot.version = 0
+
+    def test_only_changed_sections_and_records_are_copied(self):
+        hub = _make_loaded_hub()
+        before = hub.snapshot()
+
+        hub.response_handler(['Y02', '186170024143', '22.0'])
+        after_temperature = hub.snapshot()
+        self.assertGreater(after_temperature.version, before.version)
+        self.assertEqual(after_temperature.temperatures['186170024143'], '22.0')
+        self.assertIs(after_temperature.zones, before.zones)
+
+        hub.response_handler(['V00', '2', 'Bedroom', '1', '21', '15', '1', '-1'])
+        after_zone = hub.snapshot()
+        self.assertIsNot(after_zone.zones, before.zones)
+        self.assertEqual(after_zone.zones['2']['temp_comfort_c'], '21')
+        self.assertIs(after_zone.zones['1'], before.zones['1'])
+        # Earlier snapshots are unaffected
+        self.assertEqual(before.zones['2']['temp_comfort_c'], '20')
+
+    def test_export_to_json(self):
+        hub = _make_loaded_hub()
+        state = hub.to_dict()
+        self.assertEqual(list(state), ['version', *nobo.STATE_SECTIONS])
+        self.assertEqual(state['version'], hub.version)
+        self.assertEqual(state['zones']['1']['name'], 'Living\u00a0room')
+        self.assertEqual(state['components']['186170024143']['model'], nobo.MODELS['186'].to_dict())
+        self.assertEqual(state['week_profiles']['1']['profile'][:2], ['00000', '06001'])
+        self.assertEqual(state['temperatures'], {'186170024143': '21.5'})
+        self.assertIs(hub.to_json(), hub.to_json())
+
+    def test_export_only_encodes_changed_sections(self):
+        hub = _make_loaded_hub()
+        hub.to_json()
+        encoded = dict(hub._json_sections)
+
+        hub.response_handler(['Y02', '186170024143', '22.0'])
+        self.assertEqual(hub.to_dict()['temperatures']['186170024143'], '22.0')
+        self.assertIsNot(hub._json_sections['temperatures'], encoded['temperatures'])
+        self.assertIs(hub._json_sections['zones'], encoded['zones'])
+
+        # Optimistic changes are exported as the strings the hub would send
+        hub._save_zone('1', {'temp_comfort_c': 23})
+        self.assertEqual(hub.to_dict()['zones']['1']['temp_comfort_c'], '23')
+        self.assertIsNot(hub._json_sections['zones'], encoded['zones'])
+        self.assertIs(hub._json_sections['components'], encoded['components'])
+
+
+
+class TestBulkCommands(unittest.IsolatedAsyncioTestCase):
+
+    def _make_hub(self):
+        hub = _make_loaded_hub()
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.drain = AsyncMock()
+        hub._writer.wait_closed = AsyncMock()
+        return hub
+
+    async def test_update_zones_sends_pipelined_write_and_collects_acknowledgements(self):
+        hub = self._make_hub()
+        task = asyncio.create_task(hub.async_update_zones(
+            {'1': {'temp_comfort_c': 23}, '2': {'temp_eco_c': '14'}}, wait=True))
+        await asyncio.sleep(0)
+
+        self.assertEqual(hub._writer.write.call_args_list, [
+            call(b'U00 1 Living\xc2\xa0room 1 23 16 1 -1\r'),
+            call(b'U00 2 Bedroom 1 20 14 1 -1\r'),
+        ])
+        hub._writer.drain.assert_awaited_once()
+        # Saved before the hub confirms
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], 23)
+
+        hub.response_handler(['V00', '2', 'Bedroom', '1', '20', '14', '1', '-1'])
+        hub.response_handler(['V00', '1', 'Living\u00a0room', '1', '23', '16', '1', '-1'])
+        self.assertEqual(await task, {'1': None, '2': None})
+
+    async def test_update_zones_validates_everything_before_sending(self):
+        hub = self._make_hub()
+        with self.assertRaises(PynoboValidationError):
+            await hub.async_update_zones({'1': {'temp_comfort_c': 23}, '2': {'temp_eco_c': 40}})
+        with self.assertRaises(PynoboValidationError):
+            await hub.async_update_zones({'1': {'temperature': 23}})
+        hub._writer.write.assert_not_called()
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], '22')
+
+    async def test_update_zones_reports_missing_acknowledgement_per_zone(self):
+        hub = self._make_hub()
+        task = asyncio.create_task(hub.async_update_zones(
+            {'1': {'temp_comfort_c': 23}, '2': {'temp_eco_c': 14}}, wait=True, timeout=0.05))
+        await asyncio.sleep(0)
+        hub.response_handler(['V00', '1', 'Living\u00a0room', '1', '23', '16', '1', '-1'])
+
+        results = await task
+        self.assertIsNone(results['1'])
+        self.assertIsInstance(results['2'], PynoboTimeoutError)
+
+    async def test_create_overrides_acknowledged_by_target(self):
+        hub = self._make_hub()
+        task = asyncio.create_task(hub.async_create_overrides([
+            {'mode': nobo.API.OVERRIDE_MODE_ECO, 'type': nobo.API.OVERRIDE_TYPE_CONSTANT,
+             'target_type': nobo.API.OVERRIDE_TARGET_ZONE, 'target_id': '1'},
+            {'mode': nobo.API.OVERRIDE_MODE_AWAY, 'type': nobo.API.OVERRIDE_TYPE_CONSTANT,
+             'target_type': nobo.API.OVERRIDE_TARGET_ZONE, 'target_id': '2'},
+        ], wait=True))
+        await asyncio.sleep(0)
+        self.assertEqual(hub._writer.write.call_count, 2)
+        hub._writer.drain.assert_awaited_once()
+
+        hub.response_handler(['B03', '9', '3', '3', '-1', '-1', '1', '2'])
+        hub.response_handler(['B03', '8', '2', '3', '-1', '-1', '1', '1'])
+        self.assertEqual(await task, [None, None])
+
+    async def test_lost_connection_fails_pending_commands(self):
+        hub = self._make_hub()
+        task = asyncio.create_task(hub.async_update_zones({'1': {'temp_comfort_c': 23}}, wait=True))
+        await asyncio.sleep(0)
+        await hub.close()
+
+        self.assertIsInstance((await task)['1'], PynoboConnectionError)
+
+    async def test_not_connected_reports_errors_without_waiting(self):
+        hub = _make_loaded_hub()
+        results = await hub.async_update_zones({'1': {'temp_comfort_c': 23}, '2': {'temp_eco_c': 14}}, wait=False)
+        self.assertIsInstance(results['1'], PynoboConnectionError)
+        self.assertIsInstance(results['2'], PynoboConnectionError)
+        await asyncio.sleep(0)
+        # The saved changes are rolled back
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], '22')
+
+    async def test_rollback_is_published(self):
+        hub = _make_loaded_hub()
+        events = hub.events()
+        await hub.async_update_zones({'1': {'temp_comfort_c': 23}}, wait=False)
+        await asyncio.sleep(0)
+        event = await anext(events)
+        self.assertEqual((event.kind, event.section, event.key, event.response, event.changed),
+                         ('rollback', 'zones', '1', (), {'temp_comfort_c'}))
+        self.assertEqual(event.version, hub._version)
+
+
+
+class TestCommandScheduler(unittest.IsolatedAsyncioTestCase):
+
+    def _make_hub(self, scheduler):
+        hub = _make_loaded_hub(command_scheduler=scheduler)
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.drain = AsyncMock()
+        hub._writer.wait_closed = AsyncMock()
+        return hub
+
+    async def test_bulk_commands_are_sent_at_the_rate_limit(self):
+        scheduler = CommandScheduler(rate=20, burst=2)
+        hub = self._make_hub(scheduler)
+        await hub.async_update_zones({'1': {'temp_comfort_c': 23}, '2': {'temp_eco_c': 14}}, wait=False)
+        # Fits the burst
+        self.assertEqual(hub._writer.write.call_count, 2)
+        self.assertEqual(scheduler.wait_max['bulk'], 0.0)
+
+        task = asyncio.create_task(hub._async_send_commands([['U00', str(i)] for i in range(3)], wait=False, timeout=1))
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queue_depth, {'keep_alive': 0, 'command': 0, 'bulk': 3})
+        await task
+        self.assertEqual(hub._writer.write.call_count, 5)
+        self.assertEqual(scheduler.sent['bulk'], 5)
+        self.assertGreater(scheduler.wait_max['bulk'], 0.005)
+        self.assertEqual(scheduler.queue_depth['bulk'], 0)
+
+    async def test_lanes_are_served_in_priority_order(self):
+        scheduler = CommandScheduler(rate=10, burst=1)
+        hub = self._make_hub(scheduler)
+        self.assertEqual(scheduler.take(1, CommandScheduler.COMMAND), 1)
+        order = []
+        hub._writer.write.side_effect = lambda data: order.append(data.split(b' ')[0].rstrip(b'\r'))
+
+        bulk = asyncio.create_task(hub._async_send_commands([['U00', '1'], ['U00', '2']], wait=False, timeout=1))
+        await asyncio.sleep(0)
+        command = asyncio.create_task(hub.async_send_command(['U02', '1']))
+        await asyncio.sleep(0)
+        # Keep-alives never wait
+        await hub.async_send_command([nobo.API.HANDSHAKE])
+        self.assertEqual(order, [b'HANDSHAKE'])
+
+        await asyncio.gather(bulk, command)
+        self.assertEqual(order, [b'HANDSHAKE', b'U02', b'U00', b'U00'])
+        self.assertEqual(scheduler.sent, {'keep_alive': 1, 'command': 2, 'bulk': 2})
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(PynoboValidationError):
+            CommandScheduler(rate=0)
+        with self.assertRaises(PynoboValidationError):
+            CommandScheduler(burst=0)
+        with self.assertRaises(PynoboValidationError):
+            CommandScheduler().take(1, 'urgent')
+
+
+class TestOptimisticUpdates(unittest.IsolatedAsyncioTestCase):
+
+    def _make_hub(self):
+        hub = _make_loaded_hub()
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.drain = AsyncMock()
+        hub._writer.wait_closed = AsyncMock()
+        self.callbacks = []
+        hub.register_callback(lambda h: self.callbacks.append(dict(h.zones['1'])))
+        return hub
+
+    async def test_unconfirmed_zone_update_is_rolled_back(self):
+        hub = self._make_hub()
+        with patch('pynobo.COMMAND_TIMEOUT', 0.02):
+            await hub.async_update_zone('1', temp_comfort_c=25)
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], 25)
+
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], '22')
+        self.assertEqual([c['temp_comfort_c'] for c in self.callbacks], ['22'])
+
+    async def test_confirmed_zone_update_is_kept(self):
+        hub = self._make_hub()
+        with patch('pynobo.COMMAND_TIMEOUT', 0.02):
+            await hub.async_update_zone('1', temp_comfort_c=25)
+        hub.response_handler(['V00', '1', 'Living\u00a0room', '1', '25', '16', '1', '-1'])
+
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], '25')
+        self.assertEqual(self.callbacks, [])
+
+    async def test_rollback_does_not_clobber_a_later_change(self):
+        hub = self._make_hub()
+        await hub.async_update_zones({'1': {'temp_comfort_c': 25}}, timeout=0.02)
+        await hub.async_update_zones({'1': {'temp_comfort_c': 26}}, timeout=10)
+
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], 26)
+
+    async def test_override_change_rolled_back_on_disconnect(self):
+        hub = self._make_hub()
+        await hub.async_create_override(nobo.API.OVERRIDE_MODE_AWAY, nobo.API.OVERRIDE_TYPE_CONSTANT,
+                                        nobo.API.OVERRIDE_TARGET_GLOBAL)
+        self.assertEqual(hub.overrides['4']['mode'], nobo.API.OVERRIDE_MODE_AWAY)
+
+        await hub.close()
+        await asyncio.sleep(0)
+
+        self.assertEqual(hub.overrides['4']['mode'], nobo.API.OVERRIDE_MODE_NORMAL)
+        self.assertEqual(hub.overrides['4']['type'], nobo.API.OVERRIDE_TYPE_NOW)
+        self.assertEqual(len(self.callbacks), 1)
+
+
+
+class TestHubErrors(unittest.IsolatedAsyncioTestCase):
+
+    def _make_hub(self):
+        hub = _make_loaded_hub()
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.drain = AsyncMock()
+        hub._writer.wait_closed = AsyncMock()
+        return hub
+
+    async def test_error_fails_oldest_pending_command_with_same_opcode(self):
+        hub = self._make_hub()
+        task = asyncio.create_task(hub.async_update_zones(
+            {'1': {'temp_comfort_c': 25}, '2': {'temp_comfort_c': 24}}, wait=True))
+        await asyncio.sleep(0)
+
+        hub.response_handler(['E00', 'U00', 'Invalid\u00a0temperature'])
+        hub.response_handler(['V00', '2', 'Bedroom', '1', '24', '15', '1', '-1'])
+
+        results = await task
+        self.assertIsInstance(results['1'], PynoboHubError)
+        self.assertEqual((results['1'].code, results['1'].command), ('E00', 'U00'))
+        self.assertIsNone(results['2'])
+        self.assertEqual(hub.error_counts['U00'], 1)
+        self.assertIs(hub.last_error, results['1'])
+        # The optimistic change is rolled back
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], '22')
+
+    async def test_wait_raises_hub_error(self):
+        hub = self._make_hub()
+        task = asyncio.create_task(hub.async_create_override(
+            nobo.API.OVERRIDE_MODE_ECO, nobo.API.OVERRIDE_TYPE_CONSTANT,
+            nobo.API.OVERRIDE_TARGET_ZONE, '1', wait=True))
+        await asyncio.sleep(0)
+        hub.response_handler(['E01', 'A03', 'Override\u00a0not\u00a0allowed'])
+
+        with self.assertRaises(PynoboHubError):
+            await task
+
+    async def test_unmatched_error_is_counted_without_callbacks(self):
+        hub = self._make_hub()
+        callbacks = []
+        hub.register_callback(callbacks.append)
+        responses = iter([[b'E00 U02 Unknown\r'], []])
+
+        async def readuntil(_sep):
+            try:
+                return next(responses)[0]
+            except IndexError:
+                await asyncio.Event().wait()
+
+        hub._reader = MagicMock(spec=asyncio.StreamReader)
+        hub._reader.readuntil = readuntil
+        task = asyncio.create_task(hub.socket_receive())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+        self.assertEqual(hub.error_counts['U02'], 1)
+        self.assertEqual(callbacks, [])
+
+
+
+class TestShardedHubs(unittest.IsolatedAsyncioTestCase):
+
+    def _make_runtime(self):
+        runtime = ShardedHubs(workers=2)
+        runtime._loop = asyncio.get_running_loop()
+        runtime._shards = {index: _Shard(index, MagicMock(), MagicMock()) for index in range(2)}
+        return runtime
+
+    async def test_proxy_mirrors_worker_state_and_routes_commands(self):
+        runtime = self._make_runtime()
+        hub = runtime.add_hub('102000022151', ip='10.0.0.1')
+        owner = runtime._shards[runtime._owner['102000022151']]
+        owner.commands.put.assert_called_once_with(('add', '102000022151', '10.0.0.1', False))
+        order = []
+        hub.register_callback(lambda _h: order.append('data'))
+        hub.register_connection_callback(lambda _h, state: order.append(state))
+
+        runtime._dispatch(owner.index, [('response', '102000022151', response) for response in INITIAL_DATA])
+        self.assertEqual(order, [])
+        runtime._dispatch(owner.index, [('connected', '102000022151', True)])
+        self.assertEqual(order, [True, 'data'])
+        self.assertIs(runtime['102000022151'], hub)
+        self.assertEqual(hub.get_current_zone_temperature('1'), '21.5')
+        runtime._dispatch(owner.index, [('response', '102000022151', ['Y02', '186170024143', '21.5'])])
+        self.assertEqual(order, [True, 'data'])
+
+        await hub.async_update_zone('1', temp_comfort_c=23)
+        owner.commands.put.assert_called_with(('write', '102000022151', b'U00 1 Living\xc2\xa0room 1 23 16 1 -1\r'))
+
+        # Losing the connection rolls back the unconfirmed change
+        runtime._dispatch(owner.index, [('connected', '102000022151', False)])
+        await asyncio.sleep(0)
+        self.assertFalse(hub.connected)
+        self.assertEqual(hub.zones['1']['temp_comfort_c'], '22')
+
+    async def test_events_from_previous_owner_are_ignored(self):
+        runtime = self._make_runtime()
+        hub = runtime.add_hub('102000022151', ip='10.0.0.1')
+        other = 1 - runtime._owner['102000022151']
+
+        runtime._dispatch(other, [('response', '102000022151', ['Y02', '186170024143', '21.5'])])
+
+        self.assertEqual(hub.temperatures, {})
+
+    async def test_removed_hub_stops_watching_and_closes_streams(self):
+        runtime = self._make_runtime()
+        hub = runtime.add_hub('102000022151', ip='10.0.0.1')
+        owner = runtime._shards[runtime._owner['102000022151']]
+        runtime._dispatch(owner.index, [('response', '102000022151', response) for response in INITIAL_DATA])
+        runtime._dispatch(owner.index, [('connected', '102000022151', True)])
+        events = hub.events()
+        self.assertIsNotNone(hub._watched_zone_modes)
+
+        await runtime.remove_hub('102000022151')
+        owner.commands.put.assert_called_with(('remove', '102000022151'))
+        self.assertIsNone(hub._watched_zone_modes)
+        self.assertIsNone(hub._transition_timer)
+        self.assertTrue(events.closed)
+        self.assertNotIn('102000022151', runtime.hubs)
+
+    async def test_hubs_of_dead_worker_move_to_remaining_worker(self):
+        runtime = ShardedHubs(workers=2)
+        await runtime.start()
+        try:
+            # Nothing listens on this address, so the worker keeps retrying in the background
+            runtime.add_hub('102000022151', ip='127.0.0.1')
+            owner = runtime._owner['102000022151']
+            runtime._shards[owner].process.kill()
+            for _ in range(100):
+                if runtime._owner.get('102000022151') not in (owner, None):
+                    break
+                await asyncio.sleep(0.05)
+            self.assertEqual(runtime._owner['102000022151'], 1 - owner)
+            self.assertEqual(list(runtime._shards), [1 - owner])
+        finally:
+            await runtime.stop()
+
+
+class TestEventStream(unittest.IsolatedAsyncioTestCase):
+
+    async def _receive(self, hub, responses):
+        """Run socket_receive over the given responses, then stop it."""
+        received = asyncio.Event()
+        responses = iter(responses)
+
+        async def get_response():
+            try:
+                return list(next(responses))
+            except StopIteration:
+                received.set()
+                await asyncio.Event().wait()
+
+        hub.get_response = get_response
+        task = asyncio.create_task(hub.socket_receive())
+        await received.wait()
+        task.cancel()
+        await task
+
+    async def test_events_are_delivered_in_order_until_closed(self):
+        hub = _make_loaded_hub()
+        events = hub.events()
+        await self._receive(hub, [
+            ['Y02', '186170024143', '21.0'],
+            ['E00', 'U00', 'Error'],
+            ['V00', '1', 'Living\u00a0room', '1', '23', '16', '1', '-1'],
+            ['V03', '102000022151', 'Our\u00a0hub', '0', '4', '11123610_rev._1', '20180119', '20180119'],
+        ])
+        await hub.stop()
+
+        received = [event async for event in events]
+        self.assertEqual([(event.section, event.key) for event in received],
+                         [('temperatures', '186170024143'), ('zones', '1'), ('hub_info', None)])
+        self.assertEqual(received[1].response[4], '23')
+        self.assertLess(received[0].version, received[1].version)
+        self.assertTrue(events.closed)
+        self.assertEqual(hub._event_streams, [])
+
+    async def test_slow_consumer_does_not_block_receiving(self):
+        hub = _make_loaded_hub()
+        async with hub.events(maxsize=2, overflow='drop_oldest') as events:
+            await self._receive(hub, [['Y02', '186170024143', str(temperature)] for temperature in range(10)])
+            self.assertEqual(hub.temperatures['186170024143'], '9')
+            self.assertEqual(events.dropped, 8)
+            self.assertEqual([(await anext(events)).response[2] for _ in range(2)], ['8', '9'])
+        self.assertEqual(hub._event_streams, [])
+
+    async def test_overflow_policies(self):
+        hub = _make_loaded_hub()
+        newest = hub.events(maxsize=2, overflow='drop_newest')
+        coalesce = hub.events(maxsize=2, overflow='coalesce')
+        for response in [['Y02', '186170024143', '20'], ['Y02', '234001021010', '19'], ['Y02', '186170024143', '21'],
+                         ['V00', '1', 'Living\u00a0room', '1', '23', '16', '1', '-1']]:
+            hub._publish(response)
+
+        self.assertEqual(newest.dropped, 2)
+        self.assertEqual([(await anext(newest)).response[2] for _ in range(2)], ['20', '19'])
+        self.assertEqual((coalesce.coalesced, coalesce.dropped), (1, 1))
+        self.assertEqual([(await anext(coalesce)).response[1:3] for _ in range(2)],
+                         [('186170024143', '21'), ('1', 'Living\u00a0room')])
+        with self.assertRaises(PynoboValidationError):
+            hub.events(overflow='block')
+
+    async def test_coalescing_keeps_changed_fields(self):
+        hub = _make_loaded_hub()
+        events = hub.events(overflow='coalesce')
+        hub._publish(['V00', '1', 'Kitchen', '1', '22', '16', '1', '-1'], changed=frozenset({'name'}))
+        hub._publish(['V00', '1', 'Kitchen', '1', '22', '17', '1', '-1'], changed=frozenset({'temp_eco_c'}))
+        hub._publish(['V00', '2', 'Bedroom', '1', '20', '14', '1', '-1'], changed=frozenset({'temp_eco_c'}))
+        hub._publish(['V00', '2', 'Bedroom', '1', '20', '13', '1', '-1'])
+
+        self.assertEqual(events.coalesced, 2)
+        first, second = await anext(events), await anext(events)
+        self.assertEqual((first.response[5], first.changed), ('17', {'name', 'temp_eco_c'}))
+        self.assertEqual((second.response[5], second.changed), ('13', None))
+
+    async def test_duplicate_updates_are_suppressed(self):
+        hub = _make_loaded_hub()
+        callback = MagicMock()
+        hub.register_callback(callback)
+        version = hub.version
+        async with hub.events() as events:
+            await self._receive(hub, [
+                ['Y02', '186170024143', '21.5'],
+                ['V00', '1', 'Living\u00a0room', '1', '22', '16', '1', '-1'],
+                ['V01', '186170024143', '0', 'Heater', '0', '1', '-1', '-1'],
+                ['V00', '1', 'Living\u00a0room', '1', '22', '17', '1', '-1'],
+                ['S00', '3', 'Unknown', '1', '22', '16', '1', '-1'],
+            ])
+            self.assertEqual(callback.call_count, 1)
+            self.assertEqual(hub.version, version + 1)
+            self.assertEqual(hub.suppressed_updates, {'temperatures': 1, 'zones': 2, 'components': 1})
+            event = await anext(events)
+            self.assertEqual((event.section, event.key, event.changed), ('zones', '1', {'temp_eco_c'}))
+            self.assertEqual(len(events), 0)
+
+    async def test_echo_of_saved_change_is_notified_once(self):
+        hub = _make_loaded_hub()
+        callback = MagicMock()
+        hub.register_callback(callback)
+        hub._save_zone('1', {'temp_comfort_c': '23'})
+        async with hub.events() as events:
+            await self._receive(hub, [['V00', '1', 'Living\u00a0room', '1', '23', '16', '1', '-1']] * 2)
+            self.assertEqual(callback.call_count, 1)
+            self.assertEqual((await anext(events)).changed, {'temp_comfort_c'})
+            self.assertEqual(len(events), 0)
+
+    async def test_temperature_filter(self):
+        hub = _make_loaded_hub(temperature_deadband=0.2)
+        hub.set_temperature_filter('234001021010', deadband=0, min_interval=60)
+        callback = MagicMock()
+        hub.register_callback(callback)
+        async with hub.events() as events:
+            await self._receive(hub, [
+                ['Y02', '186170024143', '21.6'],
+                ['Y02', '186170024143', '21.7'],
+                ['Y02', '186170024143', '21.8'],
+                ['Y02', '234001021010', '19.0'],
+                ['Y02', '234001021010', '25.0'],
+            ])
+            # The latest value is always stored
+            self.assertEqual(hub.temperatures, {'186170024143': '21.8', '234001021010': '25.0'})
+            self.assertEqual(hub.snapshot().temperatures['186170024143'], '21.8')
+            self.assertEqual(callback.call_count, 2)
+            self.assertEqual([(await anext(events)).response[1:] for _ in range(2)],
+                             [('186170024143', '21.7'), ('234001021010', '19.0')])
+            self.assertEqual(hub.suppressed_temperatures, {'186170024143': 2, '234001021010': 1})
+            self.assertEqual(hub.suppressed_updates['temperatures'], 3)
+        with self.assertRaises(PynoboValidationError):
+            hub.set_temperature_filter(None, deadband=-1)
+
+    async def test_held_back_temperature_is_notified_when_the_interval_has_passed(self):
+        hub = _make_loaded_hub(temperature_min_interval=0.05)
+        callback = MagicMock()
+        hub.register_callback(callback)
+        async with hub.events() as events:
+            self.assertEqual(hub.response_handler(['Y02', '186170024143', '21.0']), frozenset())
+            await asyncio.sleep(0.1)
+            self.assertEqual(callback.call_count, 1)
+            event = await anext(events)
+            self.assertEqual((event.response, event.changed), (('Y02', '186170024143', '21.0'), {'temperature'}))
+            self.assertEqual(hub._notified_temperatures['186170024143'][0], 21.0)
+            self.assertEqual(hub._held_temperatures, {})
+
+    def test_repeated_value_notifies_held_back_temperature(self):
+        # No running event loop, so nothing is scheduled and the next update must notify it
+        hub = _make_loaded_hub(temperature_min_interval=0.05)
+        self.assertEqual(hub.response_handler(['Y02', '186170024143', '21.0']), frozenset())
+        self.assertEqual(hub.response_handler(['Y02', '186170024143', '21.0']), frozenset())
+        time.sleep(0.06)
+        self.assertEqual(hub.response_handler(['Y02', '186170024143', '21.0']), {'temperature'})
+        self.assertEqual(hub.response_handler(['Y02', '186170024143', '21.0']), frozenset())
+
+
+async def _simulate_hub(reader, writer):
+    """Minimal hub for MemoryTransport: handshake, initial data, and echo of zone updates."""
+    def send(*responses):
+        for response in responses:
+            writer.write(' '.join(response).encode('utf-8') + b'\r')
+
+    while True:
+        try:
+            command = (await reader.readuntil(b'\r'))[:-1].decode('utf-8').split(' ')
+        except asyncio.IncompleteReadError:
+            return
+        if command[0] == nobo.API.START and command[2] != '102000022151':
+            send([nobo.API.REJECT, '1'])
+        elif command[0] == nobo.API.START:
+            send([nobo.API.START, nobo.API.VERSION])
+        elif command[0] == nobo.API.HANDSHAKE:
+            send([nobo.API.HANDSHAKE])
+        elif command[0] == nobo.API.GET_ALL_INFO:
+            send(*INITIAL_DATA)
+        elif command[0] == nobo.API.UPDATE_ZONE:
+            send([nobo.API.RESPONSE_UPDATE_ZONE, *command[1:]])
+
+
+class TestMemoryTransport(unittest.IsolatedAsyncioTestCase):
+
+    async def test_connect_and_send_commands_without_sockets(self):
+        transport = MemoryTransport()
+        transport.listen('10.0.0.1', _simulate_hub)
+        hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, transport=transport)
+        with patch('asyncio.open_connection') as open_connection:
+            await hub.start()
+        open_connection.assert_not_called()
+        try:
+            self.assertTrue(hub.connected)
+            self.assertEqual(hub.hub_info['name'], 'My\u00a0hub')
+            self.assertEqual(list(hub.zones), ['1', '2'])
+            await hub.async_update_zone('1', temp_comfort_c=23, wait=True)
+            self.assertEqual(hub.zones['1']['temp_comfort_c'], '23')
+        finally:
+            await hub.stop()
+
+    async def test_nothing_listening(self):
+        hub = nobo('102000022151', ip='10.0.0.2', discover=False, synchronous=False, transport=MemoryTransport())
+        with self.assertRaises(PynoboConnectionError):
+            await hub.async_connect_hub('10.0.0.2', '102000022151')
+
+    def test_transport_must_implement_open_connection(self):
+        class Incomplete(Transport):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class TestInitialData(unittest.IsolatedAsyncioTestCase):
+
+    def _slow_hub(self, delay, stall_after=None):
+        async def handle(reader, writer):
+            while True:
+                try:
+                    command = decode_response(await reader.readuntil(b'\r'))
+                except asyncio.IncompleteReadError:
+                    return
+                if command[0] == nobo.API.START:
+                    writer.write(encode_command([nobo.API.START, nobo.API.VERSION]))
+                elif command[0] == nobo.API.HANDSHAKE:
+                    writer.write(encode_command([nobo.API.HANDSHAKE]))
+                elif command[0] == nobo.API.GET_ALL_INFO:
+                    for i, response in enumerate(INITIAL_DATA):
+                        if i == stall_after:
+                            await asyncio.Event().wait()
+                        await asyncio.sleep(delay)
+                        writer.write(encode_command(response))
+        return handle
+
+    async def test_load_continues_while_data_keeps_coming(self):
+        transport = MemoryTransport()
+        transport.listen('10.0.0.1', self._slow_hub(0.02))
+        hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, transport=transport)
+        events = hub.events()
+        with patch('pynobo.INITIAL_DATA_IDLE_TIMEOUT', 0.1):
+            # Takes longer than the idle timeout in total
+            self.assertTrue(await hub.async_connect_hub('10.0.0.1', '102000022151'))
+        await hub.close()
+
+        self.assertEqual(hub.initial_data_progress,
+                         {'H00': 1, 'zones': 2, 'components': 2, 'week_profiles': 1, 'overrides': 1, 'temperatures': 1, 'hub_info': 1})
+        received = [await anext(events) for _ in range(len(events))]
+        self.assertEqual({event.kind for event in received}, {'initial_data'})
+        self.assertEqual([event.key for event in received if event.section == 'zones'], ['1', '2'])
+
+    async def test_stalled_load_times_out(self):
+        transport = MemoryTransport()
+        transport.listen('10.0.0.1', self._slow_hub(0, stall_after=3))
+        hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, transport=transport)
+        with patch('pynobo.INITIAL_DATA_IDLE_TIMEOUT', 0.05):
+            with self.assertRaises(PynoboConnectionError) as context:
+                await hub.async_connect_hub('10.0.0.1', '102000022151')
+        await hub.close()
+        self.assertIn("'zones': 2", str(context.exception))
+        self.assertEqual(hub.initial_data_progress['components'], 0)
+
+
+class TestTcpKeepalive(unittest.IsolatedAsyncioTestCase):
+
+    async def test_keepalive_options_are_set_on_the_hub_socket(self):
+        server = await asyncio.start_server(_simulate_hub, '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+        transport = TcpTransport(keepalive=True, keepalive_idle=4, keepalive_interval=1, keepalive_count=2, user_timeout=3)
+
+        _reader, writer = await transport.open_connection('127.0.0.1', port)
+        try:
+            sock = writer.get_extra_info('socket')
+            self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 4)
+            if hasattr(socket, 'TCP_KEEPCNT'):
+                self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT), 2)
+            if hasattr(socket, 'TCP_USER_TIMEOUT'):
+                self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT), 3000)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        _reader, writer = await TcpTransport().open_connection('127.0.0.1', port)
+        self.assertEqual(writer.get_extra_info('socket').getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 0)
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_timed_out_write_closes_the_connection(self):
+        hub = _make_loaded_hub()
+        writer = hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        writer.drain = AsyncMock(side_effect=TimeoutError(errno.ETIMEDOUT, 'Connection timed out'))
+        writer.wait_closed = AsyncMock()
+        await hub.async_send_command([nobo.API.HANDSHAKE])
+        writer.close.assert_called_once()
+        self.assertIsNone(hub._writer)
+
+        hub._writer = MagicMock(spec=asyncio.StreamWriter)
+        hub._writer.drain = AsyncMock(side_effect=OSError(errno.EINVAL, 'Invalid argument'))
+        with self.assertRaises(OSError):
+            await hub.async_send_command([nobo.API.HANDSHAKE])
+
+
+class TestHubProtocol(unittest.TestCase):
+
+    def test_handshake_and_initial_data(self):
+        protocol = HubProtocol('102000022151')
+        protocol.hello(datetime.datetime(2024, 4, 4, 18, 0, 5))
+        self.assertEqual(protocol.data_to_send(), b'HELLO 1.1 102000022151 20240404180005\r')
+        self.assertEqual(protocol.data_to_send(), b'')
+
+        self.assertEqual(protocol.receive_data(b'HELLO 1.1\r'), [['HELLO', '1.1']])
+        self.assertEqual(protocol.state, HubProtocol.HANDSHAKE)
+        self.assertEqual(protocol.data_to_send(), b'HANDSHAKE\r')
+        protocol.receive_data(b'HANDSHAKE\r')
+        self.assertEqual(protocol.state, HubProtocol.READY)
+
+        protocol.request_initial_data()
+        self.assertEqual(protocol.data_to_send(), b'G00\r')
+        data = b''.join(encode_command(response) for response in INITIAL_DATA)
+        # Responses split over chunks are framed when complete
+        responses = protocol.receive_data(data[:7]) + protocol.receive_data(data[7:-3])
+        self.assertEqual(protocol.state, HubProtocol.INITIAL_DATA)
+        responses += protocol.receive_data(data[-3:])
+        self.assertEqual(responses, INITIAL_DATA)
+        self.assertEqual(protocol.state, HubProtocol.CONNECTED)
+
+    def test_rejected_and_unexpected_responses(self):
+        protocol = HubProtocol('102000022151')
+        protocol.hello()
+        protocol.receive_data(b'REJECT 1\r')
+        self.assertEqual((protocol.state, protocol.reject_code), (HubProtocol.REJECTED, '1'))
+
+        protocol = HubProtocol('102000022151')
+        protocol.hello()
+        protocol.receive_data(b'HELLO 1.1\r')
+        with self.assertRaises(PynoboHandshakeError):
+            protocol.receive_data(b'E00 HANDSHAKE\r')
+
+    def test_encode_and_decode(self):
+        self.assertEqual(encode_command(['U00', 1, 'Living\u00a0room']), 'U00 1 Living\u00a0room\r'.encode('utf-8'))
+        self.assertEqual(decode_response(b'Y02 186170024143 21.5\r'), ['Y02', '186170024143', '21.5'])
+
+
+class _Span:
+    """Span recorded by _Tracer, with the subset of the OpenTelemetry Span API used by pynobo."""
+
+    def __init__(self, tracer, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = parent
+        self.exceptions = []
+        self.ended = False
+        tracer.spans.append(self)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.exceptions.append(exception)
+
+    def end(self):
+        self.ended = True
+
+
+class _Tracer:
+    """Records spans, with the subset of the OpenTelemetry Tracer API used by pynobo."""
+
+    def __init__(self):
+        self.spans = []
+        self._current = contextvars.ContextVar('span', default=None)
+
+    def start_span(self, name, attributes=None):
+        return _Span(self, name, attributes or {}, self._current.get())
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        span = self.start_span(name, attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        finally:
+            self._current.reset(token)
+            span.end()
+
+
+class TestTracing(unittest.IsolatedAsyncioTestCase):
+
+    async def test_connection_phases_and_commands_are_traced(self):
+        transport = MemoryTransport()
+        transport.listen('10.0.0.1', _simulate_hub)
+        tracer = _Tracer()
+        hub = nobo('102000022151', ip='10.0.0.1', discover=False, synchronous=False, transport=transport, tracer=tracer)
+        await hub.start()
+        try:
+            await hub.async_update_zone('1', temp_comfort_c=23, wait=True)
+        finally:
+            await hub.stop()
+
+        self.assertEqual(
+            [(span.name, span.parent.name if span.parent else None) for span in tracer.spans],
+            [
+                ('pynobo.connect', None),
+                ('pynobo.connect_hub', 'pynobo.connect'),
+                ('pynobo.tcp_connect', 'pynobo.connect_hub'),
+                ('pynobo.hello', 'pynobo.connect_hub'),
+                ('pynobo.handshake', 'pynobo.connect_hub'),
+                ('pynobo.initial_data', 'pynobo.connect_hub'),
+                ('pynobo.callbacks', 'pynobo.connect_hub'),
+                ('pynobo.command', None),
+                ('pynobo.send', None),
+            ],
+        )
+        self.assertTrue(all(span.ended for span in tracer.spans))
+        self.assertEqual(tracer.spans[1].attributes, {'nobo.serial': '102000022151', 'nobo.ip': '10.0.0.1'})
+        command, send = tracer.spans[-2:]
+        self.assertEqual(command.attributes['nobo.command'], 'U00')
+        self.assertEqual(command.attributes['nobo.outcome'], 'acknowledged')
+        self.assertEqual(send.attributes['nobo.command'], 'U00')
+
+    async def test_failed_command_is_recorded(self):
+        tracer = _Tracer()
+        hub = _make_loaded_hub(tracer=tracer)
+        hub._writer = MagicMock()
+        hub._writer.drain = AsyncMock()
+        errors = await hub.async_update_zones({'1': {'temp_comfort_c': 23}}, wait=True, timeout=0.01)
+        self.assertIsInstance(errors['1'], PynoboTimeoutError)
+        send, span = tracer.spans
+        self.assertEqual((send.name, span.name, span.parent), ('pynobo.send', 'pynobo.command', send))
+        self.assertEqual(send.attributes['nobo.count'], 1)
+        self.assertEqual(span.attributes['nobo.outcome'], 'PynoboTimeoutError')
+        self.assertIsInstance(span.exceptions[0], PynoboTimeoutError)
+
+
+class TestProbeHubs(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.transport = MemoryTransport()
+        self.transport.listen('10.0.0.5', _simulate_hub)
+
+    async def test_probe_confirms_serial(self):
+        async def not_a_hub(reader, writer):
+            writer.close()
+
+        self.transport.listen('10.0.0.3', not_a_hub)
+        hubs = await nobo.async_probe_hubs('10.0.0.0/29', '102000022151', transport=self.transport)
+        self.assertEqual(hubs, {('10.0.0.5', '102000022151')})
+        hubs = await nobo.async_probe_hubs('10.0.0.0/29', '102000022999', transport=self.transport)
+        self.assertEqual(hubs, set())
+        with self.assertRaises(PynoboValidationError):
+            await nobo.async_probe_hubs('10.0.0.0/29', '151', transport=self.transport)
+
+    async def test_connect_falls_back_to_probing(self):
+        hub = nobo('102000022151', synchronous=False, transport=self.transport, probe_network='10.0.0.0/29')
+        with patch.object(nobo, 'async_discover_hubs', AsyncMock(return_value=set())) as discover:
+            await hub.connect()
+        discover.assert_awaited_once_with(serial='102000022151', ip=None)
+        try:
+            self.assertTrue(hub.connected)
+            self.assertEqual(hub.hub_ip, '10.0.0.5')
+        finally:
+            await hub.stop()
+
+
+class TestZoneModeCache(unittest.TestCase):
+
+    def test_mode_is_cached_until_related_records_change(self):
+        hub = _make_loaded_hub()
+        mode = hub.get_current_zone_mode('1')
+        with patch.object(hub, 'get_zone_override_mode', wraps=hub.get_zone_override_mode) as override_mode:
+            self.assertEqual(hub.get_current_zone_mode('1'), mode)
+            self.assertEqual(hub.get_current_zone_mode('2'), hub.get_current_zone_mode('2'))
+            self.assertEqual(override_mode.call_count, 1)
+
+            # A zone override only invalidates its zone
+            hub.response_handler(['B03', '5', '3', '0', '-1', '-1', '1', '1'])
+            self.assertEqual(hub.get_current_zone_mode('1'), nobo.API.NAME_AWAY)
+            self.assertEqual(hub.get_current_zone_mode('2'), hub.get_current_zone_mode('2'))
+            self.assertEqual(override_mode.call_count, 2)
+
+            hub.response_handler(['S03', '5', '3', '0', '-1', '-1', '1', '1'])
+            self.assertEqual(hub.get_current_zone_mode('1'), mode)
+
+            # Changing the week profile invalidates the zones using it
+            hub.response_handler(['V02', '1', 'Default', ','.join(['00001'] * 7)])
+            self.assertEqual(hub.get_current_zone_mode('1'), nobo.API.NAME_COMFORT)
+            self.assertEqual(hub.get_current_zone_mode('2'), nobo.API.NAME_COMFORT)
+
+    def test_mode_expires_at_next_transition(self):
+        hub = _make_loaded_hub()
+        hub.get_current_zone_mode('1')
+        [(_mode, expires)] = [hub._zone_modes['1']]
+        self.assertGreater(expires, time.time())
+        with patch('time.time', return_value=expires):
+            with patch.object(hub, 'get_week_profile_status', wraps=hub.get_week_profile_status) as status:
+                hub.get_current_zone_mode('1')
+        status.assert_called_once()
+
+    def test_next_week_profile_transition(self):
+        hub = _make_loaded_hub()
+        monday = datetime.datetime(2024, 4, 1)
+        self.assertEqual(hub._next_week_profile_transition('1', monday.replace(hour=7)), monday.replace(hour=8))
+        self.assertEqual(hub._next_week_profile_transition('1', monday.replace(hour=8)), monday.replace(hour=15))
+        self.assertEqual(hub._next_week_profile_transition('1', monday.replace(hour=23, minute=30)),
+                         monday + datetime.timedelta(days=1))
+        saturday = monday + datetime.timedelta(days=5)
+        self.assertEqual(hub._next_week_profile_transition('1', saturday.replace(hour=9)), saturday.replace(hour=23))
+
+
+class TestZoneModeTransitions(unittest.IsolatedAsyncioTestCase):
+
+    async def test_transition_timer_notifies_mode_change(self):
+        hub = _make_loaded_hub()
+        changes = []
+        hub.register_zone_mode_callback(lambda _hub, zone_id, mode: changes.append((zone_id, mode)))
+        events = hub.events()
+        hub._watch_zone_modes()
+        self.addCleanup(hub._unwatch_zone_modes)
+
+        # One timer, at the earliest transition of the zones
+        expires = hub._zone_modes['1'][1]
+        self.assertEqual(hub._transition_at, min(hub._zone_modes['1'][1], hub._zone_modes['2'][1]))
+        self.assertIsNotNone(hub._transition_timer)
+        self.assertEqual(changes, [])
+
+        mode = hub._watched_zone_modes['1']
+        other = nobo.API.NAME_ECO if mode == nobo.API.NAME_COMFORT else nobo.API.NAME_COMFORT
+        with patch('time.time', return_value=expires), patch.object(hub, 'get_week_profile_status', return_value=other):
+            hub._on_transition()
+            self.assertEqual(changes, [('1', other), ('2', other)])
+            self.assertGreater(hub._transition_at, expires)  # Rescheduled to the next transition
+
+        event = await anext(events)
+        self.assertEqual((event.kind, event.section, event.response), ('zone_mode', 'zones', ()))
+
+    async def test_override_notifies_mode_change(self):
+        hub = _make_loaded_hub()
+        changes = []
+        hub.register_zone_mode_callback(lambda _hub, zone_id, mode: changes.append((zone_id, mode)))
+        hub._watch_zone_modes()
+        self.addCleanup(hub._unwatch_zone_modes)
+
+        hub.response_handler(['B03', '5', '3', '0', '-1', '-1', '1', '1'])
+        self.assertEqual(changes, [])
+        await asyncio.sleep(0)
+        self.assertEqual(changes, [('1', nobo.API.NAME_AWAY)])
+
+        hub._unwatch_zone_modes()
+        self.assertIsNone(hub._transition_timer)
+        hub.response_handler(['S03', '5', '3', '0', '-1', '-1', '1', '1'])
+        await asyncio.sleep(0)
+        self.assertEqual(len(changes), 1)
+
+
+class TestOverrideWindows(unittest.IsolatedAsyncioTestCase):
+
+    def _override(self, hub, override_id, start, end, target_type='1', target_id='1', mode='3'):
+        fmt = lambda dt: '-1' if dt is None else dt.strftime('%Y%m%d%H%M')
+        hub.response_handler(['B03', override_id, mode, '2', fmt(end), fmt(start), target_type, target_id])
+
+    async def test_override_applies_within_its_window(self):
+        hub = _make_loaded_hub()
+        now = datetime.datetime.now().replace(second=0, microsecond=0)
+        start, end = now + datetime.timedelta(hours=1), now + datetime.timedelta(hours=2)
+        self._override(hub, '5', start, end)
+        self._override(hub, '6', None, now - datetime.timedelta(minutes=1), mode='1')
+
+        self.assertEqual(hub.get_override_window('5'), (start, end))
+        self.assertEqual(hub.get_zone_override_mode('1'), nobo.API.NAME_NORMAL)
+        self.assertEqual(hub.get_zone_override_mode('1', start), nobo.API.NAME_AWAY)
+        self.assertEqual(hub.get_zone_override_mode('1', end), nobo.API.NAME_NORMAL)
+        self.assertEqual(hub.get_current_zone_mode('1', start + datetime.timedelta(minutes=30)), nobo.API.NAME_AWAY)
+        # The expired override '6' is pruned from the index
+        self.assertEqual(hub._zone_overrides['1'], ['5'])
+
+        # The cached mode expires when the override starts, at the latest
+        hub.get_current_zone_mode('1')
+        self.assertLessEqual(hub._zone_modes['1'][1], start.timestamp())
+
+        hub.response_handler(['S03', '5', '3', '2', '-1', '-1', '1', '1'])
+        self.assertEqual(hub._zone_overrides['1'], [])
+        self.assertEqual(hub.get_zone_override_mode('1', start), nobo.API.NAME_NORMAL)
+
+    async def test_override_start_and_end_are_published(self):
+        hub = _make_loaded_hub()
+        hub._watch_zone_modes()
+        self.addCleanup(hub._unwatch_zone_modes)
+        changes = []
+        # Only zone 1 is overridden, zone 2 may change by its week profile in the meantime
+        hub.register_zone_mode_callback(lambda _hub, zone_id, mode: zone_id == '1' and changes.append((zone_id, mode)))
+        events = hub.events()
+        now = datetime.datetime.now().replace(second=0, microsecond=0)
+        start, end = now + datetime.timedelta(hours=1), now + datetime.timedelta(hours=2)
+        self._override(hub, '5', start, end)
+        await asyncio.sleep(0)
+        self.assertIsNotNone(hub._override_timer)
+
+        with patch('time.time', return_value=start.timestamp()):
+            hub._on_override_time()
+            await asyncio.sleep(0)
+        self.assertEqual(changes, [('1', nobo.API.NAME_AWAY)])
+        with patch('time.time', return_value=end.timestamp()):
+            hub._on_override_time()
+            await asyncio.sleep(0)
+        self.assertEqual(changes[-1][1], hub.get_week_profile_status('1', end))
+        self.assertEqual(hub._zone_overrides['1'], [])
+        self.assertIsNone(hub._override_timer)
+
+        received = [await anext(events) for _ in range(len(events))]
+        self.assertEqual([(event.kind, event.section, event.key) for event in received if event.kind != 'zone_mode'],
+                         [('override_activated', 'overrides', '5'), ('override_expired', 'overrides', '5')])
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_responses_are_journaled_and_replayed(self):
+        journal = Journal(self.directory, fsync=False)
+        hub = _make_loaded_hub(journal=journal)
+        hub.response_handler(['Y02', '186170024143', '20.5'])
+        journal.close()
+
+        records = list(read_journal(self.directory))
+        self.assertEqual(len(records), len(INITIAL_DATA) + 1)
+        self.assertEqual(records[1][1:], ('102000022151', 'H01', ('1', 'Living\u00a0room', '1', '22', '16', '1', '-1')))
+        self.assertEqual(records[-1][1:], ('102000022151', 'Y02', ('186170024143', '20.5')))
+        self.assertIsInstance(records[-1], JournalRecord)
+        self.assertAlmostEqual(records[-1].timestamp, time.time(), delta=60)
+
+    def test_closed_journal_drops_records_without_breaking_the_hub(self):
+        journal = Journal(self.directory, fsync=False)
+        hub = _make_loaded_hub(journal=journal)
+        journal.close()
+        with self.assertLogs('pynobo.journal', 'WARNING'):
+            hub.response_handler(['Y02', '186170024143', '20.5'])
+        hub.response_handler(['Y02', '186170024143', '20.0'])
+        self.assertEqual(hub.temperatures['186170024143'], '20.0')
+        self.assertEqual(journal.dropped, 2)
+        self.assertEqual(len(list(read_journal(self.directory))), len(INITIAL_DATA))
+
+        # A failing journal is logged, the state is still updated
+        hub._journal = MagicMock()
+        hub._journal.append.side_effect = OSError(errno.ENOSPC, 'No space left on device')
+        with self.assertLogs('pynobo', 'ERROR'):
+            hub.response_handler(['Y02', '186170024143', '19.5'])
+        self.assertEqual(hub.temperatures['186170024143'], '19.5')
+
+    def test_rotation_and_torn_tail(self):
+        journal = Journal(self.directory, max_bytes=100, max_files=2, fsync=False)
+        for i in range(10):
+            journal.append('102000022151', ['Y02', '186170024143', str(i)], timestamp=i)
+            journal.flush()
+        journal.close()
+
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(len(files), 2)
+        temperatures = [record.fields[1] for record in read_journal(self.directory)]
+        self.assertEqual(temperatures, [str(i) for i in range(10 - len(temperatures), 10)])
+
+        # A crash while writing leaves an incomplete record, which is skipped
+        with open(os.path.join(self.directory, files[-1]), 'ab') as file:
+            file.write(b'\x20\x00\x00\x00\x01')
+        self.assertEqual([record.fields[1] for record in read_journal(self.directory)], temperatures)
+
+        # A new journal continues after the existing files
+        Journal(self.directory, fsync=False).close()
+        self.assertGreater(sorted(os.listdir(self.directory))[-1], files[-1])
+
+
+class TestSharedState(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = _make_loaded_hub()
+        self.exporter = SharedStateExporter(self.hub, max_components=4, max_zones=4)
+        self.addCleanup(self.exporter.close)
+        self.reader = SharedStateReader(self.exporter.name)
+        self.addCleanup(self.reader.close)
+
+    def test_reads_exported_state(self):
+        self.assertEqual(self.reader.serials, ['186170024143', '234001021010'])
+        self.assertEqual(self.reader.zone_ids, ['1', '2'])
+        self.assertEqual(self.reader.temperature('186170024143'), 21.5)
+        self.assertIsNone(self.reader.temperature('234001021010'))
+        self.assertIsNone(self.reader.temperature('999999999999'))
+        mode = self.hub.get_current_zone_mode('1')
+        setpoint = {nobo.API.NAME_COMFORT: 22.0, nobo.API.NAME_ECO: 16.0}[mode]
+        self.assertEqual(self.reader.zone('1'), (mode, setpoint))
+        self.assertEqual(self.reader.zone('9'), (None, None))
+
+    def test_callbacks_update_table(self):
+        self.hub.response_handler(['B00', '3', 'Kitchen', '1', '21', '17', '1', '-1'])
+        self.hub.response_handler(['Y02', '234001021010', '19.0'])
+        for callback in self.hub._callbacks:
+            callback(self.hub)
+
+        self.assertEqual(self.reader.temperature('234001021010'), 19.0)
+        self.assertEqual(self.reader.zone_ids, ['1', '2', '3'])
+        self.assertIn(self.reader.zone('3')[0], (nobo.API.NAME_COMFORT, nobo.API.NAME_ECO))
+
+    def test_reader_follows_reordered_layout(self):
+        self.hub.response_handler(['Y02', '234001021010', '19.0'])
+        self.exporter.update()
+        self.assertEqual(self.reader.temperature('186170024143'), 21.5)
+
+        # Removing and adding a component again moves it after the other component
+        component = ['186170024143', '0', 'Heater', '0', '1', '-1', '-1']
+        self.hub.response_handler(['S01', *component])
+        self.hub.response_handler(['B01', *component])
+        self.exporter.update()
+        self.assertEqual(self.reader.temperature('186170024143'), 21.5)
+        self.assertEqual(self.reader.temperature('234001021010'), 19.0)
+        self.assertEqual(self.reader.serials, ['234001021010', '186170024143'])
+
+    def test_reader_retries_while_writing(self):
+        self.reader.retries = 10
+        SEQUENCE.pack_into(self.exporter._buf, SEQUENCE_OFFSET, self.exporter._sequence + 1)
+        with self.assertRaisesRegex(PynoboError, 'busy'):
+            self.reader.temperature('186170024143')
+        SEQUENCE.pack_into(self.exporter._buf, SEQUENCE_OFFSET, self.exporter._sequence)
+        self.assertEqual(self.reader.temperature('186170024143'), 21.5)
+
+
 if __name__ == '__main__':
     unittest.main()